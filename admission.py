@@ -0,0 +1,186 @@
+"""Cost-aware admission control in front of the model.
+
+Every request that needs the model gets a cost estimate, the seconds of
+model time it will take, from its text length and a per-language rate
+learned from finished requests. Waiting requests are served shortest job
+first, so one huge prompt no longer holds up a queue of one-liners. A
+waiting request's priority improves with the time it has waited (aging),
+so long jobs still get their turn under steady load.
+
+When the estimated time to get through the work ahead of a new request is
+over the SLO, the request is rejected with a retry hint, or deferred:
+admitted behind everything queued at the time, from where it ages like any
+other request, so deferred requests are delayed but never starved."""
+import contextlib
+import itertools
+import threading
+import time
+
+# upper bounds (estimated seconds) of the job classes reported in metrics
+JOB_CLASSES = (("short", 5.0), ("medium", 30.0), ("long", float("inf")))
+# seconds of model time per character before a language has been measured
+DEFAULT_SECONDS_PER_CHAR = 0.05
+# scripts that pack more speech into a character
+LANGUAGE_FACTORS = {"zh-cn": 3.0, "ja": 3.0, "ko": 2.0}
+# fixed part of every inference
+OVERHEAD_SECONDS = 0.3
+
+
+def job_class(cost):
+    for name, bound in JOB_CLASSES:
+        if cost <= bound:
+            return name
+
+
+class Overloaded(Exception):
+    def __init__(self, retry_after):
+        super().__init__(f"Estimated queue time over the limit, retry in {retry_after:.0f} seconds")
+        self.retry_after = retry_after
+
+
+class CostModel:
+    """Estimates model seconds per request, refined by the measured time of finished requests."""
+
+    def __init__(self, smoothing=0.2):
+        self.smoothing = smoothing
+        # language -> seconds per character
+        self._rates = {}
+        self._lock = threading.Lock()
+
+    def estimate(self, text, language):
+        with self._lock:
+            rate = self._rates.get(language)
+        if rate is None:
+            rate = DEFAULT_SECONDS_PER_CHAR * LANGUAGE_FACTORS.get(language, 1.0)
+        return OVERHEAD_SECONDS + len(text) * rate
+
+    def observe(self, text, language, seconds):
+        if not text:
+            return
+        rate = max(seconds - OVERHEAD_SECONDS, 0.0) / len(text)
+        with self._lock:
+            old = self._rates.get(language)
+            self._rates[language] = rate if old is None else old + self.smoothing * (rate - old)
+
+    def observe_parts(self, parts, seconds):
+        """Spreads the seconds of one job made of (text, language) parts over its languages,
+        in proportion to their estimates."""
+        texts = {}
+        for text, language in parts:
+            texts.setdefault(language, []).append(text)
+        estimates = {language: self.estimate("\n".join(group), language) for language, group in texts.items()}
+        total = sum(estimates.values())
+        for language, group in texts.items():
+            self.observe("\n".join(group), language, seconds * estimates[language] / total)
+
+
+class _Ticket:
+    def __init__(self, seq, cost, deferred):
+        self.seq = seq
+        self.cost = cost
+        self.deferred = deferred
+        self.job_class = job_class(cost)
+        self.enqueued = time.monotonic()
+        # seconds added to a deferred job's cost, the work queued ahead of it when it came
+        self.backlog = 0.0
+
+    def priority(self, now, aging):
+        return (self.cost + self.backlog - aging * (now - self.enqueued), self.seq)
+
+
+class AdmissionQueue:
+    """Hands out `slots` concurrent model turns, shortest (aged) job first.
+
+    slo_seconds=0 admits everything; overload is "reject" or "defer"."""
+
+    def __init__(self, slots=1, slo_seconds=120.0, aging=1.0, overload="reject", metrics=None):
+        if overload not in ("reject", "defer"):
+            raise ValueError(f"overload must be reject or defer, not {overload!r}")
+        self.slots = slots
+        self.slo_seconds = slo_seconds
+        self.aging = aging
+        self.overload = overload
+        self.metrics = metrics
+        self._cond = threading.Condition()
+        self._waiting = []
+        # ticket -> start time of running jobs
+        self._running = {}
+        self._seq = itertools.count()
+        if metrics is not None:
+            for name, _ in JOB_CLASSES:
+                metrics.register(
+                    f"admission_waiting_{name}",
+                    lambda name=name: self.waiting(name),
+                    description=f"Requests of the {name} class waiting for the model",
+                )
+            metrics.register(
+                "admission_drain_seconds", self.drain_seconds, description="Estimated seconds to finish all admitted work"
+            )
+
+    def waiting(self, job_class=None):
+        with self._cond:
+            return sum(1 for ticket in self._waiting if job_class is None or ticket.job_class == job_class)
+
+    def _drain_seconds(self, now, before=None):
+        # estimated seconds until the slots are through the running jobs and the
+        # waiting ones, only those ahead of `before` when given
+        remaining = sum(max(ticket.cost - (now - start), 0.0) for ticket, start in self._running.items())
+        queued = sum(
+            ticket.cost
+            for ticket in self._waiting
+            if before is None or ticket.priority(now, self.aging) < before.priority(now, self.aging)
+        )
+        return (remaining + queued) / self.slots
+
+    def drain_seconds(self):
+        with self._cond:
+            return self._drain_seconds(time.monotonic())
+
+    def _next(self, now):
+        return min(self._waiting, key=lambda ticket: ticket.priority(now, self.aging))
+
+    def acquire(self, cost):
+        """Waits for a model turn for a job of the estimated cost and returns its ticket.
+
+        Raises Overloaded instead when the queue is over the SLO and overload is reject."""
+        with self._cond:
+            ticket = _Ticket(next(self._seq), cost, deferred=False)
+            # short jobs overtake the queue, only the work ahead of this one counts
+            drain = self._drain_seconds(time.monotonic(), before=ticket)
+            if self.slo_seconds and drain > self.slo_seconds:
+                if self.overload == "reject":
+                    self._count(ticket.job_class, "rejected")
+                    raise Overloaded(drain - self.slo_seconds)
+                ticket.deferred = True
+                # behind every job waiting now, it catches up by aging
+                ticket.backlog = self._drain_seconds(time.monotonic())
+            self._count(ticket.job_class, "deferred" if ticket.deferred else "admitted")
+            self._waiting.append(ticket)
+            try:
+                while len(self._running) >= self.slots or self._next(time.monotonic()) is not ticket:
+                    self._cond.wait()
+            finally:
+                self._waiting.remove(ticket)
+                # the next waiter may be able to go, also when this one gave up
+                self._cond.notify_all()
+            started = self._running[ticket] = time.monotonic()
+        if self.metrics is not None:
+            self.metrics.observe(f"admission_wait_{ticket.job_class}", started - ticket.enqueued)
+        return ticket
+
+    def release(self, ticket):
+        with self._cond:
+            del self._running[ticket]
+            self._cond.notify_all()
+
+    @contextlib.contextmanager
+    def turn(self, cost):
+        ticket = self.acquire(cost)
+        try:
+            yield ticket
+        finally:
+            self.release(ticket)
+
+    def _count(self, job_class, result):
+        if self.metrics is not None:
+            self.metrics.inc("admission_total", job_class=job_class, result=result)
@@ -0,0 +1,413 @@
+"""Headless HTTP synthesis API.
+
+A small FastAPI app next to the Gradio UI for machine-to-machine traffic.
+It shares the model and SynthesisPipeline with the UI and returns encoded
+audio directly, or streams it chunk by chunk with stream=true.
+
+    POST /v1/tts     form: text, language (detected when empty), voice (a
+                     voice bank or bundled voice id) or reference (uploaded
+                     audio), stream, cleanup,
+                     format (wav, mp3, opus, flac), bitrate (kbps),
+                     sample_rate
+    POST /v1/dialogue  form: script (JSON turns or "speaker [language]: text"
+                     lines, see dialogue.py), language (of turns without
+                     one), gap (seconds between turns), references
+                     (uploaded audio, the speaker id is the file name
+                     without extension), format, bitrate, sample_rate;
+                     returns JSON with the base64 audio and the timeline
+    GET  /v1/voices  ids accepted as voice and as dialogue speakers
+    GET  /v1/health
+
+At most max_concurrency requests are synthesized at once and max_queue more
+may wait; beyond that requests are rejected with 429 and Retry-After. Model
+work then goes through the admission queue shared with the UI (see
+admission.py), which also answers 429 when its queue is over the SLO.
+
+Run it on its own with the CPU stub model for local testing:
+
+    python api.py --stub --port 8000
+
+tests/test_api.py runs the routes against the stub with FastAPI's TestClient.
+"""
+import argparse
+import asyncio
+import base64
+import io
+import os
+import threading
+import time
+from typing import List
+
+from fastapi import APIRouter, FastAPI, File, Form, HTTPException, UploadFile
+from fastapi.responses import Response, StreamingResponse
+from starlette.concurrency import iterate_in_threadpool, run_in_threadpool
+
+from admission import AdmissionQueue, CostModel, Overloaded
+from audio_encoding import StreamEncoder, content_type, encode_audio, suffix, transcode_wav_file, validate_encoding
+from audio_io import decode_wav, encode_wav, scratch_path
+from dialogue import TURN_GAP, parse_dialogue
+from pipeline import SAMPLE_RATE
+
+MAX_TEXT_CHARS = 200000
+
+
+def bundled_voices(directory="examples"):
+    """Voice ids for the reference clips shipped with the space."""
+    return {
+        os.path.splitext(name)[0]: os.path.join(directory, name)
+        for name in sorted(os.listdir(directory))
+        if name.endswith(".wav")
+    }
+
+
+class ClosingStreamingResponse(StreamingResponse):
+    """Calls on_close once the response is over, however it ended: finished, client gone or
+    never started. Unlike a background task it also runs when sending fails."""
+
+    def __init__(self, content, on_close, **kwargs):
+        super().__init__(content, **kwargs)
+        self.on_close = on_close
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self.on_close()
+
+
+class Backpressure:
+    """Bounds the requests being synthesized and the requests waiting for a turn."""
+
+    def __init__(self, max_concurrency=1, max_queue=8):
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self.limit = max_concurrency + max_queue
+        self.in_flight = 0
+
+    async def acquire(self):
+        if self.in_flight >= self.limit:
+            raise HTTPException(429, "Too many requests, retry later", headers={"Retry-After": "1"})
+        self.in_flight += 1
+        try:
+            await self._semaphore.acquire()
+        except BaseException:
+            # the client went away while waiting
+            self.in_flight -= 1
+            raise
+
+    def release(self):
+        self._semaphore.release()
+        self.in_flight -= 1
+
+
+def create_router(
+    get_pipeline, voices=None, max_concurrency=1, max_queue=8, metrics=None, admission=None, cost_model=None
+):
+    """The /v1 routes; get_pipeline() returns the SynthesisPipeline, or None while the model is loading.
+
+    Pass the UI's admission queue and cost model so both share one queue for the model."""
+    router = APIRouter(prefix="/v1")
+    voices = bundled_voices() if voices is None else voices
+    backpressure = Backpressure(max_concurrency, max_queue)
+    admission = admission or AdmissionQueue(slots=max_concurrency, slo_seconds=0)
+    cost_model = cost_model or CostModel()
+    if metrics is not None:
+        metrics.register("api_in_flight", lambda: backpressure.in_flight, description="API requests synthesizing or waiting")
+
+    def ready_pipeline():
+        pipeline = get_pipeline()
+        if pipeline is None:
+            raise HTTPException(503, "Model is loading", headers={"Retry-After": "10"})
+        return pipeline
+
+    def load_voice(pipeline, text, language, reference, voice_id, cleanup):
+        """Returns the language and what identifies the voice in result cache keys: the voice id,
+        or the decoded (and cleaned) reference. Runs in the thread pool."""
+        if not language:
+            language = pipeline.detect_language(text)
+        if language not in pipeline.languages:
+            raise HTTPException(400, f"Unsupported language {language}")
+        if voice_id is not None:
+            return language, {"voice_id": voice_id}
+        try:
+            reference_audio = pipeline.load_reference(reference)
+            if cleanup:
+                reference_audio = pipeline.cleanup_reference(reference_audio)
+        except Exception as e:
+            raise HTTPException(400, f"Could not use the reference audio: {e}")
+        return language, {"reference_audio": reference_audio}
+
+    def acquire_turn(cost):
+        """The admission ticket of a model job, blocks until it is its turn. Runs in the thread pool."""
+        try:
+            return admission.acquire(cost)
+        except Overloaded as e:
+            raise HTTPException(429, str(e), headers={"Retry-After": str(max(round(e.retry_after), 1))})
+
+    def voice_latents(pipeline, voice_key):
+        if "voice_id" in voice_key:
+            return pipeline.voice_latents(voice_key["voice_id"])
+        try:
+            gpt_cond_latent, speaker_embedding, _, _ = pipeline.speaker_latents(voice_key["reference_audio"])
+        except Exception as e:
+            raise HTTPException(400, f"Could not use the reference audio: {e}")
+        return gpt_cond_latent, speaker_embedding
+
+    def prepare(pipeline, text, language, reference, voice_id, cleanup):
+        """Blocking part of a streamed response, returns the language, the latents and the
+        admission ticket, which the stream releases."""
+        language, voice_key = load_voice(pipeline, text, language, reference, voice_id, cleanup)
+        gpt_cond_latent, speaker_embedding = voice_latents(pipeline, voice_key)
+        return language, gpt_cond_latent, speaker_embedding, acquire_turn(cost_model.estimate(text, language))
+
+    def synthesize(pipeline, text, language, reference, voice_id, cleanup, encoding):
+        language, voice_key = load_voice(pipeline, text, language, reference, voice_id, cleanup)
+        result_key = pipeline.result_key(text, language, **voice_key)
+        cached = pipeline.result_cache.get(result_key) if result_key is not None else None
+        if cached is not None:
+            # a hit needs neither conditioning encoder
+            wav = decode_wav(cached[0])[1]
+        else:
+            gpt_cond_latent, speaker_embedding = voice_latents(pipeline, voice_key)
+            ticket = acquire_turn(cost_model.estimate(text, language))
+            try:
+                pipeline.prepare_text(text, language)
+                t0 = time.perf_counter()
+                wav = pipeline.synthesize(
+                    text,
+                    language,
+                    gpt_cond_latent,
+                    speaker_embedding,
+                    seed=pipeline.result_cache.seed if result_key is not None else None,
+                )
+            finally:
+                admission.release(ticket)
+            cost_model.observe(text, language, time.perf_counter() - t0)
+            if result_key is not None:
+                pipeline.result_cache.put(result_key, encode_wav(wav, SAMPLE_RATE))
+        return encode_audio(wav, SAMPLE_RATE, *encoding)
+
+    def render_dialogue(pipeline, turns, uploads, gap, encoding):
+        references = {**voices, **{speaker: io.BytesIO(data) for speaker, data in uploads.items()}}
+        try:
+            latents = pipeline.prepare_dialogue(turns, references)
+        except ValueError as e:
+            raise HTTPException(400, str(e))
+        ticket = acquire_turn(sum(cost_model.estimate(turn.text, turn.language) for turn in turns))
+        with scratch_path(".wav") as path:
+            try:
+                t0 = time.perf_counter()
+                timeline = pipeline.render_dialogue(turns, latents, path, gap)
+            finally:
+                admission.release(ticket)
+            cost_model.observe_parts([(turn.text, turn.language) for turn in turns], time.perf_counter() - t0)
+            format, bitrate, sample_rate = encoding
+            if format == "wav" and not sample_rate:
+                with open(path, "rb") as f:
+                    return f.read(), timeline
+            with scratch_path(suffix(format)) as encoded_path:
+                transcode_wav_file(path, encoded_path, format, bitrate, sample_rate)
+                with open(encoded_path, "rb") as f:
+                    return f.read(), timeline
+
+    @router.get("/health")
+    def health():
+        return {"ready": get_pipeline() is not None, "in_flight": backpressure.in_flight}
+
+    @router.get("/voices")
+    def list_voices():
+        pipeline = get_pipeline()
+        bank = pipeline.voice_bank.ids() if pipeline is not None and pipeline.voice_bank is not None else []
+        return {"voices": sorted(set(voices) | set(bank))}
+
+    @router.post("/tts")
+    async def tts(
+        text: str = Form(...),
+        language: str = Form(""),
+        voice: str = Form(""),
+        stream: bool = Form(False),
+        cleanup: bool = Form(False),
+        format: str = Form("wav"),
+        bitrate: int = Form(None),
+        sample_rate: int = Form(None),
+        reference: UploadFile = File(None),
+    ):
+        pipeline = ready_pipeline()
+        encoding = (format, bitrate, sample_rate)
+        try:
+            # checks the format options before any work is done
+            validate_encoding(*encoding, sample_rate=SAMPLE_RATE)
+        except ValueError as e:
+            raise HTTPException(400, str(e))
+        encoder = StreamEncoder(format, SAMPLE_RATE, bitrate, sample_rate) if stream else None
+        if not 2 <= len(text) <= MAX_TEXT_CHARS:
+            raise HTTPException(400, f"Text must be between 2 and {MAX_TEXT_CHARS} characters")
+        # voice bank voices win over bundled references of the same name
+        voice_id = voice if reference is None and pipeline.has_voice(voice) else None
+        if reference is None and voice_id is None and voice not in voices:
+            raise HTTPException(400, f"Unknown voice {voice!r}, see /v1/voices or upload a reference")
+        reference_data = await reference.read() if reference is not None else None
+
+        await backpressure.acquire()
+        trace = metrics.start_request(mode="api-stream" if stream else "api", language=language) if metrics else None
+        try:
+            # uploads are decoded from memory
+            source = io.BytesIO(reference_data) if reference_data is not None else voices.get(voice)
+            if stream:
+                prepared = await run_in_threadpool(prepare, pipeline, text, language, source, voice_id, cleanup)
+            else:
+                data = await run_in_threadpool(synthesize, pipeline, text, language, source, voice_id, cleanup, encoding)
+        except BaseException as e:
+            finish(trace, "rejected" if isinstance(e, HTTPException) else "error")
+            raise
+        if not stream:
+            finish(trace, "ok")
+            return Response(data, media_type=content_type(format))
+        # a streamed response keeps its slot until the stream is done, its admission ticket until the model is
+        state = StreamState(trace, prepared[3])
+        return ClosingStreamingResponse(
+            stream_body(pipeline, text, prepared, encoder, state), state.close, media_type=content_type(format)
+        )
+
+    @router.post("/dialogue")
+    async def dialogue(
+        script: str = Form(...),
+        language: str = Form(""),
+        gap: float = Form(TURN_GAP),
+        format: str = Form("wav"),
+        bitrate: int = Form(None),
+        sample_rate: int = Form(None),
+        references: List[UploadFile] = File(None),
+    ):
+        pipeline = ready_pipeline()
+        encoding = (format, bitrate, sample_rate)
+        try:
+            # checks the format options before any work is done
+            validate_encoding(*encoding, sample_rate=SAMPLE_RATE)
+        except ValueError as e:
+            raise HTTPException(400, str(e))
+        if not 2 <= len(script) <= MAX_TEXT_CHARS:
+            raise HTTPException(400, f"Script must be between 2 and {MAX_TEXT_CHARS} characters")
+        if gap < 0:
+            raise HTTPException(400, "The gap between turns cannot be negative")
+        try:
+            turns = parse_dialogue(script, language or None)
+        except ValueError as e:
+            raise HTTPException(400, str(e))
+        uploads = {os.path.splitext(reference.filename)[0]: await reference.read() for reference in references or []}
+
+        await backpressure.acquire()
+        trace = metrics.start_request(mode="api-dialogue", language=turns[0].language) if metrics else None
+        try:
+            data, timeline = await run_in_threadpool(render_dialogue, pipeline, turns, uploads, gap, encoding)
+        except BaseException as e:
+            finish(trace, "rejected" if isinstance(e, HTTPException) else "error")
+            raise
+        finish(trace, "ok")
+        return {"format": format, "audio": base64.b64encode(data).decode(), **timeline}
+
+    def finish(trace, outcome):
+        backpressure.release()
+        if trace is not None:
+            metrics.finish_request(trace, outcome)
+
+    class StreamState:
+        """Stop event and outcome of a streamed response, close() releases its slot once.
+
+        The admission ticket is released as soon as the model is through, by the stream's
+        producer, or by close() if the response ends first."""
+
+        def __init__(self, trace, ticket):
+            self.trace = trace
+            self.ticket = ticket
+            self.stop = threading.Event()
+            self.outcome = "cancelled"
+            self.closed = False
+            self.model_seconds = None
+            self._lock = threading.Lock()
+
+        def release_ticket(self):
+            with self._lock:
+                ticket, self.ticket = self.ticket, None
+            if ticket is not None:
+                admission.release(ticket)
+
+        def model_done(self, seconds):
+            self.model_seconds = seconds
+            self.release_ticket()
+
+        def close(self):
+            # the generator may be running in a worker thread, it is stopped rather than closed
+            self.stop.set()
+            self.release_ticket()
+            if not self.closed:
+                self.closed = True
+                finish(self.trace, self.outcome)
+
+    async def stream_body(pipeline, text, prepared, encoder, state):
+        language, gpt_cond_latent, speaker_embedding, _ = prepared
+        try:
+            await run_in_threadpool(pipeline.prepare_text, text, language, "stream")
+            chunks = pipeline.stream(
+                text, language, gpt_cond_latent, speaker_embedding, stop=state.stop, on_done=state.model_done
+            )
+            async for chunk in iterate_in_threadpool(chunks):
+                data = encoder.encode(chunk)
+                # the encoder may hold back data until it has a full frame
+                if data:
+                    yield data
+            cost_model.observe(text, language, state.model_seconds)
+            yield encoder.close()
+            state.outcome = "ok"
+        except Exception:
+            state.outcome = "error"
+            raise
+        finally:
+            # releases the model when the client went away mid-stream
+            state.close()
+
+    return router
+
+
+def create_app(get_pipeline, **kwargs):
+    app = FastAPI(title="XTTS synthesis API")
+    app.include_router(create_router(get_pipeline, **kwargs))
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the synthesis API on its own")
+    parser.add_argument("--stub", action="store_true", help="use the CPU stub model instead of XTTS")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--max-concurrency", type=int, default=1)
+    parser.add_argument("--max-queue", type=int, default=8)
+    parser.add_argument("--voice-bank", default=None, help="directory built with voice_bank.py")
+    args = parser.parse_args()
+
+    import uvicorn
+
+    from conditioning import SpeakerLatentCache
+    from pipeline import SynthesisPipeline
+
+    if args.stub:
+        from stub_model import StubXtts
+
+        model, languages = StubXtts(), ["en", "es", "fr", "de", "it", "pt", "pl", "tr", "ru", "nl", "cs", "ar", "zh-cn", "hu", "ko", "ja", "hi"]
+    else:
+        from device import select_device
+        from startup import ensure_model, load_model
+
+        model, config = load_model(ensure_model("tts_models/multilingual/multi-dataset/xtts_v2"), select_device())
+        languages = config.languages
+    voice_bank = None
+    if args.voice_bank:
+        from voice_bank import VoiceBank
+
+        voice_bank = VoiceBank(args.voice_bank)
+    pipeline = SynthesisPipeline(model, languages, SpeakerLatentCache(), voice_bank=voice_bank)
+    app = create_app(lambda: pipeline, max_concurrency=args.max_concurrency, max_queue=args.max_queue)
+    uvicorn.run(app, host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,75 +1,204 @@
-import sys
-import io, os, stat
-import subprocess
-import random
-from zipfile import ZipFile
-import uuid
+import os
+import threading
 import time
 import torch
-import torchaudio
 
 
-#download for mecab
-os.system('python -m unidic download')
-
 # By using XTTS you agree to CPML license https://coqui.ai/cpml
 os.environ["COQUI_TOS_AGREED"] = "1"
 
-# langid is used to detect language for longer text
-# Most users expect text to be their own language, there is checkbox to disable it
-import langid
-import base64
-import csv
-from io import StringIO
 import datetime
-import re
 
 import gradio as gr
-from scipy.io.wavfile import write
-from pydub import AudioSegment
-
-from TTS.api import TTS
-from TTS.tts.configs.xtts_config import XttsConfig
-from TTS.tts.models.xtts import Xtts
-from TTS.utils.generic_utils import get_user_data_dir
+from fastapi.responses import PlainTextResponse
+
+from admission import AdmissionQueue, CostModel, Overloaded
+from api import bundled_voices, create_router
+from audio_encoding import FORMATS, encode_audio, suffix, transcode_wav_file, validate_encoding
+from audio_io import decode_wav, encode_wav, scratch_file, scratch_path
+from batching import MicroBatchScheduler
+from compiled import DEFAULT_BUCKETS, compile_model, warmup as compile_warmup
+from conditioning import LOAD_SR, ReferenceAudioError, SpeakerLatentCache
+from demo_examples import examples
+from device import configure_cpu_threads, select_device
+from dialogue import TURN_GAP, parse_dialogue
+from error_reporting import DirectorySink, ErrorReporter, HfDatasetSink, dedup_key
+from metrics import Metrics
+from pipeline import SynthesisPipeline
+from prefix_cache import PrefixKVCache
+from result_cache import ResultCache
+from script_store import SegmentStore
+from startup import Startup, load_model
+from text_frontend import CachedTokenizer
+from voice_bank import VoiceBank
+from waveform_preview import render_preview
+from worker_pool import load_worker_pool
 
 repo_id = "coqui/xtts"
 
-# Use never ffmpeg binary for Ubuntu20 to use denoising for microphone input
-print("Export newer ffmpeg binary for denoise filter")
-ZipFile("ffmpeg.zip").extractall()
-print("Make ffmpeg binary executable")
-st = os.stat("ffmpeg")
-os.chmod("ffmpeg", st.st_mode | stat.S_IEXEC)
-
-# This will trigger downloading model
-print("Downloading if not downloaded Coqui XTTS V2")
-from TTS.utils.manage import ModelManager
-
-model_name = "tts_models/multilingual/multi-dataset/xtts_v2"
-ModelManager().download_model(model_name)
-model_path = os.path.join(get_user_data_dir("tts"), model_name.replace("/", "--"))
-print("XTTS downloaded")
-
-config = XttsConfig()
-config.load_json(os.path.join(model_path, "config.json"))
-
-model = Xtts.init_from_config(config)
-model.load_checkpoint(
-    config,
-    checkpoint_path=os.path.join(model_path, "model.pth"),
-    vocab_path=os.path.join(model_path, "vocab.json"),
-    eval=True,
-    use_deepspeed=True,
-)
-model.cuda()
-
 # This is for debugging purposes only
 DEVICE_ASSERT_DETECTED = 0
 DEVICE_ASSERT_PROMPT = None
 DEVICE_ASSERT_LANG = None
 
-supported_languages = config.languages
+# set when the model has loaded, see on_model_ready
+pipeline = None
+
+# Speaker latents keyed by the decoded reference audio, set LATENT_CACHE_DIR to keep them across restarts
+latent_cache = SpeakerLatentCache(
+    max_bytes=int(os.environ.get("LATENT_CACHE_MB", "256")) * 1024 * 1024,
+    cache_dir=os.environ.get("LATENT_CACHE_DIR"),
+)
+
+# Opt-in cache of synthesized audio, enabled by RESULT_CACHE_MB > 0; sampling then uses a fixed seed
+result_cache = None
+if int(os.environ.get("RESULT_CACHE_MB", "0")) > 0:
+    result_cache = ResultCache(
+        max_bytes=int(os.environ["RESULT_CACHE_MB"]) * 1024 * 1024,
+        cache_dir=os.environ.get("RESULT_CACHE_DIR"),
+        max_disk_bytes=int(os.environ.get("RESULT_CACHE_DISK_MB", "1024")) * 1024 * 1024,
+        seed=int(os.environ.get("RESULT_CACHE_SEED", "0")),
+    )
+
+model_lock = threading.Lock()
+
+# Per-stage timers and counters served on /metrics, set TRACE_FILE to also log one JSON line per request
+metrics = Metrics(trace_path=os.environ.get("TRACE_FILE"))
+
+# Micro-batching of concurrent requests, BATCH_MAX_SIZE=1 (default) runs every request on its own
+batch_max_size = int(os.environ.get("BATCH_MAX_SIZE", "1"))
+
+# Output encoding, the format is chosen per request; OUTPUT_SAMPLE_RATE resamples (default: the model's 24 kHz)
+output_bitrate = int(os.environ.get("OUTPUT_BITRATE_KBPS", "64"))
+output_sample_rate = int(os.environ.get("OUTPUT_SAMPLE_RATE", "0")) or None
+
+# Precomputed speaker latents built with voice_bank.py, selectable by voice id instead of a reference
+voice_bank = VoiceBank(os.environ["VOICE_BANK_DIR"]) if os.environ.get("VOICE_BANK_DIR") else None
+
+# Device-assert reports are spooled to ERROR_SPOOL_DIR and uploaded in the background to the
+# ERROR_REPORT_REPO dataset, or copied to ERROR_REPORT_DIR instead when that is set
+error_reporter = ErrorReporter(
+    os.environ.get("ERROR_SPOOL_DIR", "error_spool"),
+    DirectorySink(os.environ["ERROR_REPORT_DIR"])
+    if os.environ.get("ERROR_REPORT_DIR")
+    else HfDatasetSink(os.environ.get("ERROR_REPORT_REPO", "coqui/xtts-flagged-dataset")),
+    max_spool_bytes=int(os.environ.get("ERROR_SPOOL_MB", "200")) * 1024 * 1024,
+)
+
+# Sentence audio of script mode by content hash, edited scripts only re-render the changed sentences
+script_store = SegmentStore(
+    os.environ.get("SCRIPT_STORE_DIR", "script_store"),
+    max_bytes=int(os.environ.get("SCRIPT_STORE_MB", "2048")) * 1024 * 1024,
+)
+# fixed sampling seed of script mode, stored sentences are only reusable when sampling is repeatable
+script_seed = int(os.environ.get("SCRIPT_SEED", "0"))
+
+# GPT keys/values of each voice's conditioning prefix, reused by every sentence in that voice;
+# opt-in with PREFIX_CACHE_MB > 0, needs the model in this process
+prefix_cache = None
+if int(os.environ.get("PREFIX_CACHE_MB", "0")) > 0:
+    prefix_cache = PrefixKVCache(max_bytes=int(os.environ["PREFIX_CACHE_MB"]) * 1024 * 1024)
+    metrics.register("prefix_cache_hits_total", lambda: prefix_cache.hits, kind="counter", description="Sentences that reused a cached conditioning prefix")
+    metrics.register("prefix_cache_misses_total", lambda: prefix_cache.misses, kind="counter", description="Conditioning prefixes computed")
+
+# Token ids per (language, sentence) kept by the text front-end, TEXT_CACHE_ENTRIES=0 turns the cache off
+text_cache_entries = int(os.environ.get("TEXT_CACHE_ENTRIES", "4096"))
+
+# COMPILE=1 runs the decoder and the GPT (not a DeepSpeed one) through torch.compile, the decoder in COMPILE_BUCKETS latent
+# frame lengths; every bucket is compiled during startup, before the space reports ready (WORKERS=1 only)
+compile_enabled = os.environ.get("COMPILE", "0") == "1"
+compile_buckets = [int(b) for b in os.environ.get("COMPILE_BUCKETS", ",".join(map(str, DEFAULT_BUCKETS))).split(",")]
+
+# CPU worker processes sharing memory-mapped weights, WORKERS=1 (default) keeps the model in this process
+workers = int(os.environ.get("WORKERS", "1"))
+
+# Requests wait for the model shortest estimated job first (aged by ADMISSION_AGING seconds per second waited);
+# past ADMISSION_SLO_SECONDS of estimated queue new requests are rejected, or deferred with ADMISSION_OVERLOAD=defer
+cost_model = CostModel()
+admission = AdmissionQueue(
+    slots=max(batch_max_size, workers),
+    slo_seconds=float(os.environ.get("ADMISSION_SLO_SECONDS", "120")),
+    aging=float(os.environ.get("ADMISSION_AGING", "1.0")),
+    overload=os.environ.get("ADMISSION_OVERLOAD", "reject"),
+    metrics=metrics,
+)
+
+
+def on_model_ready(loaded_model, loaded_config):
+    global pipeline
+    batch_scheduler = None
+    lock = model_lock
+    if workers == 1 and compile_enabled:
+        compile_model(loaded_model, compile_buckets, mode=os.environ.get("COMPILE_MODE") or None)
+    if workers == 1 and text_cache_entries > 0:
+        # pool workers tokenize in their own process and keep their own cache
+        loaded_model.tokenizer = CachedTokenizer(loaded_model.tokenizer, text_cache_entries, metrics)
+    if workers > 1:
+        # the pool admits one request per worker, batching needs the model in this process
+        lock = loaded_model.lock
+    elif batch_max_size > 1:
+        batch_scheduler = MicroBatchScheduler(
+            loaded_model,
+            lock=model_lock,
+            max_batch_size=batch_max_size,
+            max_wait=int(os.environ.get("BATCH_MAX_WAIT_MS", "50")) / 1000,
+        )
+        metrics.register("batch_pending", batch_scheduler.pending, description="Requests waiting to be batched")
+    pipeline = SynthesisPipeline(
+        loaded_model,
+        loaded_config.languages,
+        latent_cache,
+        result_cache=result_cache,
+        batch_scheduler=batch_scheduler,
+        lock=lock,
+        # long-form segments submitted at once, more than one only helps when they can be batched or pooled
+        longform_workers=max(batch_max_size, workers),
+        metrics=metrics,
+        voice_bank=voice_bank,
+        script_store=script_store,
+        prefix_cache=prefix_cache if workers == 1 else None,
+    )
+
+
+def warmup(loaded_model):
+    if workers == 1 and compile_enabled:
+        # micro-batches of any size share the graph compiled for two
+        batch_sizes = (1, 2) if batch_max_size > 1 else (1,)
+        for name, seconds in compile_warmup(loaded_model, batch_sizes=batch_sizes).items():
+            print(f"Compiled {name} in {seconds:.1f} seconds")
+    # fills the latent cache for the bundled voice and pays for the first, slow inference
+    gpt_cond_latent, speaker_embedding, _, _ = pipeline.speaker_latents(pipeline.load_reference("examples/female.wav"))
+    pipeline.synthesize("Hello, this is a warm-up.", "en", gpt_cond_latent, speaker_embedding)
+
+
+# DEVICE=cpu|cuda (default: cuda when available), QUANTIZE_INT8=1 quantizes the model on CPU
+device = select_device()
+if device == "cpu":
+    print("Running on CPU with intra-op/inter-op threads: %d/%d" % configure_cpu_threads())
+
+# Model download and loading run in the background while the UI starts, set WARMUP=1 to also run a first inference
+startup = Startup(
+    "tts_models/multilingual/multi-dataset/xtts_v2",
+    device=device,
+    quantize=os.environ.get("QUANTIZE_INT8", "0") == "1",
+    on_ready=on_model_ready,
+    warmup=warmup if os.environ.get("WARMUP", "0") == "1" or compile_enabled else None,
+    loader=(lambda *args: load_worker_pool(*args, workers=workers)) if workers > 1 else load_model,
+)
+
+
+def empty_outputs():
+    # waveform preview, audio, metrics, reference audio, streamed audio
+    return (None, None, None, None, None)
+
+
+def encode_output(wav, output_format, trace):
+    # encoded once per request and kept in memory, returns the bytes and a metrics line
+    with metrics.stage("encode", trace):
+        data = encode_audio(wav, 24000, output_format, output_bitrate, output_sample_rate)
+    metrics.inc("output_bytes_total", len(data), format=output_format)
+    return data, f"Encoding ({output_format}): {round(trace.stages['encode']*1000)} milliseconds, {len(data) / 1024:.0f} KB\n"
+
 
 def predict(
     prompt,
@@ -80,49 +209,103 @@ def predict(
     voice_cleanup,
     no_lang_auto_detect,
     agree,
+    streaming=False,
+    longform=False,
+    output_format="wav",
+    voice_id=None,
+    script=False,
+    progress=gr.Progress(),
 ):
+    mode = "script" if script else "longform" if longform else "streaming" if streaming else "direct"
+    trace = metrics.start_request(mode=mode, language=language, prompt_chars=len(prompt or ""))
+    # stays "cancelled" when the client goes away mid-request
+    outcome = "cancelled"
+    try:
+        outcome = yield from _predict(
+            prompt,
+            language,
+            audio_file_pth,
+            mic_file_path,
+            use_mic,
+            voice_cleanup,
+            no_lang_auto_detect,
+            agree,
+            streaming,
+            longform,
+            output_format,
+            voice_id,
+            script,
+            progress,
+            trace,
+        )
+    except Exception:
+        outcome = "error"
+        raise
+    finally:
+        metrics.finish_request(trace, outcome)
+
+
+def _predict(
+    prompt,
+    language,
+    audio_file_pth,
+    mic_file_path,
+    use_mic,
+    voice_cleanup,
+    no_lang_auto_detect,
+    agree,
+    streaming,
+    longform,
+    output_format,
+    voice_id,
+    script,
+    progress,
+    trace,
+):
+    """The body of predict, returns the request outcome."""
     if agree == True:
-        if language not in supported_languages:
+        if not startup.is_ready():
+            gr.Warning(startup.status_text())
+            yield empty_outputs()
+            return "not_ready"
+
+        try:
+            # OUTPUT_SAMPLE_RATE may not suit the chosen format, refused before any model work
+            validate_encoding(output_format, output_bitrate, output_sample_rate)
+        except ValueError as e:
+            gr.Warning(str(e))
+            yield empty_outputs()
+            return "rejected"
+
+        if language not in pipeline.languages:
             gr.Warning(
                 f"Language you put {language} in is not in is not in our Supported Languages, please choose from dropdown"
             )
 
-            return (
-                None,
-                None,
-                None,
-                None,
-            )
+            yield empty_outputs()
+            return "rejected"
 
-        language_predicted = langid.classify(prompt)[
-            0
-        ].strip()  # strip need as there is space at end!
-
-        # tts expects chinese as zh-cn
-        if language_predicted == "zh":
-            # we use zh-cn
-            language_predicted = "zh-cn"
+        with metrics.stage("language_detection", trace):
+            language_predicted = pipeline.detect_language(prompt)
 
         print(f"Detected language:{language_predicted}, Chosen language:{language}")
 
-        # After text character length 15 trigger language detection
-        if len(prompt) > 15:
-            # allow any language for short text as some may be common
-            # If user unchecks language autodetection it will not trigger
-            # You may remove this completely for own use
-            if language_predicted != language and not no_lang_auto_detect:
-                # Please duplicate and remove this check if you really want this
-                # Or auto-detector fails to identify language (which it can on pretty short text or mixed text)
-                gr.Warning(
-                    f"It looks like your text isn’t the language you chose , if you’re sure the text is the same language you chose, please check disable language auto-detection checkbox"
-                )
+        # If user unchecks language autodetection it will not trigger
+        # You may remove this completely for own use
+        if not no_lang_auto_detect and pipeline.is_language_mismatch(prompt, language):
+            # Please duplicate and remove this check if you really want this
+            # Or auto-detector fails to identify language (which it can on pretty short text or mixed text)
+            gr.Warning(
+                f"It looks like your text isn’t the language you chose , if you’re sure the text is the same language you chose, please check disable language auto-detection checkbox"
+            )
 
-                return (
-                    None,
-                    None,
-                    None,
-                    None,
-                )
+            yield empty_outputs()
+            return "rejected"
+
+        if voice_id and not pipeline.has_voice(voice_id):
+            gr.Warning(f"Voice {voice_id} is not in the voice bank")
+            yield empty_outputs()
+            return "rejected"
 
         if use_mic == True:
             if mic_file_path is not None:
@@ -131,76 +314,22 @@ def predict(
                 gr.Warning(
                     "Please record your voice with Microphone, or uncheck Use Microphone to use reference audios"
                 )
-                return (
-                    None,
-                    None,
-                    None,
-                    None,
-                )
+                yield empty_outputs()
+                return "rejected"
 
         else:
             speaker_wav = audio_file_pth
 
-        # Filtering for microphone input, as it has BG noise, maybe silence in beginning and end
-        # This is fast filtering not perfect
-
-        # Apply all on demand
-        lowpassfilter = denoise = trim = loudness = True
-
-        if lowpassfilter:
-            lowpass_highpass = "lowpass=8000,highpass=75,"
-        else:
-            lowpass_highpass = ""
-
-        if trim:
-            # better to remove silence in beginning and end for microphone
-            trim_silence = "areverse,silenceremove=start_periods=1:start_silence=0:start_threshold=0.02,areverse,silenceremove=start_periods=1:start_silence=0:start_threshold=0.02,"
-        else:
-            trim_silence = ""
-
-        if voice_cleanup:
-            try:
-                out_filename = (
-                    speaker_wav + str(uuid.uuid4()) + ".wav"
-                )  # ffmpeg to know output format
-
-                # we will use newer ffmpeg as that has afftn denoise filter
-                shell_command = f"./ffmpeg -y -i {speaker_wav} -af {lowpass_highpass}{trim_silence} {out_filename}".split(
-                    " "
-                )
-
-                command_result = subprocess.run(
-                    [item for item in shell_command],
-                    capture_output=False,
-                    text=True,
-                    check=True,
-                )
-                speaker_wav = out_filename
-                print("Filtered microphone input")
-            except subprocess.CalledProcessError:
-                # There was an error - command exited with non-zero code
-                print("Error: failed filtering, use original microphone input")
-        else:
-            speaker_wav = speaker_wav
-
         if len(prompt) < 2:
             gr.Warning("Please give a longer prompt text")
-            return (
-                None,
-                None,
-                None,
-                None,
-            )
+            yield empty_outputs()
+            return "rejected"
         if len(prompt) > 200000:
             gr.Warning(
                 "Text length limited to 200 characters for this demo, please try shorter text. You can clone this space and edit code for your own usage"
             )
-            return (
-                None,
-                None,
-                None,
-                None,
-            )
+            yield empty_outputs()
+            return "rejected"
         global DEVICE_ASSERT_DETECTED
         if DEVICE_ASSERT_DETECTED:
             global DEVICE_ASSERT_PROMPT
@@ -210,94 +339,233 @@ def predict(
                 f"Unrecoverable exception caused by language:{DEVICE_ASSERT_LANG} prompt:{DEVICE_ASSERT_PROMPT}"
             )
         try:
-            metrics_text = ""
-            t_latent = time.time()
+            metrics_text = f"Language detection time: {round(trace.stages['language_detection']*1000)} milliseconds\n"
 
-            # note diffusion_conditioning not used on hifigan (default mode), it will be empty but need to pass it to model.inference
-            try:
-                (
-                    gpt_cond_latent,
-                    speaker_embedding,
-                ) = model.get_conditioning_latents(audio_path=speaker_wav, gpt_cond_len=30, gpt_cond_chunk_len=4, max_ref_length=60)
-            except Exception as e:
-                print("Speaker encoding error", str(e))
-                gr.Warning(
-                    "It appears something wrong with reference, did you unmute your microphone?"
-                )
-                return (
-                    None,
-                    None,
-                    None,
-                    None,
-                )
+            if voice_id:
+                reference_audio = None
+                reference_output = None
+            else:
+                # the result cache key only needs the decoded (and cleaned) reference, latents come after the lookup
+                try:
+                    with metrics.stage("reference_load", trace):
+                        reference_audio = pipeline.load_reference(speaker_wav)
+                    if voice_cleanup:
+                        # Filtering for microphone input, as it has BG noise, maybe silence in beginning and end
+                        # This is fast filtering not perfect
+                        with metrics.stage("cleanup", trace):
+                            reference_audio = pipeline.cleanup_reference(reference_audio)
+                        metrics_text+=f"Reference cleanup time: {round(trace.stages['cleanup']*1000)} milliseconds\n"
+                except ReferenceAudioError as e:
+                    gr.Warning(f"{e}, please upload a shorter reference")
+                    yield empty_outputs()
+                    return "rejected"
+                except Exception as e:
+                    print("Speaker encoding error", str(e))
+                    gr.Warning(
+                        "It appears something wrong with reference, did you unmute your microphone?"
+                    )
+                    yield empty_outputs()
+                    return "reference_error"
+                # show the cleaned reference when cleanup was applied
+                reference_output = (LOAD_SR, reference_audio.squeeze(0).cpu().numpy()) if voice_cleanup else speaker_wav
+
+            result_key = None
+            if not streaming and not longform and not script:
+                result_key = pipeline.result_key(prompt, language, reference_audio, voice_id=voice_id or None)
+            if result_key is not None:
+                with metrics.stage("result_cache_lookup", trace):
+                    cached_result = pipeline.result_cache.get(result_key)
+                metrics.inc("cache_lookups_total", cache="results", result=cached_result[1] if cached_result else "miss")
+                if cached_result is not None:
+                    cached_wav, result_source = cached_result
+                    metrics_text+=f"Served from result cache ({result_source}) in {round(trace.stages['result_cache_lookup']*1000)} milliseconds\n"
+                    wav = decode_wav(cached_wav)[1]
+                    output_audio, encode_text = encode_output(wav, output_format, trace)
+                    metrics_text+=encode_text
+                    with scratch_file(output_audio, suffix=suffix(output_format)) as output_path:
+                        yield (
+                            render_preview(wav),
+                            output_path,
+                            metrics_text,
+                            reference_output,
+                            None,
+                        )
+                    return "cached"
+
+            if voice_id:
+                # precomputed latents, nothing to decode or encode
+                with metrics.stage("voice_bank", trace):
+                    gpt_cond_latent, speaker_embedding = pipeline.voice_latents(voice_id)
+                metrics_text+=f"Voice bank lookup ({voice_id}): {round(trace.stages['voice_bank']*1000)} milliseconds\n"
+            else:
+                # note diffusion_conditioning not used on hifigan (default mode), it will be empty but need to pass it to model.inference
+                try:
+                    with metrics.stage("latents", trace):
+                        (
+                            gpt_cond_latent,
+                            speaker_embedding,
+                            latent_cache_source,
+                            latent_compute_time,
+                        ) = pipeline.speaker_latents(reference_audio)
+                except Exception as e:
+                    print("Speaker encoding error", str(e))
+                    gr.Warning(
+                        "It appears something wrong with reference, did you unmute your microphone?"
+                    )
+                    yield empty_outputs()
+                    return "reference_error"
 
-            latent_calculation_time = time.time() - t_latent
-            # metrics_text=f"Embedding calculation time: {latent_calculation_time:.2f} seconds\n"
-
-            # temporary comma fix
-            prompt= re.sub("([^\x00-\x7F]|\w)(\.|\。|\?)",r"\1 \2\2",prompt)
-
-            wav_chunks = []
-            ## Direct mode
-            
-            print("I: Generating new audio...")
-            t0 = time.time()
-            out = model.inference(
-                prompt,
-                language,
-                gpt_cond_latent,
-                speaker_embedding,
-                repetition_penalty=5.0,
-                temperature=0.75,
-            )
-            inference_time = time.time() - t0
-            print(f"I: Time to generate audio: {round(inference_time*1000)} milliseconds")
+                latent_calculation_time = trace.stages["latents"]
+                metrics.inc("cache_lookups_total", cache="latents", result=latent_cache_source or "miss")
+                if latent_cache_source is not None:
+                    metrics_text+=f"Speaker latents: cache hit ({latent_cache_source}), saved {round(max(latent_compute_time - latent_calculation_time, 0)*1000)} milliseconds\n"
+                else:
+                    metrics_text+=f"Embedding calculation time: {latent_calculation_time:.2f} seconds\n"
+                metrics_text+=f"Speaker latent cache: {pipeline.latent_cache.hits} hits, {pipeline.latent_cache.misses} misses\n"
+
+            script_plan = None
+            if script:
+                ## Script mode: only sentences that are not in the script store yet are rendered
+                with metrics.stage("script_plan", trace):
+                    script_plan = pipeline.plan_script(
+                        prompt, language, pipeline.voice_digest(reference_audio, voice_id or None), seed=script_seed
+                    )
+                metrics_text+=f"Script: {len(script_plan.missing)} of {len(script_plan.segments)} sentences to render\n"
+            # the text that still needs the model
+            model_text = script_plan.missing_text if script_plan is not None else prompt
+
+            # shortest estimated job first among the requests waiting for the model
+            cost = cost_model.estimate(model_text, language)
+            try:
+                ticket = admission.acquire(cost)
+            except Overloaded as e:
+                gr.Warning(f"The server is busy, please retry in {max(round(e.retry_after), 1)} seconds")
+                yield empty_outputs()
+                return "rejected"
+            metrics_text+=f"Queued as a {ticket.job_class} job (estimated {cost:.1f} seconds)\n"
+            release_ticket = True
+            try:
+                # normalization, romanization and tokenization of all sentences, ahead of the model turn
+                with metrics.stage("text_frontend", trace):
+                    pipeline.prepare_text(model_text, language, mode="longform" if longform or script else "stream" if streaming else "direct")
+                metrics_text+=f"Text front-end time: {round(trace.stages['text_frontend']*1000)} milliseconds\n"
+
+                if longform or script:
+                    ## Long-form mode: sentences are rendered by a worker pool and stitched into a file on disk in order
+                    def sentence_progress(done, total):
+                        progress(done / total, desc=f"Sentence {done}/{total}")
+
+                    with scratch_path(".wav") as output_path:
+                        with metrics.stage("inference", trace):
+                            if script_plan is not None:
+                                duration = pipeline.render_script(
+                                    script_plan,
+                                    language,
+                                    gpt_cond_latent,
+                                    speaker_embedding,
+                                    output_path,
+                                    seed=script_seed,
+                                    progress=sentence_progress,
+                                )
+                            else:
+                                duration = pipeline.render_document(
+                                    prompt,
+                                    language,
+                                    gpt_cond_latent,
+                                    speaker_embedding,
+                                    output_path,
+                                    progress=sentence_progress,
+                                )
+                        # the model is through, encoding and handing out the file do not need the ticket
+                        release_ticket = False
+                        admission.release(ticket)
+                        inference_time = trace.stages["inference"]
+                        cost_model.observe(model_text, language, inference_time)
+                        metrics_text+=f"Time to generate audio: {round(inference_time*1000)} milliseconds\n"
+                        metrics_text+=f"Real-time factor (RTF): {inference_time / max(duration, 1e-6):.2f}\n"
+                        with scratch_path(suffix(output_format)) as encoded_path:
+                            if output_format != "wav" or output_sample_rate:
+                                # re-encoded block by block from the stitched file
+                                with metrics.stage("encode", trace):
+                                    transcode_wav_file(output_path, encoded_path, output_format, output_bitrate, output_sample_rate)
+                                encoded_size = os.path.getsize(encoded_path)
+                                metrics.inc("output_bytes_total", encoded_size, format=output_format)
+                                metrics_text+=f"Encoding ({output_format}): {round(trace.stages['encode']*1000)} milliseconds, {encoded_size / 1024:.0f} KB\n"
+                            else:
+                                encoded_path = output_path
+                            yield (
+                                None,
+                                encoded_path,
+                                metrics_text,
+                                reference_output,
+                                None,
+                            )
+                    return "ok"
+
+                if streaming:
+                    ## Streaming mode: synthesize sentence by sentence and send chunks as the vocoder produces them
+                    model_seconds = []
+
+                    def stream_done(seconds):
+                        # the ticket covers the model work, not the client taking the chunks
+                        model_seconds.append(seconds)
+                        admission.release(ticket)
+
+                    wav_chunks = []
+                    t0 = time.perf_counter()
+                    # from here on the stream releases the ticket
+                    release_ticket = False
+                    for chunk in pipeline.stream(prompt, language, gpt_cond_latent, speaker_embedding, on_done=stream_done):
+                        if not wav_chunks:
+                            metrics.record("first_chunk", time.perf_counter() - t0, trace)
+                            metrics_text+=f"Latency to first audio chunk: {round(trace.stages['first_chunk']*1000)} milliseconds\n"
+                        wav_chunks.append(chunk)
+                        yield (
+                            None,
+                            None,
+                            metrics_text,
+                            reference_output,
+                            (24000, chunk.numpy()),
+                        )
+                    # includes the time the client took to take each chunk
+                    metrics.record("inference", time.perf_counter() - t0, trace)
+                    cost_model.observe(prompt, language, model_seconds[0])
+                    wav = torch.cat(wav_chunks, dim=0)
+                else:
+                    ## Direct mode
+                    with metrics.stage("inference", trace):
+                        wav = torch.tensor(
+                            pipeline.synthesize(
+                                prompt,
+                                language,
+                                gpt_cond_latent,
+                                speaker_embedding,
+                                seed=pipeline.result_cache.seed if result_key is not None else None,
+                            )
+                        )
+            finally:
+                if release_ticket:
+                    admission.release(ticket)
+            inference_time = trace.stages["inference"]
+            if not streaming:
+                # streams observe the model seconds, their inference time includes the client taking the chunks
+                cost_model.observe(prompt, language, inference_time)
             metrics_text+=f"Time to generate audio: {round(inference_time*1000)} milliseconds\n"
-            real_time_factor= (time.time() - t0) / out['wav'].shape[-1] * 24000
-            print(f"Real-time factor (RTF): {real_time_factor}")
+            real_time_factor= inference_time / wav.shape[-1] * 24000
             metrics_text+=f"Real-time factor (RTF): {real_time_factor:.2f}\n"
-            torchaudio.save("output.wav", torch.tensor(out["wav"]).unsqueeze(0), 24000)
-
-
-            """
-            print("I: Generating new audio in streaming mode...")
-            t0 = time.time()
-            chunks = model.inference_stream(
-                prompt,
-                language,
-                gpt_cond_latent,
-                speaker_embedding,
-                repetition_penalty=7.0,
-                temperature=0.85,
-            )
+            output_audio, encode_text = encode_output(wav, output_format, trace)
+            metrics_text+=encode_text
+            if result_key is not None:
+                # cached as WAV, any format can be served from it
+                pipeline.result_cache.put(result_key, output_audio if output_format == "wav" and not output_sample_rate else encode_wav(wav, 24000))
 
-            first_chunk = True
-            for i, chunk in enumerate(chunks):
-                if first_chunk:
-                    first_chunk_time = time.time() - t0
-                    metrics_text += f"Latency to first audio chunk: {round(first_chunk_time*1000)} milliseconds\n"
-                    first_chunk = False
-                wav_chunks.append(chunk)
-                print(f"Received chunk {i} of audio length {chunk.shape[-1]}")
-            inference_time = time.time() - t0
-            print(
-                f"I: Time to generate audio: {round(inference_time*1000)} milliseconds"
-            )
-            #metrics_text += (
-            #    f"Time to generate audio: {round(inference_time*1000)} milliseconds\n"
-            #)
-
-            wav = torch.cat(wav_chunks, dim=0)
-            print(wav.shape)
-            real_time_factor = (time.time() - t0) / wav.shape[0] * 24000
-            print(f"Real-time factor (RTF): {real_time_factor}")
-            metrics_text += f"Real-time factor (RTF): {real_time_factor:.2f}\n"
-
-            torchaudio.save("output.wav", wav.squeeze().unsqueeze(0).cpu(), 24000)
-            """
+            with metrics.stage("waveform", trace):
+                waveform_image = render_preview(wav.numpy())
+            metrics_text+=f"Waveform preview time: {round(trace.stages['waveform']*1000)} milliseconds\n"
 
         except RuntimeError as e:
             if "device-side assert" in str(e):
+                metrics.inc("device_asserts_total")
                 # cannot do anything on cuda device side error, need tor estart
                 print(
                     f"Exit due to: Unrecoverable exception caused by language:{language} prompt:{prompt}",
@@ -311,7 +579,7 @@ def predict(
                     DEVICE_ASSERT_LANG = language
 
                 # just before restarting save what caused the issue so we can handle it in future
-                # Uploading Error data only happens for unrecovarable error
+                # Reporting error data only happens for unrecovarable error, in the background
                 error_time = datetime.datetime.now().strftime("%d-%m-%Y-%H:%M:%S")
                 error_data = [
                     error_time,
@@ -327,33 +595,12 @@ def predict(
                 error_data = [str(e) if type(e) != str else e for e in error_data]
                 print(error_data)
                 print(speaker_wav)
-                write_io = StringIO()
-                csv.writer(write_io).writerows([error_data])
-                csv_upload = write_io.getvalue().encode()
-
-                filename = error_time + "_" + str(uuid.uuid4()) + ".csv"
-                print("Writing error csv")
-                error_api = HfApi()
-                error_api.upload_file(
-                    path_or_fileobj=csv_upload,
-                    path_in_repo=filename,
-                    repo_id="coqui/xtts-flagged-dataset",
-                    repo_type="dataset",
+                error_reporter.report(
+                    {"time": error_time, "row": error_data},
+                    files={"reference.wav": speaker_wav} if speaker_wav else None,
+                    key=dedup_key(prompt, language),
                 )
 
-                # speaker_wav
-                print("Writing error reference audio")
-                speaker_filename = (
-                    error_time + "_reference_" + str(uuid.uuid4()) + ".wav"
-                )
-                error_api = HfApi()
-                error_api.upload_file(
-                    path_or_fileobj=speaker_wav,
-                    path_in_repo=speaker_filename,
-                    repo_id="coqui/xtts-flagged-dataset",
-                    repo_type="dataset",
-                )
-                    
             else:
                 if "Failed to decode" in str(e):
                     print("Speaker encoding error", str(e))
@@ -363,28 +610,128 @@ def predict(
                 else:
                     print("RuntimeError: non device-side assert error:", str(e))
                     gr.Warning("Something unexpected happened please retry again.")
-                return (
-                    None,
-                    None,
-                    None,
-                    None,
-                )
-        return (
-            gr.make_waveform(
-                audio="output.wav",
-            ),
-            "output.wav",
-            metrics_text,
-            speaker_wav,
-        )
+            yield empty_outputs()
+            return "device_assert" if "device-side assert" in str(e) else "error"
+        # gradio copies outputs into its own cache, the scratch file is removed once it has
+        with scratch_file(output_audio, suffix=suffix(output_format)) as output_path:
+            yield (
+                waveform_image,
+                output_path,
+                metrics_text,
+                reference_output,
+                None,
+            )
+        return "ok"
     else:
         gr.Warning("Please accept the Terms & Condition!")
-        return (
-            None,
-            None,
-            None,
-            None,
+        yield empty_outputs()
+        return "rejected"
+
+
+def predict_dialogue(
+    script,
+    language,
+    audio_file_pth,
+    mic_file_path,
+    use_mic,
+    gap,
+    output_format,
+    agree,
+    progress=gr.Progress(),
+):
+    trace = metrics.start_request(mode="dialogue", language=language, prompt_chars=len(script or ""))
+    outcome = "cancelled"
+    try:
+        outcome = yield from _predict_dialogue(
+            script, language, mic_file_path if use_mic else audio_file_pth, gap, output_format, agree, progress, trace
         )
+    except Exception:
+        outcome = "error"
+        raise
+    finally:
+        metrics.finish_request(trace, outcome)
+
+
+def _predict_dialogue(script, language, speaker_wav, gap, output_format, agree, progress, trace):
+    """Renders a dialogue script in one request, the speaker "reference" is the reference audio or microphone above."""
+    if agree != True:
+        gr.Warning("Please accept the Terms & Condition!")
+        yield None, None, None
+        return "rejected"
+    if not startup.is_ready():
+        gr.Warning(startup.status_text())
+        yield None, None, None
+        return "not_ready"
+    try:
+        validate_encoding(output_format, output_bitrate, output_sample_rate)
+    except ValueError as e:
+        gr.Warning(str(e))
+        yield None, None, None
+        return "rejected"
+    if len(script or "") > 200000:
+        gr.Warning("Dialogue scripts are limited to 200000 characters")
+        yield None, None, None
+        return "rejected"
+    references = bundled_voices()
+    if speaker_wav is not None:
+        references["reference"] = speaker_wav
+    try:
+        turns = parse_dialogue(script or "", language)
+        # conditioning is computed once per speaker, whatever the number of their turns
+        with metrics.stage("latents", trace):
+            latents = pipeline.prepare_dialogue(turns, references)
+    except ValueError as e:
+        gr.Warning(str(e))
+        yield None, None, None
+        return "rejected"
+    metrics_text = f"Dialogue: {len(turns)} turns, {len(latents)} speakers, latents in {round(trace.stages['latents']*1000)} milliseconds\n"
+
+    cost = sum(cost_model.estimate(turn.text, turn.language) for turn in turns)
+    try:
+        ticket = admission.acquire(cost)
+    except Overloaded as e:
+        gr.Warning(f"The server is busy, please retry in {max(round(e.retry_after), 1)} seconds")
+        yield None, None, None
+        return "rejected"
+    metrics_text+=f"Queued as a {ticket.job_class} job (estimated {cost:.1f} seconds)\n"
+
+    def segment_progress(done, total):
+        progress(done / total, desc=f"Sentence {done}/{total}")
+
+    try:
+        with scratch_path(".wav") as output_path:
+            try:
+                with metrics.stage("inference", trace):
+                    timeline = pipeline.render_dialogue(turns, latents, output_path, gap=gap, progress=segment_progress)
+            finally:
+                admission.release(ticket)
+            inference_time = trace.stages["inference"]
+            # the turns may be in several languages, each calibrates its own rate
+            cost_model.observe_parts([(turn.text, turn.language) for turn in turns], inference_time)
+            metrics_text+=f"Time to generate audio: {round(inference_time*1000)} milliseconds\n"
+            metrics_text+=f"Real-time factor (RTF): {inference_time / max(timeline['duration'], 1e-6):.2f}\n"
+            with scratch_path(suffix(output_format)) as encoded_path:
+                if output_format != "wav" or output_sample_rate:
+                    with metrics.stage("encode", trace):
+                        transcode_wav_file(output_path, encoded_path, output_format, output_bitrate, output_sample_rate)
+                    metrics_text+=f"Encoding ({output_format}): {round(trace.stages['encode']*1000)} milliseconds\n"
+                else:
+                    encoded_path = output_path
+                yield encoded_path, metrics_text, timeline
+    except RuntimeError as e:
+        print("RuntimeError in dialogue:", str(e))
+        gr.Warning("Something unexpected happened please retry again.")
+        yield None, None, None
+        return "error"
+    return "ok"
+
+
+def render_waveform_video(audio):
+    # the video is only rendered on demand, it costs about as much as synthesising a short clip
+    if audio is None:
+        gr.Warning("Please generate audio first")
+        return None
+    return gr.make_waveform(audio=audio)
 
 
 title = "Coqui🐸 XTTS"
@@ -436,158 +783,7 @@ article = """
 <p>We collect data only for error cases for improvement.</p>
 </div>
 """
-examples = [
-    [
-        "Once when I was six years old I saw a magnificent picture",
-        "en",
-        "examples/female.wav",
-        None,
-        False,
-        False,
-        False,
-        True,
-    ],
-    [
-        "Lorsque j'avais six ans j'ai vu, une fois, une magnifique image",
-        "fr",
-        "examples/male.wav",
-        None,
-        False,
-        False,
-        False,
-        True,
-    ],
-    [
-        "Als ich sechs war, sah ich einmal ein wunderbares Bild",
-        "de",
-        "examples/female.wav",
-        None,
-        False,
-        False,
-        False,
-        True,
-    ],
-    [
-        "Cuando tenía seis años, vi una vez una imagen magnífica",
-        "es",
-        "examples/male.wav",
-        None,
-        False,
-        False,
-        False,
-        True,
-    ],
-    [
-        "Quando eu tinha seis anos eu vi, uma vez, uma imagem magnífica",
-        "pt",
-        "examples/female.wav",
-        None,
-        False,
-        False,
-        False,
-        True,
-    ],
-    [
-        "Kiedy miałem sześć lat, zobaczyłem pewnego razu wspaniały obrazek",
-        "pl",
-        "examples/male.wav",
-        None,
-        False,
-        False,
-        False,
-        True,
-    ],
-    [
-        "Un tempo lontano, quando avevo sei anni, vidi un magnifico disegno",
-        "it",
-        "examples/female.wav",
-        None,
-        False,
-        False,
-        False,
-        True,
-    ],
-    [
-        "Bir zamanlar, altı yaşındayken, muhteşem bir resim gördüm",
-        "tr",
-        "examples/female.wav",
-        None,
-        False,
-        False,
-        False,
-        True,
-    ],
-    [
-        "Когда мне было шесть лет, я увидел однажды удивительную картинку",
-        "ru",
-        "examples/female.wav",
-        None,
-        False,
-        False,
-        False,
-        True,
-    ],
-    [
-        "Toen ik een jaar of zes was, zag ik op een keer een prachtige plaat",
-        "nl",
-        "examples/male.wav",
-        None,
-        False,
-        False,
-        False,
-        True,
-    ],
-    [
-        "Když mi bylo šest let, viděl jsem jednou nádherný obrázek",
-        "cs",
-        "examples/female.wav",
-        None,
-        False,
-        False,
-        False,
-        True,
-    ],
-    [
-        "当我还只有六岁的时候， 看到了一副精彩的插画",
-        "zh-cn",
-        "examples/female.wav",
-        None,
-        False,
-        False,
-        False,
-        True,
-    ],
-    [
-        "かつて 六歳のとき、素晴らしい絵を見ました",
-        "ja",
-        "examples/female.wav",
-        None,
-        False,
-        True,
-        False,
-        True,
-    ],
-    [
-        "한번은 내가 여섯 살이었을 때 멋진 그림을 보았습니다.",
-        "ko",
-        "examples/female.wav",
-        None,
-        False,
-        True,
-        False,
-        True,
-    ],
-        [
-        "Egyszer hat éves koromban láttam egy csodálatos képet",
-        "hu",
-        "examples/male.wav",
-        None,
-        False,
-        True,
-        False,
-        True,
-    ],
-]
+
 
 
 
@@ -606,6 +802,7 @@ with gr.Blocks(analytics_enabled=False) as demo:
     with gr.Row():
         with gr.Column():
             gr.Markdown(description)
+            status_gr = gr.Markdown(startup.status_text())
         with gr.Column():
             gr.Markdown(links)
 
@@ -668,6 +865,50 @@ with gr.Blocks(analytics_enabled=False) as demo:
                 value=False,
                 info="Check to disable language auto-detection",
             )
+            stream_gr = gr.Checkbox(
+                label="Streaming mode",
+                value=False,
+                info="Play audio sentence by sentence as soon as it is generated",
+            )
+            longform_gr = gr.Checkbox(
+                label="Long-form mode",
+                value=False,
+                info="For documents: render sentences in parallel and stitch them with short pauses",
+            )
+            format_gr = gr.Dropdown(
+                label="Output format",
+                info="Compressed formats are much smaller to download",
+                choices=list(FORMATS),
+                value="wav",
+            )
+            script_gr = gr.Checkbox(
+                label="Script mode",
+                value=False,
+                info="For scripts you edit and resubmit: only new or changed sentences are rendered again",
+            )
+            voice_gr = gr.Dropdown(
+                label="Voice bank",
+                info="A precomputed voice, used instead of the reference audio",
+                choices=voice_bank.ids() if voice_bank is not None else [],
+                value=None,
+                visible=voice_bank is not None,
+            )
+            with gr.Accordion("Dialogue", open=False):
+                dialogue_gr = gr.Textbox(
+                    label="Dialogue script",
+                    info="One turn per line as speaker [language]: text, or a JSON list of turns. Speakers are voice bank or bundled voices (female, male), or reference for the audio above",
+                    lines=6,
+                    value="female: Welcome back to the show.\nmale: Thanks, it's good to be here.\nfemale [es]: ¡Bienvenido!",
+                )
+                gap_gr = gr.Slider(
+                    label="Gap between turns (seconds)",
+                    minimum=0.0,
+                    maximum=3.0,
+                    step=0.05,
+                    value=TURN_GAP,
+                )
+                dialogue_button = gr.Button("Render dialogue")
+                timeline_gr = gr.JSON(label="Dialogue timeline")
             tos_gr = gr.Checkbox(
                 label="Agree",
                 value=True,
@@ -678,20 +919,46 @@ with gr.Blocks(analytics_enabled=False) as demo:
 
 
         with gr.Column():
-            video_gr = gr.Video(label="Waveform Visual")
+            preview_gr = gr.Image(label="Waveform Preview")
             audio_gr = gr.Audio(label="Synthesised Audio", autoplay=True)
             out_text_gr = gr.Text(label="Metrics")
             ref_audio_gr = gr.Audio(label="Reference Audio Used")
+            video_button = gr.Button("Render Waveform Video")
+            video_gr = gr.Video(label="Waveform Visual")
+            stream_audio_gr = gr.Audio(label="Streamed Audio", streaming=True, autoplay=True)
 
     with gr.Row():
         gr.Examples(examples,
                     label="Examples",
                     inputs=[input_text_gr, language_gr, ref_gr, mic_gr, use_mic_gr, clean_ref_gr, auto_det_lang_gr, tos_gr],
-                    outputs=[video_gr, audio_gr, out_text_gr, ref_audio_gr],
+                    outputs=[preview_gr, audio_gr, out_text_gr, ref_audio_gr, stream_audio_gr],
                     fn=predict,
                     cache_examples=False,)
 
-    tts_button.click(predict, [input_text_gr, language_gr, ref_gr, mic_gr, use_mic_gr, clean_ref_gr, auto_det_lang_gr, tos_gr], outputs=[video_gr, audio_gr, out_text_gr, ref_audio_gr])
-
-demo.queue()  
-demo.launch(debug=True, show_api=True, share=False)
+    tts_button.click(predict, [input_text_gr, language_gr, ref_gr, mic_gr, use_mic_gr, clean_ref_gr, auto_det_lang_gr, tos_gr, stream_gr, longform_gr, format_gr, voice_gr, script_gr], outputs=[preview_gr, audio_gr, out_text_gr, ref_audio_gr, stream_audio_gr])
+    dialogue_button.click(predict_dialogue, [dialogue_gr, language_gr, ref_gr, mic_gr, use_mic_gr, gap_gr, format_gr, tos_gr], outputs=[audio_gr, out_text_gr, timeline_gr])
+    video_button.click(render_waveform_video, [audio_gr], outputs=[video_gr])
+    demo.load(startup.status_text, None, status_gr, every=5)
+
+startup.start()
+
+# outputs are per request, so requests can run concurrently, which micro-batching needs to group them;
+# the admission queue decides which of them gets the model next, so the Gradio queue lets more of them
+# in than there are model slots
+demo.queue(concurrency_count=int(os.environ.get("QUEUE_CONCURRENCY", str(admission.slots + int(os.environ.get("ADMISSION_QUEUE", "16"))))))
+metrics.register("queue_depth", lambda: len(demo._queue.event_queue), description="Requests waiting in the Gradio queue")
+demo.launch(debug=True, show_api=True, share=False, prevent_thread_lock=True)
+# the FastAPI app only exists once launched
+demo.server_app.add_api_route("/metrics", lambda: PlainTextResponse(metrics.render()), methods=["GET"])
+# headless synthesis API on /v1 sharing the model, see api.py; API_CONCURRENCY requests at once, API_QUEUE more may wait
+demo.server_app.include_router(
+    create_router(
+        lambda: pipeline,
+        max_concurrency=int(os.environ.get("API_CONCURRENCY", "1")),
+        max_queue=int(os.environ.get("API_QUEUE", "8")),
+        metrics=metrics,
+        admission=admission,
+        cost_model=cost_model,
+    )
+)
+demo.block_thread()
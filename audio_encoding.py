@@ -0,0 +1,149 @@
+"""Compressed output encoding (MP3, Opus, FLAC) in process.
+
+Waveforms are encoded with torchaudio's StreamWriter (the ffmpeg libraries
+torchaudio links against) straight from the tensor, no temporary files or
+ffmpeg subprocess. StreamEncoder works incrementally: each streamed chunk
+is encoded as it arrives and the bytes the muxer produced so far are
+returned right away, so a stream is never buffered as a whole file.
+
+WAV keeps the existing float32 output for whole files and 16-bit PCM for
+streams, which cannot patch the header sizes afterwards."""
+import wave
+
+import numpy as np
+import torch
+import torchaudio
+
+from audio_io import encode_wav, pcm16, stream_wav_header
+
+# name -> (ffmpeg container, encoder, file suffix, content type)
+FORMATS = {
+    "wav": (None, None, ".wav", "audio/wav"),
+    "mp3": ("mp3", "libmp3lame", ".mp3", "audio/mpeg"),
+    "opus": ("ogg", "libopus", ".ogg", "audio/ogg"),
+    "flac": ("flac", "flac", ".flac", "audio/flac"),
+}
+# the only rates libopus encodes
+OPUS_SAMPLE_RATES = (8000, 12000, 16000, 24000, 48000)
+DEFAULT_BITRATE_KBPS = 64
+# samples read at a time when transcoding a file
+TRANSCODE_BLOCK = 24000 * 10
+
+
+def validate_encoding(format, bitrate_kbps=None, target_sample_rate=None, sample_rate=24000):
+    """Raises ValueError for options no encoder accepts, before any audio is made."""
+    if format not in FORMATS:
+        raise ValueError(f"Unsupported output format {format!r}, choose from {', '.join(FORMATS)}")
+    if bitrate_kbps is not None and bitrate_kbps <= 0:
+        raise ValueError("The bitrate must be positive")
+    if target_sample_rate is not None and target_sample_rate <= 0:
+        raise ValueError("The sample rate must be positive")
+    if format == "opus" and (target_sample_rate or sample_rate) not in OPUS_SAMPLE_RATES:
+        raise ValueError(f"Opus needs one of the sample rates {OPUS_SAMPLE_RATES}")
+
+
+def suffix(format):
+    return FORMATS[format][2]
+
+
+def content_type(format):
+    return FORMATS[format][3]
+
+
+class _Sink:
+    # file-like destination collecting what the muxer writes
+    def __init__(self):
+        self._parts = []
+
+    def write(self, data):
+        self._parts.append(bytes(data))
+        return len(data)
+
+    def take(self):
+        data = b"".join(self._parts)
+        self._parts = []
+        return data
+
+
+class StreamEncoder:
+    """Encodes a mono float waveform chunk by chunk.
+
+    encode(chunk) and close() return the encoded bytes that became
+    available, which may be empty while the encoder fills a frame."""
+
+    def __init__(self, format="wav", sample_rate=24000, bitrate_kbps=None, target_sample_rate=None):
+        validate_encoding(format, bitrate_kbps, target_sample_rate, sample_rate)
+        target_sample_rate = target_sample_rate or sample_rate
+        self.format = format
+        self.sample_rate = sample_rate
+        self.target_sample_rate = target_sample_rate
+        self.bytes_written = 0
+        if format == "wav":
+            self._writer = None
+            self._header = stream_wav_header(target_sample_rate)
+            return
+        from torchaudio.io import CodecConfig, StreamWriter
+
+        container, encoder, _, _ = FORMATS[format]
+        self._sink = _Sink()
+        self._writer = StreamWriter(self._sink, format=container)
+        self._writer.add_audio_stream(
+            sample_rate,
+            1,
+            format="flt",
+            encoder=encoder,
+            # resampling and sample format conversion happen in ffmpeg's filter graph
+            encoder_sample_rate=target_sample_rate,
+            codec_config=CodecConfig(bit_rate=(bitrate_kbps or DEFAULT_BITRATE_KBPS) * 1000) if format != "flac" else None,
+        )
+        self._writer.open()
+
+    def _out(self, data):
+        self.bytes_written += len(data)
+        return data
+
+    def encode(self, chunk):
+        chunk = torch.as_tensor(np.asarray(chunk, dtype=np.float32)).reshape(-1)
+        if self._writer is None:
+            data, self._header = self._header, b""
+            if self.target_sample_rate != self.sample_rate:
+                chunk = torchaudio.functional.resample(chunk, self.sample_rate, self.target_sample_rate)
+            return self._out(data + pcm16(chunk))
+        self._writer.write_audio_chunk(0, chunk.unsqueeze(1))
+        return self._out(self._sink.take())
+
+    def close(self):
+        if self._writer is None:
+            data, self._header = self._header, b""
+            return self._out(data)
+        self._writer.flush()
+        self._writer.close()
+        return self._out(self._sink.take())
+
+
+def encode_audio(wav, sample_rate=24000, format="wav", bitrate_kbps=None, target_sample_rate=None):
+    """The whole waveform encoded in format, as bytes."""
+    if format == "wav":
+        if hasattr(wav, "numpy"):
+            wav = wav.detach().cpu().numpy()
+        wav = np.asarray(wav, dtype=np.float32).reshape(-1)
+        if target_sample_rate and target_sample_rate != sample_rate:
+            wav = torchaudio.functional.resample(torch.from_numpy(wav), sample_rate, target_sample_rate).numpy()
+            sample_rate = target_sample_rate
+        return encode_wav(wav, sample_rate)
+    encoder = StreamEncoder(format, sample_rate, bitrate_kbps, target_sample_rate)
+    if hasattr(wav, "numpy"):
+        wav = wav.detach().cpu().numpy()
+    return encoder.encode(wav) + encoder.close()
+
+
+def transcode_wav_file(src_path, dst_path, format, bitrate_kbps=None, target_sample_rate=None):
+    """Re-encodes a 16-bit WAV file block by block, memory does not grow with its length."""
+    with wave.open(src_path, "rb") as src, open(dst_path, "wb") as dst:
+        encoder = StreamEncoder(format, src.getframerate(), bitrate_kbps, target_sample_rate)
+        while True:
+            frames = src.readframes(TRANSCODE_BLOCK)
+            if not frames:
+                break
+            dst.write(encoder.encode(np.frombuffer(frames, dtype="<i2").astype(np.float32) / 32767))
+        dst.write(encoder.close())
@@ -0,0 +1,73 @@
+"""In-memory encoding of synthesized audio.
+
+Each request encodes its waveform once into bytes. Consumers that can only
+take a path (gradio components) get a unique scratch file that is removed
+as soon as they are done with it, so concurrent requests never share an
+output file."""
+import contextlib
+import io
+import os
+import struct
+import tempfile
+
+import numpy as np
+from scipy.io.wavfile import read, write
+
+SCRATCH_DIR = os.path.join(tempfile.gettempdir(), "xtts-scratch")
+
+
+def encode_wav(wav, sample_rate=24000):
+    # float32 WAV, the same format torchaudio.save wrote for the float output
+    if hasattr(wav, "numpy"):
+        wav = wav.detach().cpu().numpy()
+    buffer = io.BytesIO()
+    write(buffer, sample_rate, np.asarray(wav, dtype=np.float32).reshape(-1))
+    return buffer.getvalue()
+
+
+def pcm16(wav):
+    """Little-endian 16-bit PCM bytes of a float waveform."""
+    if hasattr(wav, "numpy"):
+        wav = wav.detach().cpu().numpy()
+    return (np.clip(np.asarray(wav, dtype=np.float32).reshape(-1), -1.0, 1.0) * 32767).astype("<i2").tobytes()
+
+
+def stream_wav_header(sample_rate=24000):
+    # 16-bit mono WAV header for a stream of unknown length, sizes are left at their maximum
+    data_size = 0xFFFFFFFF - 36
+    return (
+        b"RIFF"
+        + struct.pack("<I", data_size + 36)
+        + b"WAVEfmt "
+        + struct.pack("<IHHIIHH", 16, 1, 1, sample_rate, sample_rate * 2, 2, 16)
+        + b"data"
+        + struct.pack("<I", data_size)
+    )
+
+
+def decode_wav(data):
+    sample_rate, wav = read(io.BytesIO(data))
+    return sample_rate, wav
+
+
+@contextlib.contextmanager
+def scratch_path(suffix=".wav"):
+    # a unique, empty file that is removed when the block exits
+    os.makedirs(SCRATCH_DIR, exist_ok=True)
+    fd, path = tempfile.mkstemp(prefix="output-", suffix=suffix, dir=SCRATCH_DIR)
+    os.close(fd)
+    try:
+        yield path
+    finally:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+@contextlib.contextmanager
+def scratch_file(data, suffix=".wav"):
+    with scratch_path(suffix) as path:
+        with open(path, "wb") as f:
+            f.write(data)
+        yield path
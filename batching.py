@@ -0,0 +1,217 @@
+"""Dynamic micro-batching for XTTS inference.
+
+Concurrent requests that arrive within a short window are grouped by
+language, sampling parameters and text length bucket and run as one padded
+batch through the GPT and the HiFiGAN decoder, then scattered back to their
+callers."""
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import torch
+import torch.nn.functional as F
+
+# upper bounds (in characters) of the text length buckets
+LENGTH_BUCKETS = (40, 80, 160, 320)
+
+
+def length_bucket(text):
+    for i, bound in enumerate(LENGTH_BUCKETS):
+        if len(text) <= bound:
+            return i
+    return len(LENGTH_BUCKETS)
+
+
+@torch.inference_mode()
+def batched_inference(
+    model,
+    texts,
+    language,
+    gpt_cond_latents,
+    speaker_embeddings,
+    temperature=0.75,
+    length_penalty=1.0,
+    repetition_penalty=5.0,
+    top_k=50,
+    top_p=0.85,
+):
+    """Xtts.inference for several texts of one language at once.
+
+    The conditioning prefixes (speaker latent + text embedding) are left
+    padded and masked out, which is exact for XTTS since its GPT has no
+    positional embedding of its own. Returns one float waveform per text."""
+    gpt = model.gpt
+    device = model.device
+    language = language.split("-")[0]  # remove the country code
+
+    text_tokens = []
+    prefixes = []
+    for text, cond_latent in zip(texts, gpt_cond_latents):
+        tokens = torch.IntTensor(model.tokenizer.encode(text.strip().lower(), lang=language)).unsqueeze(0).to(device)
+        assert (
+            tokens.shape[-1] < model.args.gpt_max_text_tokens
+        ), " ❗ XTTS can only generate text with a maximum of 400 tokens."
+        text_tokens.append(tokens)
+        # same as GPT.compute_embeddings, one item at a time
+        padded = F.pad(tokens, (0, 1), value=gpt.stop_text_token)
+        padded = F.pad(padded, (1, 0), value=gpt.start_text_token)
+        emb = gpt.text_embedding(padded) + gpt.text_pos_embedding(padded)
+        prefixes.append(torch.cat([cond_latent.to(device), emb], dim=1))
+
+    batch_size = len(prefixes)
+    prefix_len = max(prefix.shape[1] for prefix in prefixes)
+    prefix_emb = prefixes[0].new_zeros(batch_size, prefix_len, prefixes[0].shape[-1])
+    # +1 for the start_audio_token
+    attention_mask = torch.zeros(batch_size, prefix_len + 1, dtype=torch.long, device=device)
+    for i, prefix in enumerate(prefixes):
+        prefix_emb[i, prefix_len - prefix.shape[1] :] = prefix[0]
+        attention_mask[i, prefix_len - prefix.shape[1] :] = 1
+    gpt.gpt_inference.store_prefix_emb(prefix_emb)
+    gpt_inputs = torch.full((batch_size, prefix_len + 1), fill_value=1, dtype=torch.long, device=device)
+    gpt_inputs[:, -1] = gpt.start_audio_token
+
+    codes = gpt.gpt_inference.generate(
+        gpt_inputs,
+        attention_mask=attention_mask,
+        bos_token_id=gpt.start_audio_token,
+        pad_token_id=gpt.stop_audio_token,
+        eos_token_id=gpt.stop_audio_token,
+        max_length=gpt.max_gen_mel_tokens + gpt_inputs.shape[-1],
+        do_sample=True,
+        top_p=top_p,
+        top_k=top_k,
+        temperature=temperature,
+        num_return_sequences=1,
+        num_beams=1,
+        length_penalty=length_penalty,
+        repetition_penalty=repetition_penalty,
+        output_attentions=False,
+    )[:, gpt_inputs.shape[1] :]
+
+    gpt_latents_list = []
+    for i, tokens in enumerate(text_tokens):
+        row = codes[i]
+        stops = (row == gpt.stop_audio_token).nonzero()
+        # keep the first stop token, like a batch-of-one generate does
+        length = stops[0].item() + 1 if len(stops) else row.shape[0]
+        gpt_codes = row[:length].unsqueeze(0)
+        expected_output_len = torch.tensor([gpt_codes.shape[-1] * gpt.code_stride_len], device=device)
+        text_len = torch.tensor([tokens.shape[-1]], device=device)
+        gpt_latents_list.append(
+            gpt(
+                tokens,
+                text_len,
+                gpt_codes,
+                expected_output_len,
+                cond_latents=gpt_cond_latents[i].to(device),
+                return_attentions=False,
+                return_latent=True,
+            )
+        )
+
+    # one vocoder pass over the zero padded latents, cropped back per item
+    max_frames = max(item_latents.shape[1] for item_latents in gpt_latents_list)
+    latents = torch.cat(
+        [F.pad(item_latents, (0, 0, 0, max_frames - item_latents.shape[1])) for item_latents in gpt_latents_list]
+    )
+    g = torch.cat([embedding.to(device) for embedding in speaker_embeddings])
+    wavs = model.hifigan_decoder(latents, g=g).cpu()
+    samples_per_frame = wavs.shape[-1] // max_frames
+    return [
+        wavs[i].reshape(-1)[: item_latents.shape[1] * samples_per_frame].numpy()
+        for i, item_latents in enumerate(gpt_latents_list)
+    ]
+
+
+class _Request:
+    def __init__(self, text, gpt_cond_latent, speaker_embedding):
+        self.text = text
+        self.gpt_cond_latent = gpt_cond_latent
+        self.speaker_embedding = speaker_embedding
+        self.arrival = time.monotonic()
+        self.future = Future()
+
+
+class MicroBatchScheduler:
+    """Collects requests for up to max_wait seconds and runs each group of up
+    to max_batch_size requests as one batch on a single worker thread.
+
+    A group is dispatched as soon as it is full or its oldest request has
+    waited max_wait, so no request waits longer than max_wait plus the time
+    of the batch running ahead of it."""
+
+    def __init__(self, model, max_batch_size=8, max_wait=0.05, lock=None):
+        self.model = model
+        # shared with callers that use the model outside the scheduler
+        self.lock = lock or threading.Lock()
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.batches = 0
+        self.batched_requests = 0
+        self._incoming = queue.Queue()
+        self._pending = {}
+        self._worker = threading.Thread(target=self._run, name="micro-batcher", daemon=True)
+        self._worker.start()
+
+    def submit(self, text, language, gpt_cond_latent, speaker_embedding, temperature=0.75, repetition_penalty=5.0):
+        """Blocks until the request's batch has run and returns its waveform."""
+        request = _Request(text, gpt_cond_latent, speaker_embedding)
+        key = (language, temperature, repetition_penalty, length_bucket(text))
+        self._incoming.put((key, request))
+        return request.future.result()
+
+    def pending(self):
+        """Requests submitted and not yet dispatched in a batch."""
+        return self._incoming.qsize() + sum(len(requests) for requests in list(self._pending.values()))
+
+    def _next_due(self):
+        # the full group, else the group whose oldest request has waited longest
+        oldest_key = None
+        for key, requests in self._pending.items():
+            if len(requests) >= self.max_batch_size:
+                return key, 0
+            if oldest_key is None or requests[0].arrival < self._pending[oldest_key][0].arrival:
+                oldest_key = key
+        if oldest_key is None:
+            return None, None
+        return oldest_key, self._pending[oldest_key][0].arrival + self.max_wait - time.monotonic()
+
+    def _run(self):
+        while True:
+            key, wait = self._next_due()
+            if key is None or wait > 0:
+                try:
+                    new_key, request = self._incoming.get(timeout=wait)
+                except queue.Empty:
+                    pass
+                else:
+                    self._pending.setdefault(new_key, []).append(request)
+                continue
+            requests = self._pending[key][: self.max_batch_size]
+            self._pending[key] = self._pending[key][self.max_batch_size :]
+            if not self._pending[key]:
+                del self._pending[key]
+            self._run_batch(key, requests)
+
+    def _run_batch(self, key, requests):
+        language, temperature, repetition_penalty, _ = key
+        self.batches += 1
+        self.batched_requests += len(requests)
+        try:
+            with self.lock:
+                wavs = batched_inference(
+                    self.model,
+                    [request.text for request in requests],
+                    language,
+                    [request.gpt_cond_latent for request in requests],
+                    [request.speaker_embedding for request in requests],
+                    temperature=temperature,
+                    repetition_penalty=repetition_penalty,
+                )
+        except Exception as e:
+            for request in requests:
+                request.future.set_exception(e)
+            return
+        for request, wav in zip(requests, wavs):
+            request.future.set_result(wav)
@@ -0,0 +1,95 @@
+"""Compares the in-process reference cleanup with the ffmpeg filter chain it
+replaces, for speed and output difference. ffmpeg writes 16 bit PCM, so
+an exact match shows up as about 79 dB SNR.
+
+    python benchmarks/bench_cleanup.py [--ffmpeg ./ffmpeg] [--repeat 5] [wav ...]
+"""
+import argparse
+import glob
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import torch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from audio_cleanup import cleanup_reference_audio  # noqa: E402
+from conditioning import LOAD_SR, load_reference_audio  # noqa: E402
+
+FFMPEG_FILTER = (
+    "lowpass=8000,highpass=75,"
+    "areverse,silenceremove=start_periods=1:start_silence=0:start_threshold=0.02,"
+    "areverse,silenceremove=start_periods=1:start_silence=0:start_threshold=0.02"
+)
+
+
+def run_ffmpeg(ffmpeg, path, out_dir):
+    out_filename = os.path.join(out_dir, os.path.basename(path) + ".filtered.wav")
+    subprocess.run(
+        [ffmpeg, "-y", "-loglevel", "error", "-i", path, "-af", FFMPEG_FILTER, out_filename],
+        check=True,
+    )
+    # the old path then decoded the filtered file again for conditioning
+    return load_reference_audio(out_filename)
+
+
+def run_in_process(path):
+    return cleanup_reference_audio(load_reference_audio(path), LOAD_SR)
+
+
+def timed(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - t0)
+    return result, statistics.median(times)
+
+
+def compare(reference, candidate):
+    length_difference = abs(reference.shape[-1] - candidate.shape[-1])
+    length = min(reference.shape[-1], candidate.shape[-1])
+    reference, candidate = reference[..., :length], candidate[..., :length]
+    noise = (reference - candidate).pow(2).sum()
+    signal = reference.pow(2).sum()
+    return {
+        "length_difference_ms": round(length_difference / LOAD_SR * 1000, 2),
+        "snr_db": round(float(10 * torch.log10(signal / noise.clamp(min=1e-12))), 2),
+        "max_abs_difference": round(float((reference - candidate).abs().max()), 4),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("wavs", nargs="*")
+    parser.add_argument("--ffmpeg", default=None, help="ffmpeg binary, defaults to ./ffmpeg or the one on PATH")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    wavs = args.wavs or sorted(glob.glob("examples/*.wav"))
+    ffmpeg = args.ffmpeg or ("./ffmpeg" if os.path.exists("./ffmpeg") else shutil.which("ffmpeg"))
+
+    results = []
+    with tempfile.TemporaryDirectory() as out_dir:
+        for path in wavs:
+            cleaned, in_process_time = timed(lambda: run_in_process(path), args.repeat)
+            result = {"file": path, "in_process_ms": round(in_process_time * 1000, 2)}
+            if ffmpeg:
+                filtered, ffmpeg_time = timed(lambda: run_ffmpeg(ffmpeg, path, out_dir), args.repeat)
+                result["ffmpeg_ms"] = round(ffmpeg_time * 1000, 2)
+                result["saved_ms"] = round((ffmpeg_time - in_process_time) * 1000, 2)
+                result.update(compare(filtered, cleaned))
+            results.append(result)
+    if not ffmpeg:
+        print("ffmpeg not found, only the in-process timings are reported", file=sys.stderr)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
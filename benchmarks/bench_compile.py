@@ -0,0 +1,85 @@
+"""CPU real-time factor of eager vs compiled (torch.compile, shape bucketed) XTTS.
+
+Runs the same seeded sentences through the eager model and through the
+compiled one after its warm-up, and reports both RTFs side by side with
+the time the warm-up took to compile.
+
+    python benchmarks/bench_compile.py [--threads N] [--repeat 3] [--buckets 64,128,256,512,1024]
+        [--mode max-autotune]
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+import torch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from compiled import DEFAULT_BUCKETS, compile_model, warmup  # noqa: E402
+from conditioning import LOAD_SR, compute_conditioning_latents, load_reference_audio  # noqa: E402
+from device import configure_cpu_threads  # noqa: E402
+from startup import ensure_model, load_model  # noqa: E402
+
+MODEL_NAME = "tts_models/multilingual/multi-dataset/xtts_v2"
+CASES = [
+    ("Hello there, how are you?", "en", "examples/female.wav"),
+    ("Once when I was six years old I saw a magnificent picture in a book about the primeval forest.", "en", "examples/male.wav"),
+    ("Lorsque j'avais six ans j'ai vu, une fois, une magnifique image", "fr", "examples/male.wav"),
+    ("Als ich sechs war, sah ich einmal ein wunderbares Bild", "de", "examples/female.wav"),
+]
+
+
+def run_cases(model, repeat):
+    cases = []
+    for text, language, wav_path in CASES:
+        gpt_cond_latent, speaker_embedding = compute_conditioning_latents(model, load_reference_audio(wav_path), LOAD_SR)
+        rtfs = []
+        for i in range(repeat):
+            torch.manual_seed(i)
+            t0 = time.perf_counter()
+            out = model.inference(text, language, gpt_cond_latent, speaker_embedding, repetition_penalty=5.0, temperature=0.75)
+            rtfs.append((time.perf_counter() - t0) / out["wav"].shape[-1] * 24000)
+        cases.append({"text": text[:40], "language": language, "voice": wav_path, "rtf": round(statistics.median(rtfs), 3)})
+    return cases
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--threads", type=int, default=None)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--buckets", default=",".join(map(str, DEFAULT_BUCKETS)), help="decoder latent frame buckets")
+    parser.add_argument("--mode", default=None, help="torch.compile mode, e.g. max-autotune")
+    args = parser.parse_args()
+
+    threads = configure_cpu_threads(intra_op=args.threads)
+    model, _ = load_model(ensure_model(MODEL_NAME), device="cpu")
+    eager = run_cases(model, args.repeat)
+
+    compile_model(model, [int(b) for b in args.buckets.split(",")], mode=args.mode)
+    t0 = time.perf_counter()
+    warmup_timings = warmup(model)
+    warmup_seconds = time.perf_counter() - t0
+    compiled = run_cases(model, args.repeat)
+
+    report = {
+        "threads": threads[0],
+        "buckets": args.buckets,
+        "mode": args.mode or "default",
+        "warmup_seconds": round(warmup_seconds, 1),
+        "warmup": {name: round(seconds, 2) for name, seconds in warmup_timings.items()},
+        "cases": [
+            {**{k: v for k, v in e.items() if k != "rtf"}, "eager_rtf": e["rtf"], "compiled_rtf": c["rtf"]}
+            for e, c in zip(eager, compiled)
+        ],
+        "eager_rtf": round(statistics.median(case["rtf"] for case in eager), 3),
+        "compiled_rtf": round(statistics.median(case["rtf"] for case in compiled), 3),
+    }
+    report["speedup"] = round(report["eager_rtf"] / report["compiled_rtf"], 2)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
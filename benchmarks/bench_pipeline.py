@@ -0,0 +1,191 @@
+"""Offline benchmark of the predict pipeline stages.
+
+Replays the demo examples plus synthetic short and long prompts through
+language detection, reference cleanup, speaker latents, inference, saving
+and waveform preview, and reports per-stage p50/p95, RTF and first-chunk
+latency as JSON. Runs on CPU with the stub model by default.
+
+    python benchmarks/bench_pipeline.py [--model stub|xtts|module:factory] [--repeat 5]
+        [--output report.json] [--save-baseline baseline.json] [--baseline baseline.json]
+
+With --baseline, metrics slower than the baseline by more than --tolerance
+are listed under "regressions" and the command exits with status 1.
+"""
+import argparse
+import importlib
+import json
+import math
+import os
+import sys
+import time
+
+import torch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from audio_io import encode_wav  # noqa: E402
+from conditioning import SpeakerLatentCache  # noqa: E402
+from demo_examples import examples  # noqa: E402
+from pipeline import SAMPLE_RATE, SynthesisPipeline  # noqa: E402
+from waveform_preview import render_preview  # noqa: E402
+
+STAGES = ("language_detection", "cleanup", "latents", "inference", "save", "waveform")
+LANGUAGES = ["en", "es", "fr", "de", "it", "pt", "pl", "tr", "ru", "nl", "cs", "ar", "zh-cn", "hu", "ko", "ja", "hi"]
+LONG_PROMPT = " ".join(
+    [
+        "Once when I was six years old I saw a magnificent picture in a book about the primeval forest.",
+        "It was a picture of a boa constrictor in the act of swallowing an animal.",
+        "In the book it said that boa constrictors swallow their prey whole, without chewing it.",
+    ]
+    * 3
+)
+# ignore differences below this when looking for regressions
+MIN_REGRESSION_MS = 1.0
+
+
+def load_model(spec):
+    if spec == "stub":
+        from stub_model import StubXtts
+
+        return StubXtts(), LANGUAGES
+    if spec == "xtts":
+        from startup import ensure_model, load_model as load_xtts
+        from device import select_device
+
+        model, config = load_xtts(ensure_model("tts_models/multilingual/multi-dataset/xtts_v2"), select_device())
+        return model, config.languages
+    # module:factory returning a model object
+    module_name, factory = spec.split(":")
+    return getattr(importlib.import_module(module_name), factory)(), LANGUAGES
+
+
+def build_cases():
+    cases = [
+        {"name": f"example-{language}", "prompt": prompt, "language": language, "voice": voice, "cleanup": cleanup}
+        for prompt, language, voice, _, _, cleanup, _, _ in examples
+    ]
+    cases.append({"name": "synthetic-short", "prompt": "Hello there.", "language": "en", "voice": "examples/female.wav", "cleanup": False})
+    cases.append({"name": "synthetic-long", "prompt": LONG_PROMPT, "language": "en", "voice": "examples/male.wav", "cleanup": True})
+    return cases
+
+
+def percentile(values, p):
+    # nearest rank
+    values = sorted(values)
+    return values[max(0, math.ceil(p / 100 * len(values)) - 1)]
+
+
+def summarize(values):
+    return {
+        "p50": round(percentile(values, 50), 3),
+        "p95": round(percentile(values, 95), 3),
+        "count": len(values),
+    }
+
+
+def timed(fn, *args, **kwargs):
+    t0 = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, (time.perf_counter() - t0) * 1000
+
+
+def run_case(pipeline, case, samples, stream):
+    _, ms = timed(pipeline.detect_language, case["prompt"])
+    samples["language_detection"].append(ms)
+
+    reference_audio = pipeline.load_reference(case["voice"])
+    if case["cleanup"]:
+        reference_audio, ms = timed(pipeline.cleanup_reference, reference_audio)
+        samples["cleanup"].append(ms)
+
+    (gpt_cond_latent, speaker_embedding, _, _), ms = timed(pipeline.speaker_latents, reference_audio)
+    samples["latents"].append(ms)
+
+    torch.manual_seed(0)
+    wav, ms = timed(pipeline.synthesize, case["prompt"], case["language"], gpt_cond_latent, speaker_embedding)
+    samples["inference"].append(ms)
+    samples["rtf"].append(ms / 1000 / (len(wav) / SAMPLE_RATE))
+
+    _, ms = timed(encode_wav, wav, SAMPLE_RATE)
+    samples["save"].append(ms)
+    _, ms = timed(render_preview, wav)
+    samples["waveform"].append(ms)
+
+    if stream:
+        t0 = time.perf_counter()
+        chunks = pipeline.stream(case["prompt"], case["language"], gpt_cond_latent, speaker_embedding)
+        next(chunks)
+        samples["first_chunk"].append((time.perf_counter() - t0) * 1000)
+        # finish the generator so the model lock is released
+        for _ in chunks:
+            pass
+
+
+def compare(report, baseline, tolerance):
+    regressions = []
+
+    def check(name, current, previous, floor):
+        if current > previous * (1 + tolerance) and current - previous > floor:
+            regressions.append({"metric": name, "baseline": previous, "current": current})
+
+    for stage, stats in baseline.get("stages", {}).items():
+        if stage in report["stages"]:
+            for key in ("p50", "p95"):
+                check(f"{stage}.{key}_ms", report["stages"][stage][key], stats[key], MIN_REGRESSION_MS)
+    if "rtf" in baseline and "rtf" in report:
+        check("rtf.p50", report["rtf"]["p50"], baseline["rtf"]["p50"], 0.0)
+    if "first_chunk_ms" in baseline and "first_chunk_ms" in report:
+        check("first_chunk.p50_ms", report["first_chunk_ms"]["p50"], baseline["first_chunk_ms"]["p50"], MIN_REGRESSION_MS)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--model", default="stub", help="stub (default), xtts or module:factory")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--no-stream", action="store_true", help="skip the first-chunk latency measurement")
+    parser.add_argument("--latent-cache", action="store_true", help="keep speaker latents cached between runs")
+    parser.add_argument("--output", default=None, help="write the report here instead of stdout")
+    parser.add_argument("--baseline", default=None, help="report to compare against")
+    parser.add_argument("--save-baseline", default=None, help="also write the report here as a new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed slowdown vs the baseline (0.2 = 20%%)")
+    args = parser.parse_args()
+
+    model, languages = load_model(args.model)
+    # a zero byte budget keeps every latents call cold unless asked otherwise
+    latent_cache = SpeakerLatentCache(max_bytes=256 * 1024 * 1024 if args.latent_cache else 0)
+    pipeline = SynthesisPipeline(model, languages, latent_cache)
+
+    samples = {name: [] for name in STAGES + ("rtf", "first_chunk")}
+    for _ in range(args.repeat):
+        for case in build_cases():
+            run_case(pipeline, case, samples, stream=not args.no_stream)
+
+    report = {
+        "model": args.model,
+        "repeat": args.repeat,
+        "stages": {stage: summarize(samples[stage]) for stage in STAGES if samples[stage]},
+        "rtf": summarize(samples["rtf"]),
+    }
+    if samples["first_chunk"]:
+        report["first_chunk_ms"] = summarize(samples["first_chunk"])
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            report["regressions"] = compare(report, json.load(f), args.tolerance)
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump(report, f, indent=2)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    else:
+        print(output)
+    if report.get("regressions"):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+"""Savings and equivalence of the conditioning prefix cache.
+
+For short sentences in the bundled voices, compares Xtts.inference with
+prefix_cache.cached_inference under the same seed and reports:
+
+- the time per sentence of both paths (p50/p95, milliseconds),
+- the first decoding step alone, whole prefix vs cached prefix,
+- the largest difference between the first-step logits of both paths and
+  how many sentences came out with the same number of samples and how
+  close those waveforms are.
+
+    python benchmarks/bench_prefix_cache.py [--repeat 5] [--device cuda|cpu]
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+import numpy as np
+import torch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from conditioning import LOAD_SR, compute_conditioning_latents, load_reference_audio  # noqa: E402
+from device import select_device  # noqa: E402
+from pipeline import REPETITION_PENALTY, TEMPERATURE  # noqa: E402
+from prefix_cache import PrefixKVCache, cached_inference, fresh_past  # noqa: E402
+from startup import ensure_model, load_model  # noqa: E402
+
+MODEL_NAME = "tts_models/multilingual/multi-dataset/xtts_v2"
+VOICES = ["examples/female.wav", "examples/male.wav"]
+SENTENCES = [
+    ("Hello there.", "en"),
+    ("How are you today?", "en"),
+    ("The weather is lovely.", "en"),
+    ("Bonjour à tous.", "fr"),
+    ("Wie geht es dir?", "de"),
+    ("Hasta mañana.", "es"),
+]
+
+
+def summarize(values):
+    return {
+        "p50": round(statistics.median(values), 3),
+        "p95": round(sorted(values)[max(0, int(len(values) * 0.95) - 1)], 3),
+        "count": len(values),
+    }
+
+
+def synchronize(device):
+    if str(device).startswith("cuda"):
+        torch.cuda.synchronize()
+
+
+def timed(device, fn, *args, **kwargs):
+    synchronize(device)
+    t0 = time.perf_counter()
+    result = fn(*args, **kwargs)
+    synchronize(device)
+    return result, (time.perf_counter() - t0) * 1000
+
+
+@torch.inference_mode()
+def first_step(model, prefix_cache, text, language, gpt_cond_latent):
+    """First-step logits and times of the whole prefix and of the cached prefix."""
+    gpt = model.gpt
+    device = model.device
+    tokens = torch.IntTensor(model.tokenizer.encode(text.strip().lower(), lang=language.split("-")[0]))
+    tokens = tokens.unsqueeze(0).to(device)
+    text_inputs = torch.nn.functional.pad(tokens, (0, 1), value=gpt.stop_text_token)
+    text_inputs = torch.nn.functional.pad(text_inputs, (1, 0), value=gpt.start_text_token)
+    text_emb = gpt.text_embedding(text_inputs) + gpt.text_pos_embedding(text_inputs)
+    start = torch.full((1, 1), gpt.start_audio_token, dtype=torch.long, device=device)
+    start_emb = gpt.gpt_inference.embeddings(start)
+    start_emb = start_emb + gpt.gpt_inference.pos_embedding(start_emb)
+
+    full, full_ms = timed(device, gpt.gpt, inputs_embeds=torch.cat([gpt_cond_latent, text_emb, start_emb], dim=1))
+    past = prefix_cache.get_or_compute(gpt, gpt_cond_latent)
+    # copied outside the timing, like cached_inference does once per sentence
+    past = fresh_past(past)
+    cached, cached_ms = timed(
+        device, gpt.gpt, inputs_embeds=torch.cat([text_emb, start_emb], dim=1), past_key_values=past, use_cache=True
+    )
+    full_logits = gpt.gpt_inference.lm_head(full.last_hidden_state[:, -1]).float()
+    cached_logits = gpt.gpt_inference.lm_head(cached.last_hidden_state[:, -1]).float()
+    return float((full_logits - cached_logits).abs().max()), full_ms, cached_ms
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--device", default=None, help="default: cuda when available")
+    args = parser.parse_args()
+
+    device = args.device or select_device()
+    model, _ = load_model(ensure_model(MODEL_NAME), device)
+    prefix_cache = PrefixKVCache()
+    params = dict(repetition_penalty=REPETITION_PENALTY, temperature=TEMPERATURE)
+
+    samples = {"uncached": [], "cached": [], "first_step_full": [], "first_step_cached": []}
+    logit_diffs = []
+    same_length = 0
+    wav_diffs = []
+    runs = 0
+    for voice in VOICES:
+        audio = load_reference_audio(voice, LOAD_SR)
+        gpt_cond_latent, speaker_embedding = compute_conditioning_latents(model, audio, LOAD_SR)
+        gpt_cond_latent = gpt_cond_latent.to(model.device)
+        for repeat in range(args.repeat):
+            for i, (text, language) in enumerate(SENTENCES):
+                diff, full_ms, cached_ms = first_step(model, prefix_cache, text, language, gpt_cond_latent)
+                logit_diffs.append(diff)
+                samples["first_step_full"].append(full_ms)
+                samples["first_step_cached"].append(cached_ms)
+
+                seed = repeat * len(SENTENCES) + i
+                torch.manual_seed(seed)
+                out, ms = timed(
+                    model.device, model.inference, text, language, gpt_cond_latent, speaker_embedding, **params
+                )
+                samples["uncached"].append(ms)
+                torch.manual_seed(seed)
+                cached_out, ms = timed(
+                    model.device,
+                    cached_inference,
+                    model,
+                    prefix_cache,
+                    text,
+                    language,
+                    gpt_cond_latent,
+                    speaker_embedding,
+                    **params,
+                )
+                samples["cached"].append(ms)
+
+                runs += 1
+                wav, cached_wav = np.asarray(out["wav"]).reshape(-1), np.asarray(cached_out["wav"]).reshape(-1)
+                if len(wav) == len(cached_wav):
+                    same_length += 1
+                    wav_diffs.append(float(np.abs(wav - cached_wav).max()))
+
+    report = {
+        "device": str(device),
+        "sentences": runs,
+        "ms": {name: summarize(values) for name, values in samples.items()},
+        "saved_ms_per_sentence": round(
+            statistics.median(samples["uncached"]) - statistics.median(samples["cached"]), 3
+        ),
+        "equivalence": {
+            "first_step_logits_max_abs_diff": max(logit_diffs),
+            "same_length_ratio": round(same_length / runs, 3),
+            "same_length_wav_max_abs_diff": max(wav_diffs) if wav_diffs else None,
+        },
+        "prefix_cache": {"voices": len(prefix_cache), "hits": prefix_cache.hits, "misses": prefix_cache.misses},
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""CPU quality/speed report for fp32 vs dynamic int8 XTTS.
+
+Runs the bundled example voices through both variants and reports the
+real-time factor and a quality proxy: cosine similarity between the speaker
+embedding of the output and of the reference (1.0 = same voice). Both
+embeddings come from the fp32 model's speaker encoder, for both variants.
+
+    python benchmarks/bench_quantization.py [--threads N] [--repeat 3]
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+import torch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from conditioning import LOAD_SR, compute_conditioning_latents, load_reference_audio  # noqa: E402
+from device import configure_cpu_threads  # noqa: E402
+from startup import ensure_model, load_model  # noqa: E402
+
+MODEL_NAME = "tts_models/multilingual/multi-dataset/xtts_v2"
+CASES = [
+    ("Once when I was six years old I saw a magnificent picture", "en", "examples/female.wav"),
+    ("Lorsque j'avais six ans j'ai vu, une fois, une magnifique image", "fr", "examples/male.wav"),
+    ("Als ich sechs war, sah ich einmal ein wunderbares Bild", "de", "examples/female.wav"),
+]
+
+
+def speaker_similarity(judge, wav, reference_embedding):
+    wav = torch.as_tensor(wav).unsqueeze(0)
+    embedding = judge.get_speaker_embedding(wav, 24000)
+    return float(torch.nn.functional.cosine_similarity(embedding.flatten(), reference_embedding.flatten(), dim=0))
+
+
+def run_variant(model_path, quantize, repeat, judge=None):
+    """judge is the fp32 model whose speaker encoder scores the outputs, the variant itself when None."""
+    t0 = time.perf_counter()
+    model, _ = load_model(model_path, device="cpu", quantize=quantize)
+    judge = judge or model
+    results = {"load_seconds": round(time.perf_counter() - t0, 2), "cases": []}
+    for text, language, wav_path in CASES:
+        gpt_cond_latent, speaker_embedding = compute_conditioning_latents(model, load_reference_audio(wav_path), LOAD_SR)
+        _, reference_embedding = compute_conditioning_latents(judge, load_reference_audio(wav_path), LOAD_SR)
+        rtfs = []
+        for i in range(repeat):
+            torch.manual_seed(i)
+            t0 = time.perf_counter()
+            out = model.inference(text, language, gpt_cond_latent, speaker_embedding, repetition_penalty=5.0, temperature=0.75)
+            rtfs.append((time.perf_counter() - t0) / out["wav"].shape[-1] * 24000)
+        results["cases"].append(
+            {
+                "language": language,
+                "voice": wav_path,
+                "rtf": round(statistics.median(rtfs), 3),
+                "speaker_similarity": round(speaker_similarity(judge, out["wav"], reference_embedding), 4),
+            }
+        )
+    results["rtf"] = round(statistics.median(case["rtf"] for case in results["cases"]), 3)
+    return results, model
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--threads", type=int, default=None)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    threads = configure_cpu_threads(intra_op=args.threads)
+    model_path = ensure_model(MODEL_NAME)
+    report = {"threads": threads[0]}
+    report["fp32"], fp32_model = run_variant(model_path, quantize=False, repeat=args.repeat)
+    report["int8"], _ = run_variant(model_path, quantize=True, repeat=args.repeat, judge=fp32_model)
+    report["int8_speedup"] = round(report["fp32"]["rtf"] / report["int8"]["rtf"], 2)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""Small two-tier cache: an in-memory LRU with a byte budget in front of an
+optional on-disk store that survives restarts."""
+import os
+import threading
+import uuid
+from collections import OrderedDict
+
+
+class LRUCache:
+    def __init__(self, max_bytes, sizeof=len):
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.current_bytes = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._items:
+                return None
+            self._items.move_to_end(key)
+            return self._items[key][0]
+
+    def put(self, key, value):
+        size = self.sizeof(value)
+        if size > self.max_bytes:
+            # never let a single oversized entry flush the whole tier
+            return
+        with self._lock:
+            if key in self._items:
+                self.current_bytes -= self._items.pop(key)[1]
+            self._items[key] = (value, size)
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes:
+                _, (_, evicted_size) = self._items.popitem(last=False)
+                self.current_bytes -= evicted_size
+
+    def __len__(self):
+        return len(self._items)
+
+
+class DiskCache:
+    """Stores one file per key; writes are atomic so concurrent readers never
+    see a partial entry. When max_bytes is set the least recently used files
+    (by mtime) are removed to stay under budget."""
+
+    def __init__(self, directory, max_bytes=None, suffix=".bin"):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.suffix = suffix
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self.current_bytes = sum(size for _, size, _ in self._entries())
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + self.suffix)
+
+    def _entries(self):
+        for name in os.listdir(self.directory):
+            if not name.endswith(self.suffix):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                continue
+            yield path, st.st_size, st.st_mtime
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        try:
+            # touch so eviction is least-recently-used rather than oldest-written
+            os.utime(path)
+        except OSError:
+            pass
+        return data
+
+    def __contains__(self, key):
+        path = self._path(key)
+        try:
+            # counts as a use, like get
+            os.utime(path)
+        except OSError:
+            return False
+        return True
+
+    def put(self, key, data):
+        path = self._path(key)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        with self._lock:
+            try:
+                self.current_bytes -= os.path.getsize(path)
+            except FileNotFoundError:
+                pass
+            os.replace(tmp_path, path)
+            self.current_bytes += len(data)
+            if self.max_bytes is not None and self.current_bytes > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        for path, size, _ in sorted(self._entries(), key=lambda entry: entry[2]):
+            if self.current_bytes <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                self.current_bytes -= size
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,122 @@
+"""Optional torch.compile execution of the HiFiGAN decoder and the GPT.
+
+Compiled graphs are only fast while their input shapes repeat. The decoder
+input is zero padded along time to the next of a few length buckets, so
+one static graph per bucket serves every request, and the output is cropped
+back to the length the eager decoder would have produced. The batch
+dimension is marked dynamic for micro-batches, so each bucket has one graph
+for single requests and one for every batch size. The padding only reaches the last samples through
+the vocoder's receptive field, like the padding of a micro-batch.
+Latents longer than the largest bucket run eagerly.
+
+The GPT runs one step per audio token with a growing key/value cache, it is
+compiled with dynamic shapes instead, so the sequence length is a symbolic
+dimension rather than a recompile per step.
+
+Compiling happens on first use of a shape; warmup() runs every bucket, at
+every batch size given, and one sentence per voice at startup so no request
+pays for it."""
+import glob
+import math
+import time
+
+import torch
+import torch.nn.functional as F
+
+from conditioning import LOAD_SR, compute_conditioning_latents, load_reference_audio
+
+# latent frames (about 21.5 per second of audio), the largest covers the longest sentence XTTS generates
+DEFAULT_BUCKETS = (64, 128, 256, 512, 1024)
+
+
+class BucketedDecoder(torch.nn.Module):
+    """Stands in for model.hifigan_decoder, attributes like speaker_encoder are the wrapped decoder's."""
+
+    def __init__(self, decoder, buckets=DEFAULT_BUCKETS, **compile_kwargs):
+        super().__init__()
+        self.decoder = decoder
+        self.buckets = sorted(buckets)
+        self.compiled = torch.compile(decoder, dynamic=False, **compile_kwargs)
+
+    def __getattr__(self, name):
+        try:
+            return super().__getattr__(name)
+        except AttributeError:
+            return getattr(super().__getattr__("decoder"), name)
+
+    def bucket(self, frames):
+        for bucket in self.buckets:
+            if frames <= bucket:
+                return bucket
+        return None
+
+    def decoded_length(self, frames):
+        """Samples the eager decoder returns for a number of latent frames, its interpolations round down."""
+        decoder = self.decoder
+        length = math.floor(frames * (decoder.ar_mel_length_compression / decoder.output_hop_length))
+        if decoder.output_sample_rate != decoder.input_sample_rate:
+            length = math.floor(length * (decoder.output_sample_rate / decoder.input_sample_rate))
+        return length * decoder.output_hop_length
+
+    def forward(self, latents, g=None):
+        frames = latents.shape[1]
+        bucket = self.bucket(frames)
+        if bucket is None:
+            return self.decoder(latents, g=g)
+        latents = F.pad(latents, (0, 0, 0, bucket - frames))
+        if latents.shape[0] > 1:
+            # one graph for every micro-batch size instead of a recompile per size
+            torch._dynamo.mark_dynamic(latents, 0)
+            if g is not None:
+                torch._dynamo.mark_dynamic(g, 0)
+        wav = self.compiled(latents, g=g)
+        return wav[..., : self.decoded_length(frames)]
+
+
+def compile_model(model, buckets=DEFAULT_BUCKETS, mode=None):
+    """Swaps in the compiled decoder and GPT, in place. mode is torch.compile's (e.g. max-autotune).
+
+    A GPT loaded with DeepSpeed keeps its injected inference kernels, only the decoder is compiled."""
+    compile_kwargs = {"mode": mode} if mode else {}
+    # past the limit dynamo silently runs the decoder eagerly, there are two graphs per bucket
+    torch._dynamo.config.cache_size_limit = max(torch._dynamo.config.cache_size_limit, 2 * len(buckets))
+    model.hifigan_decoder = BucketedDecoder(model.hifigan_decoder, buckets, **compile_kwargs)
+    if getattr(model.gpt, "ds_engine", None) is not None:
+        print("GPT runs on DeepSpeed, compiling the decoder only")
+        return model
+    gpt = torch.compile(model.gpt.gpt, dynamic=True, **compile_kwargs)
+    # generate() steps through gpt_inference.transformer, the latents pass through gpt.gpt
+    model.gpt.gpt = gpt
+    model.gpt.gpt_inference.transformer = gpt
+    return model
+
+
+@torch.inference_mode()
+def warmup(model, voices=None, language="en", text="This sentence compiles the model.", batch_sizes=(1,)):
+    """Compiles every decoder bucket at each batch size and the GPT steps with the bundled voices.
+
+    Any batch size above one compiles the graph all micro-batches share. Returns the
+    seconds spent per voice and per bucket and batch size."""
+    voices = voices or sorted(glob.glob("examples/*.wav"))
+    timings = {}
+    latents = []
+    for voice in voices:
+        t0 = time.perf_counter()
+        gpt_cond_latent, speaker_embedding = compute_conditioning_latents(
+            model, load_reference_audio(voice, LOAD_SR), LOAD_SR
+        )
+        model.inference(text, language, gpt_cond_latent, speaker_embedding)
+        timings[voice] = time.perf_counter() - t0
+        latents.append((gpt_cond_latent, speaker_embedding))
+    decoder = model.hifigan_decoder
+    for i, bucket in enumerate(getattr(decoder, "buckets", ())):
+        gpt_cond_latent, speaker_embedding = latents[i % len(latents)]
+        for batch_size in batch_sizes:
+            t0 = time.perf_counter()
+            decoder(
+                gpt_cond_latent.new_zeros(batch_size, bucket, gpt_cond_latent.shape[-1]),
+                g=speaker_embedding.expand(batch_size, *speaker_embedding.shape[1:]),
+            )
+            name = f"bucket-{bucket}" if batch_size == 1 else f"bucket-{bucket}x{batch_size}"
+            timings[name] = time.perf_counter() - t0
+    return timings
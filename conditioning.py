@@ -0,0 +1,161 @@
+"""Reference audio loading and speaker conditioning for XTTS.
+
+Latents are cached by a hash of the decoded reference audio plus the
+conditioning parameters, so a repeated voice (e.g. the bundled examples)
+never goes through the encoders twice."""
+import hashlib
+import io
+import os
+import time
+
+import torch
+import torchaudio
+
+from cache import DiskCache, LRUCache
+
+# sample rate Xtts.get_conditioning_latents loads references at
+LOAD_SR = 22050
+# uploads larger or longer than this are rejected before decoding
+MAX_REFERENCE_BYTES = int(os.environ.get("MAX_REFERENCE_MB", "50")) * 1024 * 1024
+MAX_REFERENCE_SECONDS = int(os.environ.get("MAX_REFERENCE_SECONDS", "600"))
+
+
+class ReferenceAudioError(ValueError):
+    pass
+
+
+def _source_size(source):
+    if isinstance(source, (str, os.PathLike)):
+        return os.path.getsize(source)
+    position = source.tell()
+    size = source.seek(0, os.SEEK_END)
+    source.seek(position)
+    return size
+
+
+def load_reference_audio(source, sr=LOAD_SR, max_seconds=None):
+    """Decodes at most max_seconds of a reference given as a path or binary file object.
+
+    Same result as TTS.tts.models.xtts.load_audio (mono, resampled, clipped)
+    on the decoded window. Inputs over MAX_REFERENCE_MB or, when the header
+    tells, MAX_REFERENCE_SECONDS are rejected before anything is decoded."""
+    if _source_size(source) > MAX_REFERENCE_BYTES:
+        raise ReferenceAudioError(f"Reference audio is larger than {MAX_REFERENCE_BYTES // (1024 * 1024)} MB")
+    info = torchaudio.info(source)
+    if not isinstance(source, (str, os.PathLike)):
+        source.seek(0)
+    # num_frames is 0 when the container does not record the length
+    if info.num_frames > MAX_REFERENCE_SECONDS * info.sample_rate:
+        raise ReferenceAudioError(f"Reference audio is longer than {MAX_REFERENCE_SECONDS} seconds")
+    num_frames = -1 if max_seconds is None else int(max_seconds * info.sample_rate)
+    audio, lsr = torchaudio.load(source, num_frames=num_frames)
+    # downmix before resampling, so the resampler runs on one channel
+    if audio.size(0) != 1:
+        audio = torch.mean(audio, dim=0, keepdim=True)
+    if lsr != sr:
+        audio = torchaudio.functional.resample(audio, lsr, sr)
+    audio.clip_(-1, 1)
+    return audio
+
+
+def audio_digest(audio, **params):
+    digest = hashlib.sha256()
+    digest.update(audio.detach().to("cpu", torch.float32).contiguous().numpy().tobytes())
+    for name in sorted(params):
+        digest.update(f"|{name}={params[name]}".encode())
+    return digest.hexdigest()
+
+
+@torch.inference_mode()
+def compute_conditioning_latents(
+    model, audio, sr=LOAD_SR, gpt_cond_len=30, gpt_cond_chunk_len=4, max_ref_length=60
+):
+    # Xtts.get_conditioning_latents for a single, already decoded reference
+    audio = audio[:, : sr * max_ref_length].to(model.device)
+    speaker_embedding = model.get_speaker_embedding(audio, sr)
+    gpt_cond_latent = model.get_gpt_cond_latents(
+        audio, sr, length=gpt_cond_len, chunk_length=gpt_cond_chunk_len
+    )
+    return gpt_cond_latent, speaker_embedding
+
+
+def _entry_nbytes(entry):
+    gpt_cond_latent, speaker_embedding, _ = entry
+    return (
+        gpt_cond_latent.numel() * gpt_cond_latent.element_size()
+        + speaker_embedding.numel() * speaker_embedding.element_size()
+    )
+
+
+class SpeakerLatentCache:
+    def __init__(self, max_bytes=256 * 1024 * 1024, cache_dir=None):
+        self.memory = LRUCache(max_bytes, sizeof=_entry_nbytes)
+        self.disk = DiskCache(cache_dir, suffix=".pt") if cache_dir else None
+        self.hits = 0
+        self.misses = 0
+
+    def _load_disk(self, key):
+        if self.disk is None:
+            return None
+        data = self.disk.get(key)
+        if data is None:
+            return None
+        try:
+            stored = torch.load(io.BytesIO(data), map_location="cpu")
+            return (
+                stored["gpt_cond_latent"],
+                stored["speaker_embedding"],
+                stored["compute_time"],
+            )
+        except Exception as e:
+            print("Ignoring unreadable latent cache entry", key, str(e))
+            return None
+
+    def _store_disk(self, key, entry):
+        if self.disk is None:
+            return
+        gpt_cond_latent, speaker_embedding, compute_time = entry
+        buffer = io.BytesIO()
+        torch.save(
+            {
+                "gpt_cond_latent": gpt_cond_latent,
+                "speaker_embedding": speaker_embedding,
+                "compute_time": compute_time,
+            },
+            buffer,
+        )
+        self.disk.put(key, buffer.getvalue())
+
+    def get_or_compute(self, model, audio, sr=LOAD_SR, **params):
+        """Returns (gpt_cond_latent, speaker_embedding, source, compute_time).
+
+        source is "memory" or "disk" on a hit and None when the latents were
+        computed; compute_time is what the encoders took originally, i.e. the
+        time a hit saved."""
+        key = audio_digest(audio, sr=sr, **params)
+        source = "memory"
+        entry = self.memory.get(key)
+        if entry is None:
+            source = "disk"
+            entry = self._load_disk(key)
+            if entry is not None:
+                self.memory.put(key, entry)
+        if entry is None:
+            source = None
+            self.misses += 1
+            t0 = time.time()
+            gpt_cond_latent, speaker_embedding = compute_conditioning_latents(
+                model, audio, sr=sr, **params
+            )
+            entry = (gpt_cond_latent.cpu(), speaker_embedding.cpu(), time.time() - t0)
+            self.memory.put(key, entry)
+            self._store_disk(key, entry)
+        else:
+            self.hits += 1
+        gpt_cond_latent, speaker_embedding, compute_time = entry
+        return (
+            gpt_cond_latent.to(model.device),
+            speaker_embedding.to(model.device),
+            source,
+            compute_time,
+        )
@@ -0,0 +1,154 @@
+# predict inputs: prompt, language, reference audio, microphone audio, use microphone,
+# cleanup reference, disable language auto-detection, agree to the terms
+examples = [
+    [
+        "Once when I was six years old I saw a magnificent picture",
+        "en",
+        "examples/female.wav",
+        None,
+        False,
+        False,
+        False,
+        True,
+    ],
+    [
+        "Lorsque j'avais six ans j'ai vu, une fois, une magnifique image",
+        "fr",
+        "examples/male.wav",
+        None,
+        False,
+        False,
+        False,
+        True,
+    ],
+    [
+        "Als ich sechs war, sah ich einmal ein wunderbares Bild",
+        "de",
+        "examples/female.wav",
+        None,
+        False,
+        False,
+        False,
+        True,
+    ],
+    [
+        "Cuando tenía seis años, vi una vez una imagen magnífica",
+        "es",
+        "examples/male.wav",
+        None,
+        False,
+        False,
+        False,
+        True,
+    ],
+    [
+        "Quando eu tinha seis anos eu vi, uma vez, uma imagem magnífica",
+        "pt",
+        "examples/female.wav",
+        None,
+        False,
+        False,
+        False,
+        True,
+    ],
+    [
+        "Kiedy miałem sześć lat, zobaczyłem pewnego razu wspaniały obrazek",
+        "pl",
+        "examples/male.wav",
+        None,
+        False,
+        False,
+        False,
+        True,
+    ],
+    [
+        "Un tempo lontano, quando avevo sei anni, vidi un magnifico disegno",
+        "it",
+        "examples/female.wav",
+        None,
+        False,
+        False,
+        False,
+        True,
+    ],
+    [
+        "Bir zamanlar, altı yaşındayken, muhteşem bir resim gördüm",
+        "tr",
+        "examples/female.wav",
+        None,
+        False,
+        False,
+        False,
+        True,
+    ],
+    [
+        "Когда мне было шесть лет, я увидел однажды удивительную картинку",
+        "ru",
+        "examples/female.wav",
+        None,
+        False,
+        False,
+        False,
+        True,
+    ],
+    [
+        "Toen ik een jaar of zes was, zag ik op een keer een prachtige plaat",
+        "nl",
+        "examples/male.wav",
+        None,
+        False,
+        False,
+        False,
+        True,
+    ],
+    [
+        "Když mi bylo šest let, viděl jsem jednou nádherný obrázek",
+        "cs",
+        "examples/female.wav",
+        None,
+        False,
+        False,
+        False,
+        True,
+    ],
+    [
+        "当我还只有六岁的时候， 看到了一副精彩的插画",
+        "zh-cn",
+        "examples/female.wav",
+        None,
+        False,
+        False,
+        False,
+        True,
+    ],
+    [
+        "かつて 六歳のとき、素晴らしい絵を見ました",
+        "ja",
+        "examples/female.wav",
+        None,
+        False,
+        True,
+        False,
+        True,
+    ],
+    [
+        "한번은 내가 여섯 살이었을 때 멋진 그림을 보았습니다.",
+        "ko",
+        "examples/female.wav",
+        None,
+        False,
+        True,
+        False,
+        True,
+    ],
+        [
+        "Egyszer hat éves koromban láttam egy csodálatos képet",
+        "hu",
+        "examples/male.wav",
+        None,
+        False,
+        True,
+        False,
+        True,
+    ],
+]
@@ -0,0 +1,61 @@
+"""Device selection for the XTTS model.
+
+Uses CUDA (with deepspeed when it is installed) when available, otherwise
+runs on CPU with configurable thread counts and optional dynamic int8
+quantization of the GPT's linear layers."""
+import importlib.util
+import os
+
+import torch
+from torch import nn
+
+
+def select_device(preferred=None):
+    preferred = preferred or os.environ.get("DEVICE", "auto")
+    if preferred == "auto":
+        return "cuda" if torch.cuda.is_available() else "cpu"
+    return preferred
+
+
+def deepspeed_available():
+    return importlib.util.find_spec("deepspeed") is not None
+
+
+def configure_cpu_threads(intra_op=None, inter_op=None):
+    # must run before torch starts any parallel work, set_num_interop_threads fails afterwards
+    intra_op = intra_op or int(os.environ.get("CPU_THREADS", "0")) or None
+    inter_op = inter_op or int(os.environ.get("CPU_INTEROP_THREADS", "0")) or None
+    if intra_op:
+        torch.set_num_threads(intra_op)
+    if inter_op:
+        torch.set_num_interop_threads(inter_op)
+    return torch.get_num_threads(), torch.get_num_interop_threads()
+
+
+def _conv1d_to_linear(module):
+    # GPT-2 blocks use transformers' Conv1D (a transposed linear), which
+    # quantize_dynamic does not know about
+    from transformers.pytorch_utils import Conv1D
+
+    for name, child in module.named_children():
+        if isinstance(child, Conv1D):
+            in_features, out_features = child.weight.shape
+            linear = nn.Linear(in_features, out_features)
+            linear.weight.data = child.weight.data.t().contiguous()
+            linear.bias.data = child.bias.data
+            setattr(module, name, linear)
+        else:
+            _conv1d_to_linear(child)
+
+
+def quantize_int8(model):
+    """Dynamic int8 quantization of the autoregressive GPT and its head, CPU only.
+
+    The conditioning encoder, perceiver and speaker encoder stay fp32, so
+    speaker latents (and the latent cache) do not depend on quantization.
+    The HiFiGAN vocoder has no linear layers and stays fp32 as well."""
+    # gpt_inference.transformer is the same module as gpt.gpt
+    _conv1d_to_linear(model.gpt.gpt)
+    torch.ao.quantization.quantize_dynamic(model.gpt.gpt, {nn.Linear}, dtype=torch.qint8, inplace=True)
+    torch.ao.quantization.quantize_dynamic(model.gpt.gpt_inference.lm_head, {nn.Linear}, dtype=torch.qint8, inplace=True)
+    return model
@@ -0,0 +1,150 @@
+"""Multi-speaker dialogue rendering.
+
+A dialogue is a list of turns, each with its own speaker and language. It
+is written either as JSON, a list of {"speaker", "language", "text"} objects
+with an optional "gap" (seconds of silence after that turn), or as lines of
+
+    speaker [language]: text
+
+where the language may be left out for the default one and a line without a
+speaker continues the previous turn.
+
+Turns are not rendered in script order. The conditioning latents of every
+speaker are resolved once, then the segments of all turns of one speaker in
+one language are rendered together by the long-form workers: with
+micro-batching enabled they run as batches of that speaker, and with the
+prefix cache they follow each other on the same cached prefix. The audio is
+then stitched in script order into a single WAV with a gap after every turn,
+and the place of every turn on that timeline is returned as a manifest.
+
+The audio of a dialogue is held in memory until all of its groups are rendered."""
+import json
+import re
+
+import numpy as np
+
+from longform import WavStitcher, render_in_order, segment_document
+
+# silence after a turn, in seconds
+TURN_GAP = 0.4
+LINE_RE = re.compile(r"^\s*([\w.-]+)\s*(?:\[\s*([\w-]+)\s*\])?\s*:(.*)$")
+
+
+class Turn:
+    def __init__(self, speaker, language, text, gap=None):
+        self.speaker = speaker
+        self.language = language
+        self.text = text
+        # None uses the dialogue's gap
+        self.gap = gap
+
+
+def _json_turns(script, default_language):
+    try:
+        items = json.loads(script)
+    except json.JSONDecodeError as e:
+        raise ValueError(f"Invalid dialogue JSON: {e}")
+    turns = []
+    for number, item in enumerate(items, 1):
+        if not isinstance(item, dict) or not item.get("speaker"):
+            raise ValueError(f"Turn {number} has no speaker")
+        gap = item.get("gap")
+        turns.append(
+            Turn(
+                str(item["speaker"]),
+                item.get("language") or default_language,
+                str(item.get("text", "")).strip(),
+                float(gap) if gap is not None else None,
+            )
+        )
+    return turns
+
+
+def _line_turns(script, default_language):
+    turns = []
+    for number, line in enumerate(script.splitlines(), 1):
+        if not line.strip():
+            continue
+        match = LINE_RE.match(line)
+        if match:
+            turns.append(Turn(match[1], match[2] or default_language, match[3].strip()))
+        elif turns:
+            turns[-1].text = f"{turns[-1].text} {line.strip()}".strip()
+        else:
+            raise ValueError(f"Line {number} does not start with a speaker")
+    return turns
+
+
+def parse_dialogue(script, default_language=None):
+    """Turns of a JSON or line formatted dialogue, raises ValueError when it is malformed."""
+    script = script.strip()
+    turns = _json_turns(script, default_language) if script.startswith("[") else _line_turns(script, default_language)
+    if not turns:
+        raise ValueError("The dialogue has no turns")
+    for number, turn in enumerate(turns, 1):
+        if not turn.language:
+            raise ValueError(f"Turn {number} has no language")
+        if len(turn.text) < 2:
+            raise ValueError(f"Turn {number} has no text")
+        if turn.gap is not None and turn.gap < 0:
+            raise ValueError(f"Turn {number} has a negative gap")
+    return turns
+
+
+def render_dialogue(turns, latents, render, path, max_chars, sample_rate=24000, gap=TURN_GAP, workers=1, progress=None):
+    """Renders turns into the WAV file at path.
+
+    latents maps every speaker to its conditioning, render(text, language,
+    latents) returns the audio of a segment and max_chars(language) is the
+    segment length limit. Returns the timeline:
+
+        {"duration": seconds, "turns": [{"turn", "speaker", "language", "text", "start", "end"}, ...]}
+
+    progress(done, total) is called after every rendered segment."""
+    segments = [segment_document(turn.text, max_chars(turn.language)) for turn in turns]
+    groups = {}
+    for i, turn in enumerate(turns):
+        groups.setdefault((turn.speaker, turn.language), []).append(i)
+
+    audio = [[None] * len(turn_segments) for turn_segments in segments]
+    total = sum(map(len, segments))
+    done = 0
+    for (speaker, language), indices in groups.items():
+        jobs = [(i, j) for i in indices for j in range(len(segments[i]))]
+        rendered = render_in_order(
+            [segments[i][j] for i, j in jobs],
+            lambda text: render(text, language, latents[speaker]),
+            workers,
+        )
+        for (i, j), wav in zip(jobs, rendered):
+            audio[i][j] = wav
+            done += 1
+            if progress is not None:
+                progress(done, total)
+
+    stitcher = WavStitcher(path, sample_rate)
+    timeline = []
+    try:
+        for i, turn in enumerate(turns):
+            for j, (segment, wav) in enumerate(zip(segments[i], audio[i])):
+                pause = segment.pause_after
+                if j == len(segments[i]) - 1 and i < len(turns) - 1:
+                    pause = gap if turn.gap is None else turn.gap
+                offset = stitcher.add(wav, pause)
+                if j == 0:
+                    start = offset
+            end = offset + np.asarray(wav).size
+            audio[i] = None
+            timeline.append(
+                {
+                    "turn": i,
+                    "speaker": turn.speaker,
+                    "language": turn.language,
+                    "text": turn.text,
+                    "start": round(start / sample_rate, 3),
+                    "end": round(end / sample_rate, 3),
+                }
+            )
+    finally:
+        stitcher.close()
+    return {"duration": round(stitcher.samples_written / sample_rate, 3), "turns": timeline}
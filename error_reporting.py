@@ -0,0 +1,235 @@
+"""Background reporting of unrecoverable errors.
+
+report() only puts the incident on an in-memory queue. A background thread
+writes each incident (a JSON record plus attachments such as the reference
+audio) to a spool directory and flushes spooled incidents in batches to a
+sink, retrying failed batches with backoff. Repeated prompts are reported
+once, and the spool is capped in size by dropping its oldest incidents, so
+reporting never adds latency to a request or holds up a shutdown."""
+import atexit
+import csv
+import hashlib
+import io
+import json
+import os
+import queue
+import shutil
+import threading
+import time
+import traceback
+import uuid
+
+RECORD_FILE = "record.json"
+
+
+def dedup_key(*values):
+    return hashlib.sha256("|".join(str(value) for value in values).encode()).hexdigest()[:16]
+
+
+class Incident:
+    def __init__(self, path):
+        self.path = path
+        self.id = os.path.basename(path)
+        with open(os.path.join(path, RECORD_FILE)) as f:
+            self.record = json.load(f)
+
+    @property
+    def files(self):
+        """Attachment name -> path."""
+        return {name: os.path.join(self.path, name) for name in self.record["files"]}
+
+
+class DirectorySink:
+    """Copies incidents into a local directory, a stand-in for remote sinks."""
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def send(self, incidents):
+        os.makedirs(self.directory, exist_ok=True)
+        for incident in incidents:
+            target = os.path.join(self.directory, incident.id)
+            shutil.rmtree(target, ignore_errors=True)
+            shutil.copytree(incident.path, target)
+
+
+class HfDatasetSink:
+    """Uploads a batch as one commit to a Hugging Face dataset: a CSV row per
+    incident plus its attachments, named as the space always named them."""
+
+    def __init__(self, repo_id):
+        self.repo_id = repo_id
+
+    def send(self, incidents):
+        from huggingface_hub import CommitOperationAdd, HfApi
+
+        operations = []
+        for incident in incidents:
+            record = incident.record
+            write_io = io.StringIO()
+            csv.writer(write_io).writerows([record["row"]])
+            operations.append(
+                CommitOperationAdd(
+                    path_in_repo=f"{record['time']}_{incident.id}.csv",
+                    path_or_fileobj=write_io.getvalue().encode(),
+                )
+            )
+            for name, path in incident.files.items():
+                stem, ext = os.path.splitext(name)
+                operations.append(
+                    CommitOperationAdd(path_in_repo=f"{record['time']}_{stem}_{incident.id}{ext}", path_or_fileobj=path)
+                )
+        HfApi().create_commit(
+            repo_id=self.repo_id,
+            repo_type="dataset",
+            operations=operations,
+            commit_message=f"Add {len(incidents)} error reports",
+        )
+
+
+class ErrorReporter:
+    def __init__(
+        self,
+        spool_dir,
+        sink,
+        max_spool_bytes=200 * 1024 * 1024,
+        flush_interval=30.0,
+        batch_size=20,
+        max_attempts=5,
+        max_queued=100,
+    ):
+        self.spool_dir = spool_dir
+        self.sink = sink
+        self.max_spool_bytes = max_spool_bytes
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.reported = 0
+        self.dropped = 0
+        self.sent = 0
+        self._queue = queue.Queue(maxsize=max_queued)
+        # dedup keys seen by this process
+        self._seen = set()
+        self._failures = 0
+        self._next_flush = 0.0
+        self._closed = threading.Event()
+        os.makedirs(spool_dir, exist_ok=True)
+        self._thread = threading.Thread(target=self._run, name="error-reporter", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def report(self, record, files=None, key=None):
+        """Queues an incident, never blocks; returns False if it was a duplicate or dropped.
+
+        files maps attachment names to paths that must stay readable for a
+        moment, key identifies duplicates (default: the whole record)."""
+        key = key or dedup_key(json.dumps(record, sort_keys=True, default=str))
+        if key in self._seen:
+            return False
+        self._seen.add(key)
+        try:
+            self._queue.put_nowait((key, record, files or {}))
+        except queue.Full:
+            self.dropped += 1
+            return False
+        self.reported += 1
+        return True
+
+    def _spool(self, key, record, files):
+        target = os.path.join(self.spool_dir, key)
+        if os.path.exists(target):
+            # already spooled by an earlier run
+            return
+        incoming = os.path.join(self.spool_dir, f".incoming-{uuid.uuid4().hex}")
+        os.makedirs(incoming)
+        names = []
+        for name, path in files.items():
+            try:
+                shutil.copyfile(path, os.path.join(incoming, name))
+                names.append(name)
+            except OSError as e:
+                print(f"Error report attachment {name} unavailable: {e}")
+        with open(os.path.join(incoming, RECORD_FILE), "w") as f:
+            json.dump({**record, "files": names, "attempts": 0}, f, default=str)
+        # only complete incidents become visible to the flusher
+        os.replace(incoming, target)
+        self._enforce_cap()
+
+    def _incidents(self):
+        # oldest first
+        paths = [
+            os.path.join(self.spool_dir, name) for name in os.listdir(self.spool_dir) if not name.startswith(".")
+        ]
+        return sorted(paths, key=lambda path: os.stat(path).st_mtime)
+
+    def _spool_bytes(self, path):
+        return sum(entry.stat().st_size for entry in os.scandir(path))
+
+    def _enforce_cap(self):
+        paths = self._incidents()
+        sizes = {path: self._spool_bytes(path) for path in paths}
+        total = sum(sizes.values())
+        for path in paths:
+            if total <= self.max_spool_bytes:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total -= sizes[path]
+            self.dropped += 1
+
+    def _flush(self):
+        incidents = [Incident(path) for path in self._incidents()[: self.batch_size]]
+        if not incidents:
+            return
+        try:
+            self.sink.send(incidents)
+        except Exception:
+            traceback.print_exc()
+            self._failures += 1
+            # exponential backoff, capped at 10 minutes
+            self._next_flush = time.time() + min(self.flush_interval * 2**self._failures, 600)
+            for incident in incidents:
+                incident.record["attempts"] += 1
+                if incident.record["attempts"] >= self.max_attempts:
+                    print(f"Giving up on error report {incident.id}")
+                    shutil.rmtree(incident.path, ignore_errors=True)
+                    self.dropped += 1
+                    continue
+                with open(os.path.join(incident.path, RECORD_FILE), "w") as f:
+                    json.dump(incident.record, f, default=str)
+            return
+        self._failures = 0
+        self.sent += len(incidents)
+        for incident in incidents:
+            shutil.rmtree(incident.path, ignore_errors=True)
+
+    def _run(self):
+        while not self._closed.is_set():
+            try:
+                item = self._queue.get(timeout=max(0.1, min(self.flush_interval, self._next_flush - time.time())))
+            except queue.Empty:
+                item = None
+            try:
+                if item is not None:
+                    self._spool(*item)
+                    if not self._failures:
+                        # flush soon, but let a burst of incidents share a batch
+                        self._next_flush = min(self._next_flush, time.time() + 1.0)
+                elif time.time() >= self._next_flush:
+                    self._flush()
+                    if not self._failures:
+                        self._next_flush = time.time() + self.flush_interval
+            except Exception:
+                traceback.print_exc()
+
+    def close(self, timeout=2.0):
+        """Spools what is still queued and stops; unsent incidents stay in the spool for the next start."""
+        if self._closed.is_set():
+            return
+        self._closed.set()
+        self._thread.join(timeout)
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            try:
+                self._spool(*self._queue.get_nowait())
+            except queue.Empty:
+                break
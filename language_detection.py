@@ -0,0 +1,46 @@
+"""Language detection for prompts, restricted to the languages XTTS supports.
+
+langid is used to detect language for longer text. Detection only looks at
+a bounded sample of the prompt, so its cost does not grow with the text,
+and results are memoized for repeated prompts."""
+import functools
+
+from langid.langid import LanguageIdentifier, model as langid_model
+
+# tts expects chinese as zh-cn
+LANGID_TO_XTTS = {"zh": "zh-cn"}
+XTTS_TO_LANGID = {v: k for k, v in LANGID_TO_XTTS.items()}
+
+# After text character length 15 trigger language detection
+MIN_DETECTION_LENGTH = 15
+# characters classified at most, taken from the start, middle and end of the text
+MAX_SAMPLE_CHARS = 1200
+
+
+class LanguageDetector:
+    def __init__(self, languages, max_sample_chars=MAX_SAMPLE_CHARS, cache_size=4096):
+        self.max_sample_chars = max_sample_chars
+        self.identifier = LanguageIdentifier.from_modelstring(langid_model, norm_probs=False)
+        candidates = [XTTS_TO_LANGID.get(language, language) for language in languages]
+        self.identifier.set_languages([c for c in candidates if c in self.identifier.nb_classes])
+        self._classify = functools.lru_cache(maxsize=cache_size)(self._classify_sample)
+
+    def sample(self, text):
+        if len(text) <= self.max_sample_chars:
+            return text
+        third = self.max_sample_chars // 3
+        middle = (len(text) - third) // 2
+        return " ".join([text[:third], text[middle : middle + third], text[-third:]])
+
+    def _classify_sample(self, sample):
+        language = self.identifier.classify(sample)[0].strip()  # strip need as there is space at end!
+        return LANGID_TO_XTTS.get(language, language)
+
+    def detect(self, text):
+        return self._classify(self.sample(text))
+
+    def is_mismatch(self, text, language):
+        # allow any language for short text as some may be common
+        if len(text) <= MIN_DETECTION_LENGTH:
+            return False
+        return self.detect(text) != language
@@ -0,0 +1,138 @@
+"""Long-form (document length) synthesis.
+
+The document is segmented into paragraphs and sentences, segments are
+rendered by a small pool of workers and the results are stitched in order
+straight into a WAV file. Only a bounded window of segments is ever held in
+memory, so peak memory does not depend on the document length."""
+import re
+import wave
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from audio_io import pcm16
+from text_processing import split_sentences
+
+PARAGRAPH_RE = re.compile(r"\n\s*\n")
+
+# silence after a sentence and after a paragraph, in seconds
+SENTENCE_PAUSE = 0.25
+PARAGRAPH_PAUSE = 0.7
+# overlap used when a sentence had to be split into several segments
+CROSSFADE = 0.05
+# fade applied around pauses so segments never start or stop with a click
+EDGE_FADE = 0.01
+
+
+class Segment:
+    def __init__(self, text, pause_after):
+        self.text = text
+        self.pause_after = pause_after
+
+
+def segment_document(text, max_chars):
+    segments = []
+    for paragraph in PARAGRAPH_RE.split(text):
+        for sentence in split_sentences(paragraph, max_chars=10**9):
+            pieces = split_sentences(sentence, max_chars=max_chars)
+            # pieces of one sentence are crossfaded, whole sentences get a pause
+            segments.extend(Segment(piece, 0.0) for piece in pieces[:-1])
+            segments.append(Segment(pieces[-1], SENTENCE_PAUSE))
+        if segments:
+            segments[-1].pause_after = PARAGRAPH_PAUSE
+    if segments:
+        segments[-1].pause_after = 0.0
+    return segments
+
+
+def render_in_order(segments, render, workers=1, window=None):
+    """Yields render(segment.text) for every segment, in document order.
+
+    At most `window` segments are submitted ahead of the one being consumed."""
+    window = window or 2 * workers
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="longform") as pool:
+        in_flight = deque()
+        remaining = iter(segments)
+        for segment in remaining:
+            in_flight.append(pool.submit(render, segment.text))
+            if len(in_flight) >= window:
+                break
+        while in_flight:
+            wav = in_flight.popleft().result()
+            next_segment = next(remaining, None)
+            if next_segment is not None:
+                in_flight.append(pool.submit(render, next_segment.text))
+            yield wav
+
+
+def _fade(length):
+    return np.linspace(0.0, 1.0, length, dtype=np.float32)
+
+
+class WavStitcher:
+    """Appends segments to a 16 bit mono WAV file, crossfading segments that
+    follow each other directly and inserting silence where a pause is asked
+    for. Only the last CROSSFADE seconds are kept in memory."""
+
+    def __init__(self, path, sample_rate=24000):
+        self.sample_rate = sample_rate
+        self.samples_written = 0
+        self._file = wave.open(path, "wb")
+        self._file.setnchannels(1)
+        self._file.setsampwidth(2)
+        self._file.setframerate(sample_rate)
+        self._tail = np.zeros(0, dtype=np.float32)
+        self._pause = 0.0
+
+    def _write(self, wav):
+        self._file.writeframes(pcm16(wav))
+        self.samples_written += len(wav)
+
+    def add(self, wav, pause_after=0.0):
+        """Returns the sample of the output file the segment starts at."""
+        wav = np.asarray(wav, dtype=np.float32).reshape(-1)
+        if self._pause > 0:
+            fade = min(int(EDGE_FADE * self.sample_rate), len(self._tail), len(wav))
+            if fade:
+                self._tail[-fade:] *= _fade(fade)[::-1]
+                wav = wav.copy()
+                wav[:fade] *= _fade(fade)
+            self._write(self._tail)
+            self._write(np.zeros(int(self._pause * self.sample_rate), dtype=np.float32))
+        else:
+            overlap = min(len(self._tail), len(wav))
+            if overlap:
+                ramp = _fade(overlap)
+                wav = wav.copy()
+                wav[:overlap] = self._tail[-overlap:] * ramp[::-1] + wav[:overlap] * ramp
+            self._write(self._tail[: len(self._tail) - overlap])
+        start = self.samples_written
+        keep = min(int(CROSSFADE * self.sample_rate), len(wav))
+        self._write(wav[: len(wav) - keep])
+        self._tail = wav[len(wav) - keep :].copy()
+        self._pause = pause_after
+        return start
+
+    def close(self):
+        fade = min(int(EDGE_FADE * self.sample_rate), len(self._tail))
+        if fade:
+            self._tail[-fade:] *= _fade(fade)[::-1]
+        self._write(self._tail)
+        self._tail = np.zeros(0, dtype=np.float32)
+        self._file.close()
+
+
+def synthesize_document(text, max_chars, render, path, sample_rate=24000, workers=1, progress=None):
+    """Renders `text` into the WAV file at `path` and returns its duration in
+    seconds. progress(done, total) is called after every segment."""
+    segments = segment_document(text, max_chars)
+    stitcher = WavStitcher(path, sample_rate)
+    try:
+        for i, (segment, wav) in enumerate(zip(segments, render_in_order(segments, render, workers))):
+            stitcher.add(wav, segment.pause_after)
+            if progress is not None:
+                progress(i + 1, len(segments))
+    finally:
+        stitcher.close()
+    return stitcher.samples_written / sample_rate
@@ -0,0 +1,160 @@
+"""Per-stage instrumentation of predict.
+
+Stage timers feed one histogram per stage, counters track request outcomes,
+cache lookups and device-side asserts, and gauges are read from callbacks
+when scraped. `Metrics.render()` produces the Prometheus text format served
+on /metrics. With a trace path set, every request also appends one JSON
+line with its stage timings and outcome."""
+import contextlib
+import json
+import threading
+import time
+import uuid
+
+# seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+DESCRIPTIONS = {
+    "stage_seconds": "Time spent in each stage of a request",
+    "requests_total": "Finished requests by mode and outcome",
+    "requests_in_progress": "Requests currently being processed",
+    "cache_lookups_total": "Cache lookups by cache and result (memory, disk or miss)",
+    "device_asserts_total": "CUDA device-side asserts, the space needs a restart after one",
+    "output_bytes_total": "Encoded output audio by format",
+    "admission_total": "Requests by job class and admission result (admitted, deferred or rejected)",
+}
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for value in labels.values())
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + "}"
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class RequestTrace:
+    def __init__(self, **fields):
+        self.id = uuid.uuid4().hex
+        self.start = time.time()
+        self.fields = fields
+        self.stages = {}
+
+    def record(self):
+        return {
+            "id": self.id,
+            "time": self.start,
+            "duration": time.time() - self.start,
+            **self.fields,
+            "stages": self.stages,
+        }
+
+
+class Metrics:
+    def __init__(self, prefix="xtts", buckets=BUCKETS, trace_path=None):
+        self.prefix = prefix
+        self.buckets = buckets
+        self.trace_path = trace_path
+        self._lock = threading.Lock()
+        # name -> {label tuple: value}
+        self._counters = {}
+        # stage -> [count per bucket..., sum, count]
+        self._histograms = {}
+        # name -> (kind, callback returning a number)
+        self._callbacks = {}
+        self._in_progress = 0
+
+    def inc(self, name, amount=1, **labels):
+        key = tuple(labels.items())
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + amount
+
+    def observe(self, stage, seconds):
+        with self._lock:
+            values = self._histograms.setdefault(stage, [0] * (len(self.buckets) + 2))
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    values[i] += 1
+            values[-2] += seconds
+            values[-1] += 1
+
+    def register(self, name, callback, kind="gauge", description=None):
+        """Reports callback() under name whenever the metrics are rendered."""
+        if description is not None:
+            DESCRIPTIONS.setdefault(name, description)
+        self._callbacks[name] = (kind, callback)
+
+    @contextlib.contextmanager
+    def stage(self, name, trace=None):
+        """Times the block into the stage histogram and the request trace, if given."""
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - t0, trace)
+
+    def record(self, name, seconds, trace=None):
+        """Adds a stage duration measured by the caller."""
+        self.observe(name, seconds)
+        if trace is not None:
+            trace.stages[name] = trace.stages.get(name, 0) + seconds
+
+    def start_request(self, **fields):
+        with self._lock:
+            self._in_progress += 1
+        return RequestTrace(**fields)
+
+    def finish_request(self, trace, outcome):
+        with self._lock:
+            self._in_progress -= 1
+        self.inc("requests_total", mode=trace.fields.get("mode", ""), outcome=outcome)
+        if self.trace_path:
+            record = trace.record()
+            record["outcome"] = outcome
+            line = json.dumps(record) + "\n"
+            with self._lock, open(self.trace_path, "a") as f:
+                f.write(line)
+
+    def _header(self, lines, name, kind):
+        full_name = f"{self.prefix}_{name}"
+        if name in DESCRIPTIONS:
+            lines.append(f"# HELP {full_name} {DESCRIPTIONS[name]}")
+        lines.append(f"# TYPE {full_name} {kind}")
+        return full_name
+
+    def render(self):
+        lines = []
+        with self._lock:
+            counters = {name: dict(series) for name, series in self._counters.items()}
+            histograms = {stage: list(values) for stage, values in self._histograms.items()}
+            in_progress = self._in_progress
+
+        full_name = self._header(lines, "stage_seconds", "histogram")
+        for stage, values in sorted(histograms.items()):
+            for bound, count in zip(self.buckets, values):
+                lines.append(f"{full_name}_bucket{_labels({'stage': stage, 'le': bound})} {count}")
+            lines.append(f"{full_name}_bucket{_labels({'stage': stage, 'le': '+Inf'})} {values[-1]}")
+            lines.append(f"{full_name}_sum{_labels({'stage': stage})} {_number(values[-2])}")
+            lines.append(f"{full_name}_count{_labels({'stage': stage})} {values[-1]}")
+
+        for name, series in sorted(counters.items()):
+            full_name = self._header(lines, name, "counter")
+            for key, value in sorted(series.items()):
+                lines.append(f"{full_name}{_labels(dict(key))} {_number(value)}")
+
+        full_name = self._header(lines, "requests_in_progress", "gauge")
+        lines.append(f"{full_name} {in_progress}")
+
+        for name, (kind, callback) in sorted(self._callbacks.items()):
+            try:
+                value = callback()
+            except Exception:
+                # a broken callback must not take the whole endpoint down
+                continue
+            full_name = self._header(lines, name, kind)
+            lines.append(f"{full_name} {_number(value)}")
+        return "\n".join(lines) + "\n"
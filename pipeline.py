@@ -0,0 +1,299 @@
+"""The synthesis stages behind predict, usable without the UI.
+
+language detection -> reference loading/cleanup -> speaker latents ->
+inference (direct, streamed or long-form) -> encoding/preview
+
+The model only needs the Xtts methods used here, so the stub model in
+stub_model.py can stand in for it in benchmarks and local tests."""
+import contextlib
+import functools
+import queue
+import threading
+import time
+
+import torch
+
+from audio_cleanup import cleanup_reference_audio
+from conditioning import LOAD_SR, ReferenceAudioError, audio_digest, load_reference_audio
+from dialogue import TURN_GAP, render_dialogue
+from language_detection import LanguageDetector
+from longform import segment_document, synthesize_document
+from prefix_cache import cached_inference
+from script_store import ScriptPlan, render_script
+from text_processing import char_limit, comma_fix, split_sentences
+
+SAMPLE_RATE = 24000
+# conditioning and sampling parameters used by the demo
+GPT_COND_LEN = 30
+GPT_COND_CHUNK_LEN = 4
+MAX_REF_LENGTH = 60
+REPETITION_PENALTY = 5.0
+TEMPERATURE = 0.75
+
+
+class SynthesisPipeline:
+    def __init__(
+        self,
+        model,
+        languages,
+        latent_cache,
+        result_cache=None,
+        batch_scheduler=None,
+        lock=None,
+        longform_workers=1,
+        metrics=None,
+        voice_bank=None,
+        script_store=None,
+        prefix_cache=None,
+    ):
+        self.model = model
+        self.languages = languages
+        self.language_detector = LanguageDetector(languages)
+        self.latent_cache = latent_cache
+        self.result_cache = result_cache
+        self.batch_scheduler = batch_scheduler
+        # one model call at a time, XTTS keeps per-call state on the GPT module
+        self.lock = lock or threading.Lock()
+        self.longform_workers = longform_workers
+        self.metrics = metrics
+        self.voice_bank = voice_bank
+        self.script_store = script_store
+        # conditioning prefix keys/values per voice, used by synthesize without a batch scheduler
+        self.prefix_cache = prefix_cache
+
+    @contextlib.contextmanager
+    def _model_turn(self):
+        # time spent waiting for the model is the queueing cost under load
+        t0 = time.perf_counter()
+        with self.lock:
+            if self.metrics is not None:
+                self.metrics.observe("model_wait", time.perf_counter() - t0)
+            yield
+
+    def detect_language(self, prompt):
+        return self.language_detector.detect(prompt)
+
+    def is_language_mismatch(self, prompt, language):
+        return self.language_detector.is_mismatch(prompt, language)
+
+    def load_reference(self, source):
+        """Only the part conditioning uses is decoded, source is a path or binary file object."""
+        return load_reference_audio(source, LOAD_SR, max_seconds=MAX_REF_LENGTH)
+
+    def cleanup_reference(self, reference_audio):
+        return cleanup_reference_audio(reference_audio, LOAD_SR)
+
+    def speaker_latents(self, reference_audio):
+        """Returns (gpt_cond_latent, speaker_embedding, cache source, compute time)."""
+        return self.latent_cache.get_or_compute(
+            self.model,
+            reference_audio,
+            LOAD_SR,
+            gpt_cond_len=GPT_COND_LEN,
+            gpt_cond_chunk_len=GPT_COND_CHUNK_LEN,
+            max_ref_length=MAX_REF_LENGTH,
+        )
+
+    def has_voice(self, voice_id):
+        return self.voice_bank is not None and voice_id in self.voice_bank
+
+    def voice_latents(self, voice_id):
+        """(gpt_cond_latent, speaker_embedding) of a voice bank voice, no audio is decoded."""
+        return self.voice_bank.get(voice_id, self.model.device)
+
+    def voice_digest(self, reference_audio=None, voice_id=None):
+        """What identifies the voice in cache keys."""
+        return self.voice_bank.digest(voice_id) if voice_id is not None else audio_digest(reference_audio)
+
+    def result_key(self, prompt, language, reference_audio=None, voice_id=None):
+        if self.result_cache is None:
+            return None
+        return self.result_cache.key(
+            prompt,
+            language,
+            self.voice_digest(reference_audio, voice_id),
+            repetition_penalty=REPETITION_PENALTY,
+            temperature=TEMPERATURE,
+        )
+
+    def prepare_text(self, text, language, mode="direct"):
+        """Runs the text front-end for every text the given mode (direct, stream or
+        longform) will hand to the model, so inference finds the tokens cached."""
+        encode_many = getattr(self.model.tokenizer, "encode_many", None)
+        if encode_many is None:
+            return
+        if mode == "stream":
+            texts = split_sentences(text, char_limit(self.model, language))
+        elif mode == "longform":
+            texts = [segment.text for segment in segment_document(text, char_limit(self.model, language))]
+        else:
+            texts = [text]
+        # the form Xtts.inference encodes
+        encode_many([comma_fix(text).strip().lower() for text in texts], language)
+
+    def synthesize(self, text, language, gpt_cond_latent, speaker_embedding, seed=None):
+        """Full waveform (float numpy array at SAMPLE_RATE) for text."""
+        text = comma_fix(text)
+        if self.batch_scheduler is not None:
+            # waits for the batch this request is grouped into, batched sampling cannot be seeded per request
+            return self.batch_scheduler.submit(
+                text,
+                language,
+                gpt_cond_latent,
+                speaker_embedding,
+                repetition_penalty=REPETITION_PENALTY,
+                temperature=TEMPERATURE,
+            )
+        with self._model_turn():
+            if seed is not None:
+                torch.manual_seed(seed)
+            inference = self.model.inference
+            if self.prefix_cache is not None:
+                inference = functools.partial(cached_inference, self.model, self.prefix_cache)
+            out = inference(
+                text,
+                language,
+                gpt_cond_latent,
+                speaker_embedding,
+                repetition_penalty=REPETITION_PENALTY,
+                temperature=TEMPERATURE,
+            )
+        return out["wav"]
+
+    def stream(self, text, language, gpt_cond_latent, speaker_embedding, stop=None, on_done=None):
+        """Yields 1-D CPU tensors sentence by sentence, as the vocoder produces them.
+
+        A producer thread takes the model lock per sentence and queues the chunks, so the
+        lock is never held while a chunk waits for a slow client. Setting the stop event
+        (or closing the generator) ends generation at the next chunk. on_done(seconds) is
+        called from the producer when it is through, with the seconds it held the model,
+        before the consumer sees the end of the stream."""
+        stop = stop or threading.Event()
+        chunks = queue.Queue()
+
+        def produce():
+            model_seconds = 0.0
+            try:
+                for sentence in split_sentences(text, char_limit(self.model, language)):
+                    if stop.is_set():
+                        break
+                    with self._model_turn():
+                        t0 = time.perf_counter()
+                        sentence_chunks = self.model.inference_stream(
+                            comma_fix(sentence),
+                            language,
+                            gpt_cond_latent,
+                            speaker_embedding,
+                            repetition_penalty=REPETITION_PENALTY,
+                            temperature=TEMPERATURE,
+                        )
+                        with contextlib.closing(sentence_chunks):
+                            for chunk in sentence_chunks:
+                                chunks.put(chunk.squeeze().cpu())
+                                if stop.is_set():
+                                    break
+                        model_seconds += time.perf_counter() - t0
+            except BaseException as e:
+                chunks.put(e)
+            finally:
+                try:
+                    if on_done is not None:
+                        on_done(model_seconds)
+                finally:
+                    chunks.put(None)
+
+        threading.Thread(target=produce, name="stream", daemon=True).start()
+        try:
+            while True:
+                chunk = chunks.get()
+                if chunk is None:
+                    return
+                if isinstance(chunk, BaseException):
+                    raise chunk
+                yield chunk
+        finally:
+            stop.set()
+
+    def render_document(self, text, language, gpt_cond_latent, speaker_embedding, path, progress=None):
+        """Long-form synthesis into the WAV file at path, returns its duration in seconds."""
+        return synthesize_document(
+            text,
+            char_limit(self.model, language),
+            lambda segment: self.synthesize(segment, language, gpt_cond_latent, speaker_embedding),
+            path,
+            sample_rate=SAMPLE_RATE,
+            workers=self.longform_workers,
+            progress=progress,
+        )
+
+    def plan_script(self, text, language, voice_digest, seed=0):
+        """Which segments of a script are in the script store already and which need rendering."""
+        return ScriptPlan(
+            text,
+            char_limit(self.model, language),
+            self.script_store,
+            lambda segment: self.script_store.key(
+                segment,
+                language,
+                voice_digest,
+                seed,
+                repetition_penalty=REPETITION_PENALTY,
+                temperature=TEMPERATURE,
+            ),
+        )
+
+    def render_script(self, plan, language, gpt_cond_latent, speaker_embedding, path, seed=0, progress=None):
+        """Renders what plan is missing and stitches the script into the WAV file at path, returns its duration."""
+        return render_script(
+            plan,
+            # seeded per segment, so a segment sounds the same whatever was rendered before it
+            lambda segment: self.synthesize(segment, language, gpt_cond_latent, speaker_embedding, seed=seed),
+            path,
+            sample_rate=SAMPLE_RATE,
+            workers=self.longform_workers,
+            progress=progress,
+        )
+
+    def prepare_dialogue(self, turns, references):
+        """Conditioning of every speaker of a dialogue, computed once per speaker, and the text
+        front-end of every turn. A speaker is a voice bank id or a key of references (id ->
+        reference path or file). Raises ValueError for unknown speakers and languages, and
+        ReferenceAudioError (a ValueError) for references that cannot be decoded or encoded."""
+        for number, turn in enumerate(turns, 1):
+            if turn.language not in self.languages:
+                raise ValueError(f"Turn {number} has an unsupported language {turn.language}")
+        latents = {}
+        for turn in turns:
+            if turn.speaker in latents:
+                continue
+            if self.has_voice(turn.speaker):
+                latents[turn.speaker] = self.voice_latents(turn.speaker)
+            elif turn.speaker in references:
+                try:
+                    gpt_cond_latent, speaker_embedding, _, _ = self.speaker_latents(
+                        self.load_reference(references[turn.speaker])
+                    )
+                except Exception as e:
+                    # torchaudio raises RuntimeError for a corrupt upload
+                    raise ReferenceAudioError(f"Speaker {turn.speaker!r}: {e}") from e
+                latents[turn.speaker] = (gpt_cond_latent, speaker_embedding)
+            else:
+                raise ValueError(f"Unknown speaker {turn.speaker!r}")
+        for turn in turns:
+            self.prepare_text(turn.text, turn.language, mode="longform")
+        return latents
+
+    def render_dialogue(self, turns, latents, path, gap=TURN_GAP, progress=None):
+        """Renders the turns grouped by speaker and language and stitches them in order into the
+        WAV file at path, latents are prepare_dialogue's. Returns the turn timeline."""
+        return render_dialogue(
+            turns,
+            latents,
+            lambda segment, language, voice: self.synthesize(segment, language, *voice),
+            path,
+            lambda language: char_limit(self.model, language),
+            sample_rate=SAMPLE_RATE,
+            gap=gap,
+            workers=self.longform_workers,
+            progress=progress,
+        )
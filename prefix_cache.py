@@ -0,0 +1,169 @@
+"""Reuse of the speaker conditioning prefix across sentences and requests.
+
+Xtts.inference feeds the conditioning latents through the GPT in front of
+every sentence, so their attention keys and values are recomputed for each
+sentence of each request. The GPT is causal and has no positional embedding
+of its own (the text and audio embeddings carry their positions), so the
+keys and values of the conditioning positions only depend on the latents.
+PrefixKVCache computes them once per voice and keeps them in a bounded LRU.
+
+cached_inference is Xtts.inference with the code sampling loop written out:
+it starts from the cached prefix and runs the text and the audio tokens
+only. Sampling repeats what generate(do_sample=True) does step by step
+(repetition penalty, temperature, top-k, top-p, multinomial), so the logits
+match the uncached path up to float rounding and a seeded run draws the same
+codes. The latents pass and the vocoder are unchanged. Options the loop does
+not reproduce (a length penalty, speed, greedy or beam search, other
+generate() arguments) run model.inference uncached instead."""
+import copy
+import hashlib
+
+import torch
+import torch.nn.functional as F
+
+from cache import LRUCache
+
+# Xtts.inference options the sampling loop matches only at these values
+LOOP_DEFAULTS = {"length_penalty": 1.0, "do_sample": True, "num_beams": 1, "speed": 1.0, "enable_text_splitting": False}
+
+
+def _past_nbytes(past):
+    if not isinstance(past, tuple):
+        past = past.to_legacy_cache()
+    return sum(tensor.numel() * tensor.element_size() for layer in past for tensor in layer)
+
+
+def fresh_past(past):
+    # tuples of tensors are never modified by the model, Cache objects grow in place
+    return past if isinstance(past, tuple) else copy.deepcopy(past)
+
+
+def past_length(past):
+    return past[0][0].shape[-2] if isinstance(past, tuple) else past.get_seq_length()
+
+
+class PrefixKVCache:
+    """GPT past key/values over a voice's conditioning latents, keyed by the latents."""
+
+    def __init__(self, max_bytes=256 * 1024 * 1024):
+        self._cache = LRUCache(max_bytes, sizeof=_past_nbytes)
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, gpt_cond_latent):
+        return hashlib.sha256(gpt_cond_latent.detach().float().cpu().numpy().tobytes()).hexdigest()
+
+    def get_or_compute(self, gpt, gpt_cond_latent):
+        key = self.key(gpt_cond_latent)
+        past = self._cache.get(key)
+        if past is not None:
+            self.hits += 1
+            return past
+        self.misses += 1
+        out = gpt.gpt(inputs_embeds=gpt_cond_latent, use_cache=True, return_dict=True)
+        past = out.past_key_values
+        self._cache.put(key, past)
+        return past
+
+    def __len__(self):
+        return len(self._cache)
+
+
+def _process_logits(logits, input_ids, temperature, top_k, top_p, repetition_penalty):
+    # the order generate() applies them in: processors, then warpers
+    score = torch.gather(logits, 1, input_ids)
+    score = torch.where(score < 0, score * repetition_penalty, score / repetition_penalty)
+    logits = logits.scatter(1, input_ids, score)
+    logits = logits / temperature
+    top_k = min(top_k, logits.shape[-1])
+    logits = logits.masked_fill(logits < torch.topk(logits, top_k)[0][..., -1, None], -float("inf"))
+    sorted_logits, sorted_indices = torch.sort(logits, descending=False)
+    sorted_to_remove = sorted_logits.softmax(dim=-1).cumsum(dim=-1) <= (1 - top_p)
+    sorted_to_remove[..., -1:] = False
+    return logits.masked_fill(sorted_to_remove.scatter(1, sorted_indices, sorted_to_remove), -float("inf"))
+
+
+def sample_codes(gpt, past, text_tokens, temperature=0.75, top_k=50, top_p=0.85, repetition_penalty=5.0):
+    """Audio codes for text_tokens, continuing from the conditioning prefix past.
+
+    Returns them with the stop token, like GPT.generate."""
+    inference = gpt.gpt_inference
+    device = text_tokens.device
+    text_inputs = F.pad(text_tokens, (0, 1), value=gpt.stop_text_token)
+    text_inputs = F.pad(text_inputs, (1, 0), value=gpt.start_text_token)
+    text_emb = gpt.text_embedding(text_inputs) + gpt.text_pos_embedding(text_inputs)
+    # the placeholder ids generate() sees for the prefix, the repetition penalty applies to them too
+    prefix_len = past_length(past) + text_emb.shape[1]
+    input_ids = torch.full((1, prefix_len + 1), fill_value=1, dtype=torch.long, device=device)
+    input_ids[:, -1] = gpt.start_audio_token
+
+    start = torch.full((1, 1), gpt.start_audio_token, dtype=torch.long, device=device)
+    start_emb = inference.embeddings(start)
+    emb = torch.cat([text_emb, start_emb + inference.pos_embedding(start_emb)], dim=1)
+    past = fresh_past(past)
+    codes = []
+    for step in range(gpt.max_gen_mel_tokens):
+        out = gpt.gpt(inputs_embeds=emb, past_key_values=past, use_cache=True, return_dict=True)
+        past = out.past_key_values
+        logits = inference.lm_head(out.last_hidden_state[:, -1, :]).float()
+        logits = _process_logits(logits, input_ids, temperature, top_k, top_p, repetition_penalty)
+        token = torch.multinomial(F.softmax(logits, dim=-1), num_samples=1)
+        codes.append(token)
+        input_ids = torch.cat([input_ids, token], dim=1)
+        if token.item() == gpt.stop_audio_token:
+            break
+        emb = inference.embeddings(token) + inference.pos_embedding.get_fixed_embedding(step + 1, device)
+    return torch.cat(codes, dim=1)
+
+
+@torch.inference_mode()
+def cached_inference(
+    model,
+    prefix_cache,
+    text,
+    language,
+    gpt_cond_latent,
+    speaker_embedding,
+    temperature=0.75,
+    top_k=50,
+    top_p=0.85,
+    repetition_penalty=5.0,
+    **kwargs,
+):
+    """Xtts.inference for one sentence, starting from the voice's cached prefix."""
+    if any(key not in LOOP_DEFAULTS or value != LOOP_DEFAULTS[key] for key, value in kwargs.items()):
+        return model.inference(
+            text,
+            language,
+            gpt_cond_latent,
+            speaker_embedding,
+            temperature=temperature,
+            top_k=top_k,
+            top_p=top_p,
+            repetition_penalty=repetition_penalty,
+            **kwargs,
+        )
+    gpt = model.gpt
+    device = model.device
+    language = language.split("-")[0]  # remove the country code
+    text = text.strip().lower()
+    text_tokens = torch.IntTensor(model.tokenizer.encode(text, lang=language)).unsqueeze(0).to(device)
+    assert (
+        text_tokens.shape[-1] < model.args.gpt_max_text_tokens
+    ), " ❗ XTTS can only generate text with a maximum of 400 tokens."
+    gpt_cond_latent = gpt_cond_latent.to(device)
+    past = prefix_cache.get_or_compute(gpt, gpt_cond_latent)
+    gpt_codes = sample_codes(gpt, past, text_tokens, temperature, top_k, top_p, repetition_penalty)
+    expected_output_len = torch.tensor([gpt_codes.shape[-1] * gpt.code_stride_len], device=device)
+    text_len = torch.tensor([text_tokens.shape[-1]], device=device)
+    gpt_latents = gpt(
+        text_tokens,
+        text_len,
+        gpt_codes,
+        expected_output_len,
+        cond_latents=gpt_cond_latent,
+        return_attentions=False,
+        return_latent=True,
+    )
+    wav = model.hifigan_decoder(gpt_latents, g=speaker_embedding.to(device))
+    return {"wav": wav.cpu().numpy().squeeze()}
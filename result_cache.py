@@ -0,0 +1,51 @@
+"""Opt-in cache of synthesized audio.
+
+Outputs are keyed on everything that determines them: the normalized
+prompt, language, reference audio hash, sampling parameters and the fixed
+seed used while the cache is enabled. Encoded audio is kept in a memory LRU
+in front of an optional size-bounded disk tier."""
+import hashlib
+import unicodedata
+
+from cache import DiskCache, LRUCache
+
+
+def normalize_prompt(text):
+    return unicodedata.normalize("NFC", " ".join(text.split()))
+
+
+class ResultCache:
+    def __init__(self, max_bytes=64 * 1024 * 1024, cache_dir=None, max_disk_bytes=None, seed=0):
+        self.seed = seed
+        self.memory = LRUCache(max_bytes)
+        self.disk = DiskCache(cache_dir, max_bytes=max_disk_bytes, suffix=".wav") if cache_dir else None
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, prompt, language, reference_digest, **params):
+        digest = hashlib.sha256()
+        digest.update(normalize_prompt(prompt).encode())
+        digest.update(f"|{language}|{reference_digest}|seed={self.seed}".encode())
+        for name in sorted(params):
+            digest.update(f"|{name}={params[name]}".encode())
+        return digest.hexdigest()
+
+    def get(self, key):
+        """Returns (encoded audio, "memory" or "disk"), or None on a miss."""
+        data = self.memory.get(key)
+        source = "memory"
+        if data is None and self.disk is not None:
+            data = self.disk.get(key)
+            source = "disk"
+            if data is not None:
+                self.memory.put(key, data)
+        if data is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return data, source
+
+    def put(self, key, data):
+        self.memory.put(key, data)
+        if self.disk is not None:
+            self.disk.put(key, data)
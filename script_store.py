@@ -0,0 +1,87 @@
+"""Incremental re-synthesis of edited scripts.
+
+A script is segmented like a long-form document. The audio of every segment
+is kept in a content-addressed store under a hash of everything that
+determines it: the segment text, language, voice, sampling parameters and
+seed. Rendering a resubmitted script only synthesizes the segments that are
+not in the store yet, then stitches the whole file from stored segments, so
+the work follows the size of the edit rather than the length of the script.
+
+Pauses and crossfades are applied while stitching, a segment's audio does
+not depend on its neighbours."""
+import hashlib
+
+from audio_io import decode_wav, encode_wav
+from cache import DiskCache
+from longform import WavStitcher, render_in_order, segment_document
+from result_cache import normalize_prompt
+
+
+class SegmentStore:
+    """Segment audio on disk by content hash, least recently used segments are evicted past max_bytes."""
+
+    def __init__(self, directory, max_bytes=None, sample_rate=24000):
+        self.sample_rate = sample_rate
+        self.disk = DiskCache(directory, max_bytes=max_bytes, suffix=".wav")
+
+    def key(self, text, language, voice_digest, seed, **params):
+        digest = hashlib.sha256()
+        digest.update(normalize_prompt(text).encode())
+        digest.update(f"|{language}|{voice_digest}|seed={seed}".encode())
+        for name in sorted(params):
+            digest.update(f"|{name}={params[name]}".encode())
+        return digest.hexdigest()
+
+    def get(self, key):
+        data = self.disk.get(key)
+        return decode_wav(data)[1] if data is not None else None
+
+    def put(self, key, wav):
+        self.disk.put(key, encode_wav(wav, self.sample_rate))
+
+    def __contains__(self, key):
+        return key in self.disk
+
+
+class ScriptPlan:
+    """The segments of a script, their store keys and the ones that still need rendering."""
+
+    def __init__(self, text, max_chars, store, key_for):
+        self.store = store
+        self.segments = segment_document(text, max_chars)
+        self.keys = [key_for(segment.text) for segment in self.segments]
+        # a sentence repeated in the script is rendered once
+        first = {}
+        for segment, key in zip(self.segments, self.keys):
+            first.setdefault(key, segment)
+        self.missing = {key: segment for key, segment in first.items() if key not in store}
+
+    @property
+    def missing_text(self):
+        return "\n\n".join(segment.text for segment in self.missing.values())
+
+
+def render_script(plan, render, path, sample_rate=24000, workers=1, progress=None):
+    """Renders the missing segments of plan into the store, then stitches the
+    script into the WAV file at path. Returns its duration in seconds.
+
+    progress(done, total) is called after every rendered segment."""
+    missing = list(plan.missing.items())
+    rendered = render_in_order([segment for _, segment in missing], render, workers)
+    for i, ((key, _), wav) in enumerate(zip(missing, rendered)):
+        plan.store.put(key, wav)
+        if progress is not None:
+            progress(i + 1, len(missing))
+
+    stitcher = WavStitcher(path, sample_rate)
+    try:
+        for segment, key in zip(plan.segments, plan.keys):
+            wav = plan.store.get(key)
+            if wav is None:
+                # evicted since it was checked, the store is too small for this script
+                wav = render(segment.text)
+                plan.store.put(key, wav)
+            stitcher.add(wav, segment.pause_after)
+    finally:
+        stitcher.close()
+    return stitcher.samples_written / sample_rate
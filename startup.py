@@ -0,0 +1,182 @@
+"""Startup of the space.
+
+One-time setup steps (unidic dictionary, model download) are skipped when a
+marker shows they already completed for the files on disk, and the model is
+loaded in a background thread so the UI is served while it loads. Callers
+check `Startup.is_ready()` before using the model."""
+import contextlib
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+import traceback
+
+from device import deepspeed_available, quantize_int8
+
+MARKER_DIR = os.environ.get(
+    "STARTUP_MARKER_DIR", os.path.join(os.path.expanduser("~"), ".cache", "xtts-space")
+)
+MODEL_FILES = ("config.json", "model.pth", "vocab.json")
+
+
+def files_fingerprint(paths):
+    # size and mtime, cheap enough to check on every start; None if a file is missing
+    digest = hashlib.sha256()
+    for path in paths:
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return None
+        digest.update(f"{path}:{st.st_size}:{st.st_mtime_ns}".encode())
+    return digest.hexdigest()
+
+
+def _marker_path(step):
+    return os.path.join(MARKER_DIR, step.replace("/", "--") + ".json")
+
+
+def is_step_done(step, fingerprint):
+    if fingerprint is None:
+        return False
+    try:
+        with open(_marker_path(step)) as f:
+            return json.load(f).get("fingerprint") == fingerprint
+    except (FileNotFoundError, ValueError):
+        return False
+
+
+def mark_step_done(step, fingerprint):
+    os.makedirs(MARKER_DIR, exist_ok=True)
+    with open(_marker_path(step), "w") as f:
+        json.dump({"fingerprint": fingerprint, "time": time.time()}, f)
+
+
+def ensure_unidic():
+    """Downloads the unidic dictionary mecab needs for Japanese, once."""
+    import unidic
+
+    mecabrc = os.path.join(unidic.DICDIR, "mecabrc")
+    if is_step_done("unidic", files_fingerprint([mecabrc])):
+        return False
+    subprocess.run([sys.executable, "-m", "unidic", "download"], check=True)
+    mark_step_done("unidic", files_fingerprint([mecabrc]))
+    return True
+
+
+def ensure_model(model_name):
+    """Returns the local model directory, downloading the model only when its
+    files changed or are missing since the last successful download."""
+    from TTS.utils.generic_utils import get_user_data_dir
+
+    model_path = os.path.join(get_user_data_dir("tts"), model_name.replace("/", "--"))
+    model_files = [os.path.join(model_path, name) for name in MODEL_FILES]
+    if not is_step_done(model_name, files_fingerprint(model_files)):
+        from TTS.utils.manage import ModelManager
+
+        print("Downloading if not downloaded Coqui XTTS V2")
+        ModelManager().download_model(model_name)
+        mark_step_done(model_name, files_fingerprint(model_files))
+        print("XTTS downloaded")
+    return model_path
+
+
+def load_model(model_path, device="cuda", quantize=False):
+    from TTS.tts.configs.xtts_config import XttsConfig
+    from TTS.tts.models.xtts import Xtts
+
+    config = XttsConfig()
+    config.load_json(os.path.join(model_path, "config.json"))
+
+    model = Xtts.init_from_config(config)
+    model.load_checkpoint(
+        config,
+        checkpoint_path=os.path.join(model_path, "model.pth"),
+        vocab_path=os.path.join(model_path, "vocab.json"),
+        eval=True,
+        use_deepspeed=device == "cuda" and deepspeed_available(),
+    )
+    if device == "cpu" and quantize:
+        quantize_int8(model)
+    model.to(device)
+    return model, config
+
+
+class Startup:
+    """Runs the startup phases in a background thread.
+
+    on_ready(model, config) is called once the model is loaded and before the
+    optional warmup(model) runs; the startup only reports ready after both.
+    loader(model_path, device, quantize) replaces load_model, e.g. with a
+    worker pool."""
+
+    def __init__(self, model_name, device="cuda", quantize=False, on_ready=None, warmup=None, loader=load_model):
+        self.model_name = model_name
+        self.device = device
+        self.quantize = quantize
+        self.loader = loader
+        self.on_ready = on_ready
+        self.warmup = warmup
+        self.model = None
+        self.config = None
+        self.state = "starting"
+        self.error = None
+        self.timings = {}
+        self._ready = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="startup", daemon=True)
+
+    def start(self):
+        self._started = time.time()
+        self._thread.start()
+
+    def is_ready(self):
+        return self._ready.is_set()
+
+    def wait(self, timeout=None):
+        return self._ready.wait(timeout)
+
+    @contextlib.contextmanager
+    def _phase(self, name):
+        self.state = name
+        t0 = time.time()
+        yield
+        self.timings[name] = time.time() - t0
+        print(f"Startup phase {name}: {self.timings[name]:.2f} seconds")
+
+    def _run(self):
+        try:
+            with self._phase("unidic"):
+                ensure_unidic()
+            with self._phase("download"):
+                model_path = ensure_model(self.model_name)
+            with self._phase("load"):
+                self.model, self.config = self.loader(model_path, self.device, self.quantize)
+            if self.on_ready is not None:
+                self.on_ready(self.model, self.config)
+            if self.warmup is not None:
+                with self._phase("warmup"):
+                    try:
+                        self.warmup(self.model)
+                    except Exception:
+                        # a failed warm-up only costs the first request its speed
+                        print("Warm-up failed")
+                        traceback.print_exc()
+        except Exception as e:
+            self.state = "failed"
+            self.error = str(e)
+            print("Startup failed")
+            traceback.print_exc()
+            return
+        self.state = "ready"
+        self.timings["total"] = time.time() - self._started
+        print(f"Startup ready after {self.timings['total']:.2f} seconds")
+        self._ready.set()
+
+    def status_text(self):
+        if self.state == "failed":
+            return f"Model failed to load: {self.error}"
+        if self.state == "ready":
+            return "Model ready"
+        return f"Model is loading ({self.state}), please wait"
@@ -0,0 +1,63 @@
+"""CPU stand-in for the Xtts model.
+
+Implements the part of the Xtts interface the pipeline uses, returns
+deterministic tensors of the right shapes and simulates model time with
+sleeps proportional to the audio produced, so the pipeline can be
+benchmarked and tested without a GPU or the model download."""
+import hashlib
+import time
+
+import numpy as np
+import torch
+
+SAMPLE_RATE = 24000
+
+
+class StubTokenizer:
+    char_limits = {}
+
+    def encode(self, text, lang):
+        return [ord(c) % 6000 for c in text]
+
+
+class StubXtts:
+    def __init__(self, rtf=0.05, seconds_per_char=0.065, encoder_rtf=0.005, stream_chunk_seconds=0.5):
+        # rtf: simulated generation seconds per second of audio
+        self.rtf = rtf
+        self.seconds_per_char = seconds_per_char
+        # simulated speaker encoder seconds per second of reference audio
+        self.encoder_rtf = encoder_rtf
+        self.stream_chunk_seconds = stream_chunk_seconds
+        self.device = torch.device("cpu")
+        self.tokenizer = StubTokenizer()
+
+    def get_speaker_embedding(self, audio, sr):
+        time.sleep(audio.shape[-1] / sr * self.encoder_rtf)
+        return torch.full((1, 512, 1), float(audio.abs().mean()))
+
+    def get_gpt_cond_latents(self, audio, sr, length=30, chunk_length=6):
+        time.sleep(min(audio.shape[-1] / sr, length) * self.encoder_rtf)
+        return torch.full((1, 32, 1024), float(audio.std()))
+
+    def _waveform(self, text):
+        seconds = max(len(text) * self.seconds_per_char, 0.3)
+        # a text dependent tone, so different prompts give different audio
+        frequency = 100 + int(hashlib.sha256(text.encode()).hexdigest()[:4], 16) % 300
+        t = np.arange(int(seconds * SAMPLE_RATE), dtype=np.float32) / SAMPLE_RATE
+        return (0.3 * np.sin(2 * np.pi * frequency * t)).astype(np.float32)
+
+    def inference(self, text, language, gpt_cond_latent, speaker_embedding, **kwargs):
+        # Xtts tokenizes the same way, so text front-end caching shows up here too
+        self.tokenizer.encode(text.strip().lower(), lang=language)
+        wav = self._waveform(text)
+        time.sleep(len(wav) / SAMPLE_RATE * self.rtf)
+        return {"wav": wav}
+
+    def inference_stream(self, text, language, gpt_cond_latent, speaker_embedding, **kwargs):
+        self.tokenizer.encode(text.strip().lower(), lang=language)
+        wav = torch.from_numpy(self._waveform(text))
+        chunk_size = int(self.stream_chunk_seconds * SAMPLE_RATE)
+        for start in range(0, len(wav), chunk_size):
+            chunk = wav[start : start + chunk_size]
+            time.sleep(len(chunk) / SAMPLE_RATE * self.rtf)
+            yield chunk
@@ -0,0 +1,108 @@
+"""The /v1 API against the CPU stub model.
+
+    python -m pytest tests
+"""
+import os
+import sys
+
+import pytest
+
+pytest.importorskip("httpx")  # fastapi's TestClient
+
+from fastapi.testclient import TestClient  # noqa: E402
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from admission import AdmissionQueue, CostModel  # noqa: E402
+from api import bundled_voices, create_app  # noqa: E402
+from conditioning import SpeakerLatentCache  # noqa: E402
+from pipeline import SynthesisPipeline  # noqa: E402
+from stub_model import StubXtts  # noqa: E402
+
+TEXT = "Hello there. This is a test of the stub model."
+
+
+@pytest.fixture(scope="module")
+def pipeline():
+    return SynthesisPipeline(StubXtts(rtf=0, encoder_rtf=0), ["en", "es"], SpeakerLatentCache())
+
+
+@pytest.fixture
+def admission():
+    return AdmissionQueue(slots=1, slo_seconds=30)
+
+
+@pytest.fixture
+def client(pipeline, admission):
+    app = create_app(
+        lambda: pipeline,
+        voices=bundled_voices(os.path.join(ROOT, "examples")),
+        admission=admission,
+        cost_model=CostModel(),
+    )
+    with TestClient(app) as client:
+        yield client
+
+
+def tts(client, **data):
+    return client.post("/v1/tts", data={"text": TEXT, "language": "en", "voice": "female", **data})
+
+
+def test_tts_returns_wav(client):
+    response = tts(client)
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "audio/wav"
+    assert response.content[:4] == b"RIFF"
+
+
+@pytest.mark.parametrize(
+    "data",
+    [
+        {"format": "ogg"},
+        {"format": "opus", "sample_rate": "44100"},
+        {"format": "mp3", "bitrate": "0"},
+        {"voice": "nobody"},
+        {"text": "x"},
+        {"language": "xx"},
+    ],
+)
+def test_tts_rejects_bad_requests(client, data):
+    assert tts(client, **data).status_code == 400
+
+
+def test_dialogue_rejects_unknown_speaker(client):
+    response = client.post("/v1/dialogue", data={"script": "nobody: Hello there.", "language": "en"})
+    assert response.status_code == 400
+
+
+def test_tts_rejects_over_the_slo(client, admission):
+    # a long job holding the only slot puts the estimated queue time over the SLO
+    ticket = admission.acquire(3600)
+    try:
+        response = tts(client)
+    finally:
+        admission.release(ticket)
+    assert response.status_code == 429
+    assert int(response.headers["retry-after"]) > 0
+    assert tts(client).status_code == 200
+
+
+def test_streamed_tts(client, admission):
+    with client.stream("POST", "/v1/tts", data={"text": TEXT, "language": "en", "voice": "female", "stream": "true"}) as response:
+        assert response.status_code == 200
+        body = b"".join(response.iter_bytes())
+    assert body[:4] == b"RIFF"
+    # the 44 byte header and 16-bit samples
+    assert len(body) > 44 and (len(body) - 44) % 2 == 0
+    assert client.get("/v1/health").json()["in_flight"] == 0
+    assert admission.drain_seconds() == 0
+
+
+def test_dialogue_timeline(client):
+    script = "female: Hello there.\nmale [es]: Hola, ¿qué tal?\nfemale: Fine, thanks."
+    response = client.post("/v1/dialogue", data={"script": script, "language": "en"})
+    assert response.status_code == 200
+    turns = response.json()["turns"]
+    assert [turn["speaker"] for turn in turns] == ["female", "male", "female"]
+    assert all(a["end"] <= b["start"] for a, b in zip(turns, turns[1:]))
@@ -0,0 +1,47 @@
+"""Memoized text front-end in front of the XTTS tokenizer.
+
+VoiceBpeTokenizer.encode normalizes, romanizes or segments (cutlet/MeCab for
+Japanese, pypinyin for Chinese, hangul romanization for Korean) and then
+BPE-encodes every text it is given, even a prompt it saw a second before.
+CachedTokenizer replaces model.tokenizer and keeps the token ids per
+(language, text) in a bounded LRU, so model.inference, inference_stream and
+the batch scheduler reuse them. encode_many encodes all sentences of a
+request up front, outside the model lock, where the time is measured as its
+own stage."""
+import time
+
+from cache import LRUCache
+
+
+class CachedTokenizer:
+    def __init__(self, tokenizer, max_entries=4096, metrics=None):
+        self.tokenizer = tokenizer
+        self.metrics = metrics
+        # bounded by entry count, token lists of a sentence are small
+        self._cache = LRUCache(max_entries, sizeof=lambda ids: 1)
+
+    def __getattr__(self, name):
+        # char_limits, preprocess_text, check_input_length... of the wrapped tokenizer
+        return getattr(self.tokenizer, name)
+
+    def encode(self, txt, lang):
+        # VoiceBpeTokenizer.encode drops the region itself: prepare_text passes "zh-cn", inference "zh"
+        key = (lang.split("-")[0], txt)
+        ids = self._cache.get(key)
+        if self.metrics is not None:
+            self.metrics.inc("cache_lookups_total", cache="text_frontend", result="memory" if ids is not None else "miss")
+        if ids is None:
+            t0 = time.perf_counter()
+            ids = self.tokenizer.encode(txt, lang)
+            if self.metrics is not None:
+                self.metrics.observe("text_frontend_encode", time.perf_counter() - t0)
+            self._cache.put(key, ids)
+        # callers wrap the list in a tensor, they never modify it
+        return ids
+
+    def encode_many(self, texts, lang):
+        """Token ids of every text as a dict, the ones seen before are not encoded again."""
+        return {txt: self.encode(txt, lang) for txt in texts}
+
+    def __len__(self):
+        return len(self._cache)
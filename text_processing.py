@@ -0,0 +1,58 @@
+"""Text helpers shared by the synthesis paths."""
+import re
+
+# sentence enders for latin and CJK scripts, kept attached to their sentence
+SENTENCE_END_RE = re.compile(r"(?<=[.!?。！？])\s+|(?<=[。！？])")
+# places to break an overlong sentence, strongest first
+SOFT_BREAK_RES = [re.compile(r"(?<=[,;:，、；：])\s*"), re.compile(r"\s+")]
+# a word followed by a sentence end, see comma_fix
+COMMA_FIX_RE = re.compile(r"([^\x00-\x7F]|\w)(\.|。|\?)")
+
+# fallback when the tokenizer has no per-language character limit
+DEFAULT_CHAR_LIMIT = 250
+
+
+def _split_long(sentence, max_chars):
+    if len(sentence) <= max_chars:
+        return [sentence]
+    for break_re in SOFT_BREAK_RES:
+        parts = [p for p in break_re.split(sentence) if p]
+        if len(parts) > 1:
+            break
+    else:
+        # no natural break point (e.g. unspaced CJK), cut hard
+        return [sentence[i : i + max_chars] for i in range(0, len(sentence), max_chars)]
+
+    pieces = []
+    current = ""
+    for part in parts:
+        candidate = f"{current} {part}".strip() if current else part
+        if len(candidate) <= max_chars:
+            current = candidate
+            continue
+        if current:
+            pieces.append(current)
+        current = part
+    if current:
+        pieces.append(current)
+    return [p for piece in pieces for p in _split_long(piece, max_chars)]
+
+
+def comma_fix(text):
+    # temporary comma fix
+    return COMMA_FIX_RE.sub(r"\1 \2\2", text)
+
+
+def split_sentences(text, max_chars=DEFAULT_CHAR_LIMIT):
+    sentences = []
+    for sentence in SENTENCE_END_RE.split(text):
+        sentence = sentence.strip()
+        if sentence:
+            sentences.extend(_split_long(sentence, max_chars))
+    return sentences
+
+
+def char_limit(model, language):
+    limits = getattr(model.tokenizer, "char_limits", None) or {}
+    # the tokenizer keys some languages without country code (zh-cn -> zh)
+    return limits.get(language, limits.get(language.split("-")[0], DEFAULT_CHAR_LIMIT))
@@ -0,0 +1,219 @@
+"""Precomputed voice bank.
+
+Speaker latents for a catalogue of reference voices are computed once in a
+batch and stored in one memory-mapped file of fixed-size rows (the GPT
+conditioning latent followed by the speaker embedding) plus a JSON index
+from voice id to row. Serving a bank voice is a row lookup with no audio
+decoding or encoder pass.
+
+    python voice_bank.py REFERENCE_DIR BANK_DIR [--workers 4] [--cleanup] [--half]
+
+Voice ids are the reference file names without extension. Incremental runs
+only recompute voices whose file content or conditioning parameters changed
+and drop voices whose file is gone."""
+import argparse
+import hashlib
+import json
+import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import torch
+
+from audio_cleanup import cleanup_reference_audio
+from conditioning import LOAD_SR, compute_conditioning_latents, load_reference_audio
+
+INDEX_FILE = "index.json"
+AUDIO_SUFFIXES = (".wav", ".flac", ".mp3", ".ogg")
+
+
+def _file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _voice_key(file_digest, params, dtype):
+    # the rows depend on the build settings too, a bank rebuilt with others gets new cache keys
+    settings = json.dumps({"params": params, "dtype": dtype}, sort_keys=True)
+    return hashlib.sha256((file_digest + settings).encode()).hexdigest()
+
+
+class VoiceBank:
+    """Read side of a bank directory, rows are mapped, not loaded."""
+
+    def __init__(self, directory):
+        with open(os.path.join(directory, INDEX_FILE)) as f:
+            self.index = json.load(f)
+        self.gpt_shape = tuple(self.index["gpt_shape"])
+        self.speaker_shape = tuple(self.index["speaker_shape"])
+        self._gpt_size = int(np.prod(self.gpt_shape))
+        self.voices = self.index["voices"]
+        self._rows = np.memmap(
+            os.path.join(directory, self.index["data"]),
+            dtype=self.index["dtype"],
+            mode="r",
+            shape=(self.index["rows"], self._gpt_size + int(np.prod(self.speaker_shape))),
+        )
+
+    def __contains__(self, voice_id):
+        return voice_id in self.voices
+
+    def ids(self):
+        return sorted(self.voices)
+
+    def file_digest(self, voice_id):
+        return self.voices[voice_id]["digest"]
+
+    def digest(self, voice_id):
+        # stands in for the reference audio hash in result and script cache keys; banks built
+        # before the key was stored get it computed from their index
+        voice = self.voices[voice_id]
+        return voice.get("key") or _voice_key(voice["digest"], self.index.get("params"), self.index["dtype"])
+
+    def get(self, voice_id, device="cpu"):
+        """Returns (gpt_cond_latent, speaker_embedding) as float32 tensors."""
+        # a copy, the tensors must not point into the read-only map
+        row = np.array(self._rows[self.voices[voice_id]["row"]], dtype=np.float32)
+        gpt_cond_latent = torch.from_numpy(row[: self._gpt_size].reshape(self.gpt_shape))
+        speaker_embedding = torch.from_numpy(row[self._gpt_size :].reshape(self.speaker_shape))
+        return gpt_cond_latent.to(device), speaker_embedding.to(device)
+
+
+def build_voice_bank(
+    model,
+    reference_dir,
+    bank_dir,
+    workers=4,
+    cleanup=False,
+    half=False,
+    gpt_cond_len=30,
+    gpt_cond_chunk_len=4,
+    max_ref_length=60,
+):
+    """Writes or updates the bank in bank_dir from the audio files in reference_dir.
+
+    Returns the number of voices (re)computed."""
+    params = {
+        "gpt_cond_len": gpt_cond_len,
+        "gpt_cond_chunk_len": gpt_cond_chunk_len,
+        "max_ref_length": max_ref_length,
+        "cleanup": cleanup,
+    }
+    dtype = "float16" if half else "float32"
+    sources = {
+        os.path.splitext(name)[0]: os.path.join(reference_dir, name)
+        for name in sorted(os.listdir(reference_dir))
+        if name.lower().endswith(AUDIO_SUFFIXES)
+    }
+
+    old = None
+    if os.path.exists(os.path.join(bank_dir, INDEX_FILE)):
+        old = VoiceBank(bank_dir)
+        if old.index.get("params") != params or old.index["dtype"] != dtype:
+            old = None
+
+    if not sources:
+        raise ValueError(f"No reference audio found in {reference_dir}")
+    digests = {voice_id: _file_digest(path) for voice_id, path in sources.items()}
+    todo = [
+        voice_id
+        for voice_id in sources
+        if old is None or voice_id not in old or old.file_digest(voice_id) != digests[voice_id]
+    ]
+
+    def compute(voice_id):
+        audio = load_reference_audio(sources[voice_id], LOAD_SR, max_seconds=max_ref_length)
+        if cleanup:
+            audio = cleanup_reference_audio(audio, LOAD_SR)
+        gpt_cond_latent, speaker_embedding = compute_conditioning_latents(
+            model, audio, LOAD_SR, gpt_cond_len, gpt_cond_chunk_len, max_ref_length
+        )
+        return gpt_cond_latent.cpu().float().numpy(), speaker_embedding.cpu().float().numpy()
+
+    # decoding, resampling and the encoders release the GIL, so threads overlap them
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        computed = dict(zip(todo, pool.map(compute, todo)))
+
+    if computed:
+        first_gpt, first_speaker = next(iter(computed.values()))
+        gpt_shape, speaker_shape = first_gpt.shape, first_speaker.shape
+    else:
+        gpt_shape, speaker_shape = old.gpt_shape, old.speaker_shape
+
+    os.makedirs(bank_dir, exist_ok=True)
+    # a new data file per run, the index switches to it in one rename
+    data_file = f"latents-{uuid.uuid4().hex[:12]}.bin"
+    gpt_size = int(np.prod(gpt_shape))
+    rows = np.memmap(
+        os.path.join(bank_dir, data_file),
+        dtype=dtype,
+        mode="w+",
+        shape=(len(sources), gpt_size + int(np.prod(speaker_shape))),
+    )
+    voices = {}
+    for row, voice_id in enumerate(sources):
+        if voice_id in computed:
+            gpt_cond_latent, speaker_embedding = computed[voice_id]
+            rows[row, :gpt_size] = gpt_cond_latent.reshape(-1)
+            rows[row, gpt_size:] = speaker_embedding.reshape(-1)
+        else:
+            rows[row] = old._rows[old.voices[voice_id]["row"]]
+        voices[voice_id] = {
+            "row": row,
+            "source": os.path.basename(sources[voice_id]),
+            "digest": digests[voice_id],
+            "key": _voice_key(digests[voice_id], params, dtype),
+        }
+    rows.flush()
+    del rows
+
+    index = {
+        "data": data_file,
+        "dtype": dtype,
+        "rows": len(sources),
+        "gpt_shape": list(gpt_shape),
+        "speaker_shape": list(speaker_shape),
+        "params": params,
+        "voices": voices,
+    }
+    with open(os.path.join(bank_dir, INDEX_FILE + ".tmp"), "w") as f:
+        json.dump(index, f, indent=1)
+    os.replace(os.path.join(bank_dir, INDEX_FILE + ".tmp"), os.path.join(bank_dir, INDEX_FILE))
+    # readers that still map the previous file keep it until they close it
+    for name in os.listdir(bank_dir):
+        if name.startswith("latents-") and name != data_file:
+            os.remove(os.path.join(bank_dir, name))
+    return len(computed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or update a voice bank from a directory of references")
+    parser.add_argument("reference_dir")
+    parser.add_argument("bank_dir")
+    parser.add_argument("--workers", type=int, default=4, help="files processed in parallel")
+    parser.add_argument("--cleanup", action="store_true", help="apply the reference cleanup filter first")
+    parser.add_argument("--half", action="store_true", help="store float16 rows, half the size")
+    parser.add_argument("--stub", action="store_true", help="use the CPU stub model, for testing")
+    args = parser.parse_args()
+
+    if args.stub:
+        from stub_model import StubXtts
+
+        model = StubXtts()
+    else:
+        from device import select_device
+        from startup import ensure_model, load_model
+
+        model, _ = load_model(ensure_model("tts_models/multilingual/multi-dataset/xtts_v2"), select_device())
+    updated = build_voice_bank(
+        model, args.reference_dir, args.bank_dir, workers=args.workers, cleanup=args.cleanup, half=args.half
+    )
+    print(f"Voice bank {args.bank_dir}: {updated} voices computed")
+
+
+if __name__ == "__main__":
+    main()
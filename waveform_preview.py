@@ -0,0 +1,43 @@
+"""Cheap waveform previews computed from the in-memory waveform.
+
+Instead of encoding a video with gr.make_waveform on every request, the
+waveform is reduced to per-column peak and RMS envelopes which are
+rasterized into a small static image."""
+import numpy as np
+
+PREVIEW_WIDTH = 600
+PREVIEW_HEIGHT = 120
+# same palette as gr.make_waveform
+BACKGROUND_COLOR = (0xF3, 0xF4, 0xF6)
+PEAK_COLOR = (0xF9, 0x73, 0x16)
+RMS_COLOR = (0xC2, 0x41, 0x0C)
+
+
+def envelope(wav, bins):
+    """Peak and RMS amplitude of wav split into (at most) bins equal frames."""
+    wav = np.asarray(wav, dtype=np.float32).reshape(-1)
+    bins = min(bins, wav.shape[0])
+    if bins == 0:
+        return np.zeros(0, dtype=np.float32), np.zeros(0, dtype=np.float32)
+    # the remainder (fewer than bins samples) is dropped
+    frames = wav[: wav.shape[0] // bins * bins].reshape(bins, -1)
+    peaks = np.abs(frames).max(axis=1)
+    rms = np.sqrt(np.square(frames).mean(axis=1))
+    return peaks, rms
+
+
+def render_preview(wav, width=PREVIEW_WIDTH, height=PREVIEW_HEIGHT):
+    """RGB uint8 image of the waveform, peaks with the RMS drawn on top."""
+    peaks, rms = envelope(wav, width)
+    image = np.empty((height, max(len(peaks), 1), 3), dtype=np.uint8)
+    image[:] = BACKGROUND_COLOR
+    if len(peaks) == 0:
+        return image
+    half = height / 2
+    scale = half / max(float(peaks.max()), 1e-6)
+    # distance of every row from the centre line, compared with each column's envelope
+    distance = np.abs(np.arange(height) + 0.5 - half)[:, None]
+    image[distance <= peaks[None, :] * scale] = PEAK_COLOR
+    image[distance <= rms[None, :] * scale] = RMS_COLOR
+    return image
+
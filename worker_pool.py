@@ -0,0 +1,275 @@
+"""Multi-process CPU inference sharing memory-mapped weights.
+
+The checkpoint loaded by load_checkpoint is exported once as a state dict
+that torch.load can memory-map. Every worker process maps that file and
+assigns the mapped tensors to its model instead of copying them, so the
+weights live once in the page cache however many workers run and each
+worker only adds its activations.
+
+WorkerPool implements the Xtts methods SynthesisPipeline uses and hands
+each call to an idle worker, so the pipeline runs on it unchanged."""
+import os
+import pickle
+import queue
+import subprocess
+import sys
+import threading
+import time
+import traceback
+from multiprocessing.connection import Client, Listener, wait
+
+import torch
+
+from startup import MODEL_FILES, files_fingerprint, is_step_done, load_model, mark_step_done
+from text_frontend import CachedTokenizer
+
+MMAP_CHECKPOINT = "model.mmap.pt"
+# what the connection raises once the worker process on the other end is gone
+WORKER_LOST = (EOFError, OSError)
+# seconds a new worker process gets to import its modules and connect back
+CONNECT_TIMEOUT = 120
+
+
+def export_mmap_checkpoint(model_path):
+    """Writes the loaded model's state dict next to the checkpoint, once per checkpoint."""
+    mmap_path = os.path.join(model_path, MMAP_CHECKPOINT)
+    fingerprint = files_fingerprint([os.path.join(model_path, name) for name in MODEL_FILES])
+    step = "mmap-checkpoint:" + model_path
+    if os.path.exists(mmap_path) and is_step_done(step, fingerprint):
+        return mmap_path
+    model, _ = load_model(model_path, device="cpu")
+    tmp_path = mmap_path + ".tmp"
+    # tensors shared between modules (gpt and gpt_inference) are stored once
+    torch.save(model.state_dict(), tmp_path)
+    os.replace(tmp_path, mmap_path)
+    mark_step_done(step, fingerprint)
+    return mmap_path
+
+
+def load_mmap_model(model_path, mmap_path):
+    """An eval-mode Xtts on CPU whose weights are views of the mapped file."""
+    from TTS.tts.configs.xtts_config import XttsConfig
+    from TTS.tts.layers.xtts.tokenizer import VoiceBpeTokenizer
+    from TTS.tts.models.xtts import Xtts
+
+    config = XttsConfig()
+    config.load_json(os.path.join(model_path, "config.json"))
+    model = Xtts.init_from_config(config)
+    model.tokenizer = VoiceBpeTokenizer(vocab_file=os.path.join(model_path, "vocab.json"))
+    model.init_models()
+    # what load_checkpoint(eval=True) sets up, so the exported keys match
+    model.gpt.init_gpt_for_inference(kv_cache=model.args.kv_cache, use_deepspeed=False)
+    state_dict = torch.load(mmap_path, map_location="cpu", mmap=True, weights_only=True)
+    model.load_state_dict(state_dict, assign=True)
+    model.hifigan_decoder.eval()
+    model.gpt.eval()
+    return model, config
+
+
+def _send(conn, message):
+    # plain pickle: torch makes Connection.send pass tensors as shared memory handles,
+    # which only works between processes started by multiprocessing
+    conn.send_bytes(pickle.dumps(message, protocol=pickle.HIGHEST_PROTOCOL))
+
+
+def _recv(conn):
+    return pickle.loads(conn.recv_bytes())
+
+
+def _worker_main(address, model_path, mmap_path, threads):
+    conn = Client(address, authkey=bytes.fromhex(os.environ["XTTS_WORKER_AUTHKEY"]))
+    torch.set_num_threads(threads)
+    model, _ = load_mmap_model(model_path, mmap_path)
+    # tokenization happens here, so each worker keeps its own front-end cache
+    model.tokenizer = CachedTokenizer(model.tokenizer)
+    _send(conn, ("ready", None))
+    while True:
+        message = _recv(conn)
+        if message is None:
+            return
+        method, args, kwargs = message
+        try:
+            with torch.inference_mode():
+                if method == "inference_stream":
+                    for chunk in model.inference_stream(*args, **kwargs):
+                        _send(conn, ("chunk", chunk))
+                    _send(conn, ("done", None))
+                else:
+                    _send(conn, ("result", getattr(model, method)(*args, **kwargs)))
+        except Exception as e:
+            traceback.print_exc()
+            # the exception type may not be importable in the parent
+            _send(conn, ("error", f"{type(e).__name__}: {e}"))
+
+
+class _Worker:
+    def __init__(self, listener, authkey, model_path, mmap_path, threads):
+        # a fresh interpreter running this file; multiprocessing's spawn would re-run app.py in it
+        self.process = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), listener.address, model_path, mmap_path, str(threads)],
+            env={**os.environ, "XTTS_WORKER_AUTHKEY": authkey.hex()},
+        )
+        self.conn = self._accept(listener)
+
+    def _accept(self, listener, timeout=CONNECT_TIMEOUT):
+        # accept() would wait forever for a process that died before connecting
+        deadline = time.monotonic() + timeout
+        # the listening socket turns readable once a client connects
+        while not wait([listener._listener._socket], timeout=1.0):
+            if self.process.poll() is not None:
+                raise RuntimeError(f"Worker process exited with code {self.process.returncode} before connecting")
+            if time.monotonic() > deadline:
+                self.process.kill()
+                raise RuntimeError(f"Worker process did not connect within {timeout} seconds")
+        return listener.accept()
+
+    def wait_ready(self):
+        try:
+            status, _ = _recv(self.conn)
+        except WORKER_LOST:
+            raise RuntimeError(f"Worker process exited with code {self.process.wait()} while loading the model")
+        if status != "ready":
+            raise RuntimeError(f"Worker process sent {status!r} instead of ready")
+
+    def kill(self):
+        self.conn.close()
+        self.process.kill()
+        self.process.wait()
+
+    def call(self, method, args, kwargs):
+        _send(self.conn, (method, args, kwargs))
+        while True:
+            status, value = _recv(self.conn)
+            if status == "error":
+                raise RuntimeError(value)
+            if status in ("result", "done"):
+                yield status, value
+                return
+            yield status, value
+
+
+class WorkerPool:
+    """N worker processes behind a dispatcher that hands each call to an idle worker.
+
+    Use `lock` as the pipeline lock: it admits one caller per worker."""
+
+    device = torch.device("cpu")
+
+    def __init__(self, model_path, mmap_path, workers=2, threads_per_worker=None):
+        from TTS.tts.layers.xtts.tokenizer import VoiceBpeTokenizer
+
+        threads_per_worker = threads_per_worker or max(1, (os.cpu_count() or 1) // workers)
+        authkey = os.urandom(32)
+        # kept open to spawn replacements for workers that die
+        self._listener = Listener(authkey=authkey)
+        self._spawn_args = (self._listener, authkey, model_path, mmap_path, threads_per_worker)
+        self._spawn_lock = threading.Lock()
+        self.workers = []
+        try:
+            for _ in range(workers):
+                self.workers.append(_Worker(*self._spawn_args))
+            # the workers load in parallel
+            for worker in self.workers:
+                worker.wait_ready()
+        except BaseException:
+            for worker in self.workers:
+                worker.kill()
+            self._listener.close()
+            raise
+        self._idle = queue.Queue()
+        for worker in self.workers:
+            self._idle.put(worker)
+        self.lock = threading.BoundedSemaphore(workers)
+        # the pipeline reads char_limits from it, encoding happens in the workers
+        self.tokenizer = VoiceBpeTokenizer(vocab_file=os.path.join(model_path, "vocab.json"))
+
+    def _give_back(self, worker, alive):
+        if alive:
+            self._idle.put(worker)
+        else:
+            # never hand out a dead worker again, its replacement goes idle once it has loaded
+            threading.Thread(target=self._respawn, args=(worker,), daemon=True).start()
+
+    def _respawn(self, dead):
+        self.workers.remove(dead)
+        dead.kill()
+        worker = None
+        try:
+            with self._spawn_lock:
+                worker = _Worker(*self._spawn_args)
+            worker.wait_ready()
+        except (RuntimeError, *WORKER_LOST):
+            if worker is not None:
+                worker.kill()
+            traceback.print_exc()
+            print("Could not replace a dead worker, the pool runs with one less")
+            return
+        self.workers.append(worker)
+        self._idle.put(worker)
+
+    def _call(self, method, *args, **kwargs):
+        worker = self._idle.get()
+        alive = True
+        try:
+            for _, value in worker.call(method, args, kwargs):
+                return value
+        except WORKER_LOST:
+            alive = False
+            raise
+        finally:
+            self._give_back(worker, alive)
+
+    def get_speaker_embedding(self, audio, sr):
+        return self._call("get_speaker_embedding", audio.cpu(), sr)
+
+    def get_gpt_cond_latents(self, audio, sr, **kwargs):
+        return self._call("get_gpt_cond_latents", audio.cpu(), sr, **kwargs)
+
+    def inference(self, *args, **kwargs):
+        return self._call("inference", *args, **kwargs)
+
+    def inference_stream(self, *args, **kwargs):
+        worker = self._idle.get()
+        chunks = worker.call("inference_stream", args, kwargs)
+        alive = True
+        try:
+            for status, value in chunks:
+                if status == "chunk":
+                    yield value
+        except WORKER_LOST:
+            alive = False
+            raise
+        finally:
+            # a consumer that stopped early leaves chunks in flight, the worker is reusable once they are read
+            if alive:
+                try:
+                    for _ in chunks:
+                        pass
+                except RuntimeError:
+                    pass
+                except WORKER_LOST:
+                    alive = False
+            self._give_back(worker, alive)
+
+    def close(self):
+        for worker in self.workers:
+            _send(worker.conn, None)
+        for worker in self.workers:
+            worker.process.wait(timeout=10)
+        self._listener.close()
+
+
+def load_worker_pool(model_path, device="cpu", quantize=False, workers=2):
+    """Startup loader for the worker pool, returns (pool, config) like load_model."""
+    from TTS.tts.configs.xtts_config import XttsConfig
+
+    if device != "cpu" or quantize:
+        print("Worker pool runs unquantized on CPU, ignoring device/quantization settings")
+    mmap_path = export_mmap_checkpoint(model_path)
+    config = XttsConfig()
+    config.load_json(os.path.join(model_path, "config.json"))
+    return WorkerPool(model_path, mmap_path, workers=workers), config
+
+
+if __name__ == "__main__":
+    _worker_main(sys.argv[1], sys.argv[2], sys.argv[3], int(sys.argv[4]))